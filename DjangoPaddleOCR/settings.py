@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import json
+import os
 from pathlib import Path
 
+from .database import parse_database_url
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,11 +45,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'parser_app.metrics.metrics_middleware',
+    'parser_app.admission.ratelimit_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'parser_app.profiling.profiling_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,11 +81,15 @@ WSGI_APPLICATION = 'DjangoPaddleOCR.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# 由 DATABASE_URL 决定（见 DjangoPaddleOCR/database.py），默认使用项目根目录下的 SQLite
+# PostgreSQL 需要安装 psycopg；DATABASE_POOL=1 使用连接池（需要 psycopg[pool]），否则按 DATABASE_CONN_MAX_AGE 保持持久连接
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': parse_database_url(
+        os.environ.get('DATABASE_URL', 'sqlite:///db.sqlite3'),
+        BASE_DIR,
+        conn_max_age=int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        pool=os.environ.get('DATABASE_POOL', '') == '1',
+    ),
 }
 
 
@@ -118,8 +129,6 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
-import os
-
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
@@ -128,6 +137,205 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 媒体存储后端：local（本地磁盘 MEDIA_ROOT）或 s3（S3兼容对象存储，需要安装 boto3）
+# 路径布局见 parser_app/storage.py
+MEDIA_STORAGE_BACKEND = os.environ.get('MEDIA_STORAGE_BACKEND', 'local')
+
+if MEDIA_STORAGE_BACKEND == 's3':
+    MEDIA_STORAGE = {
+        'BACKEND': 'parser_app.storage.S3MediaStorage',
+        'OPTIONS': {
+            'bucket_name': os.environ.get('MEDIA_S3_BUCKET'),
+            'endpoint_url': os.environ.get('MEDIA_S3_ENDPOINT_URL'),
+            'access_key': os.environ.get('MEDIA_S3_ACCESS_KEY'),
+            'secret_key': os.environ.get('MEDIA_S3_SECRET_KEY'),
+            'region_name': os.environ.get('MEDIA_S3_REGION'),
+            'location': os.environ.get('MEDIA_S3_LOCATION', ''),
+            'custom_domain': os.environ.get('MEDIA_S3_CUSTOM_DOMAIN'),
+            'querystring_auth': os.environ.get('MEDIA_S3_QUERYSTRING_AUTH', '') == '1',
+        },
+    }
+else:
+    MEDIA_STORAGE = {
+        'BACKEND': 'parser_app.storage.LocalMediaStorage',
+    }
+
+# 媒体文件下发：设置为nginx internal location的前缀（如 /protected-media/）时
+# 使用 X-Accel-Redirect 交给nginx发送；留空则由Django直接返回（支持Range，适合开发环境）
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+
+# 记录的访问控制（媒体文件、详情页、进度接口与历史列表，见 parser_app/media_serving.py）：
+# public 不检查；owner 只允许管理员、上传者（与记录的 client_key 相同，即同一IP或同一 API 密钥）以及带有效签名的链接。
+# 兼容旧的 MEDIA_ACCESS_REQUIRES_LOGIN=1，视为 owner
+MEDIA_ACCESS = os.environ.get('MEDIA_ACCESS', 'owner' if os.environ.get('MEDIA_ACCESS_REQUIRES_LOGIN') == '1' else 'public')
+# API 返回的带签名文件链接的有效期（秒）
+MEDIA_LINK_MAX_AGE = int(os.environ.get('MEDIA_LINK_MAX_AGE', 86400))
+
+# 归档与还原（见 parser_app/retention.py）：archive_records 默认归档多少天前的记录；
+# 查看已归档记录时解压到 MEDIA_ROOT 下的还原缓存目录，按最近访问淘汰，总大小不超过上限（字节）
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 90))
+REHYDRATION_CACHE_PREFIX = 'rehydrated'
+REHYDRATION_CACHE_MAX_BYTES = int(os.environ.get('REHYDRATION_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+STORAGES = {
+    'default': MEDIA_STORAGE,
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # 文件上传大小限制（10MB）
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
-FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760
\ No newline at end of file
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760
+# 上传与解析视图（streaming_uploads）的文件边接收边落盘，同时计算哈希、识别类型，见 parser_app/upload_handlers.py
+
+# 解析结果正文的压缩编码（见 parser_app/fields.py）：zlib、zstd（需要 zstandard）或 none；只影响新写入的行
+TEXT_COMPRESSION = os.environ.get('TEXT_COMPRESSION', 'zlib')
+
+# 缓存配置（详情页整页缓存）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'parser-app',
+    },
+    # 限流状态必须在各 worker 之间共享：默认使用本机文件缓存，多台主机时设置 RATELIMIT_REDIS_URL
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['RATELIMIT_REDIS_URL'],
+    } if os.environ.get('RATELIMIT_REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('RATELIMIT_CACHE_DIR', '/tmp/django_paddle_ocr_ratelimit'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# 详情页缓存时间（秒）；键中带有记录修改时间，记录变化后旧缓存不会再被命中
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# 布局解析服务
+LAYOUT_PARSING_API_URL = os.environ.get('LAYOUT_PARSING_API_URL', 'http://60590ca1.r20.cpolar.top/layout-parsing')
+LAYOUT_PARSING_TIMEOUT = 120  # 秒
+# 多个解析服务实例（见 parser_app/parser_pool.py）：JSON 列表，每项 {"url": ..., "weight": 2, "name": ...,
+# "health_url": ..., "file_mode": "url"}，未设置时只有 LAYOUT_PARSING_API_URL 一个。
+# 路由方式 least_outstanding（进行中请求数/权重最小）或 weighted（加权轮询）；
+# 连续失败 LAYOUT_PARSING_EJECT_FAILURES 次摘除 LAYOUT_PARSING_EJECT_SECONDS 秒；
+# 多个后端时每 LAYOUT_PARSING_HEALTH_INTERVAL 秒主动探测健康检查地址（0 为不探测）
+LAYOUT_PARSING_BACKENDS = json.loads(os.environ.get('LAYOUT_PARSING_BACKENDS') or '[]')
+LAYOUT_PARSING_ROUTING = os.environ.get('LAYOUT_PARSING_ROUTING', 'least_outstanding')
+LAYOUT_PARSING_EJECT_FAILURES = int(os.environ.get('LAYOUT_PARSING_EJECT_FAILURES', 3))
+LAYOUT_PARSING_EJECT_SECONDS = int(os.environ.get('LAYOUT_PARSING_EJECT_SECONDS', 30))
+LAYOUT_PARSING_HEALTH_INTERVAL = int(os.environ.get('LAYOUT_PARSING_HEALTH_INTERVAL', 10))
+# 到解析服务的连接池大小（同步 requests.Session 与异步 httpx.AsyncClient 共用此配置）
+LAYOUT_PARSING_MAX_CONNECTIONS = int(os.environ.get('LAYOUT_PARSING_MAX_CONNECTIONS', 200))
+# 解析服务获取图片的方式（各后端可用 file_mode 单独设置）：inline 把图片 base64 内联在请求体中；url 只发送短期有效的签名地址，由解析服务下载
+# （解析服务与本服务在同一主机或内网时省去编码与传输）。LAYOUT_PARSING_FILE_BASE_URL 为解析服务访问本服务的地址，
+# 如 http://nginx，经 nginx 时文件由 X-Accel-Redirect 发送；签名地址的有效期为 LAYOUT_PARSING_FILE_URL_MAX_AGE 秒
+LAYOUT_PARSING_FILE_MODE = os.environ.get('LAYOUT_PARSING_FILE_MODE', 'inline')
+LAYOUT_PARSING_FILE_BASE_URL = os.environ.get('LAYOUT_PARSING_FILE_BASE_URL', '')
+LAYOUT_PARSING_FILE_URL_MAX_AGE = int(os.environ.get('LAYOUT_PARSING_FILE_URL_MAX_AGE', 300))
+
+# 使用异步视图处理 /upload/ 与 /api/parse/（需要以ASGI方式运行，如 uvicorn）
+ASYNC_INGESTION = os.environ.get('ASYNC_INGESTION', '') == '1'
+
+# 分块上传（见 parser_app/uploads.py）：未完成文件的目录（所有 worker 须共享）、单个文件上限、
+# 每块上限（需小于 nginx 的 client_max_body_size）、会话空闲多久后过期（小时）
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', os.path.join(BASE_DIR, 'upload_sessions'))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', 200 * 1024 * 1024))
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+CHUNKED_UPLOAD_EXPIRE_HOURS = int(os.environ.get('CHUNKED_UPLOAD_EXPIRE_HOURS', 24))
+
+# /api/v1/ 结果分页（见 parser_app/api.py）：默认与最大每页条数
+API_RESULTS_PAGE_SIZE = int(os.environ.get('API_RESULTS_PAGE_SIZE', 10))
+API_RESULTS_MAX_PAGE_SIZE = 100
+
+# 准入控制（见 parser_app/admission.py）
+# 按路由名限流：rate 为 次数/时间单位(s/m/h/d)，burst 为允许的突发请求数；未列出的路由不限流
+RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+RATELIMIT_CACHE = 'ratelimit'
+RATELIMIT_RULES = {
+    'upload_image': {'rate': os.environ.get('RATELIMIT_UPLOAD_RATE', '30/m'), 'burst': 10},
+    'api_parse': {'rate': os.environ.get('RATELIMIT_API_PARSE_RATE', '30/m'), 'burst': 10},
+    'api_v1_parse': {'rate': os.environ.get('RATELIMIT_API_PARSE_RATE', '30/m'), 'burst': 10},
+    'api_v1_job': {'rate': '120/m', 'burst': 30},
+    'api_v1_blocks': {'rate': '60/m', 'burst': 10},
+    'api_v1_uploads': {'rate': os.environ.get('RATELIMIT_API_PARSE_RATE', '30/m'), 'burst': 10},
+    'upload_progress': {'rate': '120/m', 'burst': 30},
+    'upload_events': {'rate': '30/m', 'burst': 10},
+}
+# 按密钥而不是IP限流的 API 密钥（请求头 X-API-Key），逗号分隔
+RATELIMIT_API_KEYS = [key for key in os.environ.get('RATELIMIT_API_KEYS', '').split(',') if key]
+# 在反向代理之后时读取客户端IP的请求头（nginx 设置 X-Real-IP，对应 HTTP_X_REAL_IP），为空则使用 REMOTE_ADDR
+CLIENT_IP_HEADER = os.environ.get('CLIENT_IP_HEADER', '')
+# 本机所有 worker 同时进行的解析数上限（0 为不限制），超出时同步请求返回 429，后台解析排队等待
+PARSER_MAX_IN_FLIGHT = int(os.environ.get('PARSER_MAX_IN_FLIGHT', 16))
+PARSER_SLOT_DIR = os.environ.get('PARSER_SLOT_DIR', '/tmp/django_paddle_ocr_parser_slots')
+PARSER_BUSY_RETRY_AFTER = 5  # 秒
+
+# 后台解析线程数（/upload/ 增量模式下使用）
+BACKGROUND_PARSE_WORKERS = int(os.environ.get('BACKGROUND_PARSE_WORKERS', 4))
+# 后台解析调度（见 parser_app/scheduler.py）：空闲时检查队列的间隔；排队每满多少秒提升一级优先级
+SCHEDULER_POLL_INTERVAL = 1.0
+SCHEDULER_AGING_SECONDS = int(os.environ.get('SCHEDULER_AGING_SECONDS', 120))
+# 处理中记录的租约（见 parser_app/leases.py）：租约时长、心跳与回收间隔（秒）、最多处理次数
+PARSE_LEASE_SECONDS = int(os.environ.get('PARSE_LEASE_SECONDS', 60))
+PARSE_HEARTBEAT_INTERVAL = PARSE_LEASE_SECONDS / 4
+PARSE_MAX_ATTEMPTS = int(os.environ.get('PARSE_MAX_ATTEMPTS', 3))
+
+# 近似重复上传（见 parser_app/similarity.py）：off 不检查，offer 返回 409 与近似记录，reuse 直接复用已有结果；
+# 请求字段 near_duplicate 可覆盖。哈希为64位，汉明距离不超过 NEAR_DUPLICATE_MAX_DISTANCE 视为同一页
+NEAR_DUPLICATE_MODE = os.environ.get('NEAR_DUPLICATE_MODE', 'off')
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', 6))
+SIMILARITY_INDEX_PATH = os.environ.get('SIMILARITY_INDEX_PATH', os.path.join(BASE_DIR, 'similarity', 'index.pickle'))
+
+# 上传进度推送：数据库轮询间隔、SSE连接最长保持时间、长轮询最长等待时间（秒）
+PROGRESS_POLL_INTERVAL = 0.5
+PROGRESS_STREAM_TIMEOUT = 300
+PROGRESS_LONG_POLL_TIMEOUT = 25
+# WSGI worker 能否挂起 SSE 与长轮询请求；gunicorn.conf.py 按实际的 worker 类型设置（单线程 sync worker 为 0）。
+# 不能时页面按 PROGRESS_SHORT_POLL_INTERVAL 秒短轮询进度
+PROGRESS_STREAMING = os.environ.get('PROGRESS_STREAMING', '1') == '1'
+PROGRESS_SHORT_POLL_INTERVAL = 2
+
+# Prometheus 指标：/metrics 的访问令牌（为空则不校验，建议在nginx层限制来源）
+# 多个 gunicorn worker 时需设置环境变量 PROMETHEUS_MULTIPROC_DIR（见 gunicorn.conf.py）
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN', '')
+
+# 请求剖析：开启后员工用户可通过 X-Profile 请求头或 ?_profile= 参数获取 Server-Timing，
+# 取值 cprofile 时把 cProfile 结果写入 PROFILING_OUTPUT_DIR（见 parser_app/profiling.py）
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILING_OUTPUT_DIR = os.environ.get('PROFILING_OUTPUT_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+# 链路追踪：导出到本地 JSONL 文件，管理后台"最慢链路"页面读取该文件（见 parser_app/tracing.py）
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '1') == '1'
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', 1.0))
+TRACING_EXPORT_PATH = os.environ.get('TRACING_EXPORT_PATH', os.path.join(BASE_DIR, 'traces', 'traces.jsonl'))
+TRACING_MAX_BYTES = 50 * 1024 * 1024  # 超过后轮转为 traces.jsonl.1
+TRACING_ADMIN_SCAN_BYTES = 5 * 1024 * 1024  # 管理页面只读取文件末尾这么多字节
+
+# 日志：每条记录带上当前链路的 trace_id
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'trace_id': {'()': 'parser_app.tracing.TraceIdFilter'},
+    },
+    'formatters': {
+        'default': {
+            'format': '%(asctime)s %(levelname)s [trace=%(trace_id)s] %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['trace_id'],
+            'formatter': 'default',
+        },
+    },
+    'loggers': {
+        'parser_app': {
+            'handlers': ['console'],
+            'level': os.environ.get('PARSER_APP_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
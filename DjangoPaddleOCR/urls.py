@@ -24,6 +24,6 @@ urlpatterns = [
     path('', include('parser_app.urls')),
 ]
 
+# 媒体文件经 parser_app 的 record_file 视图鉴权后下发，不再直接暴露 MEDIA_ROOT
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
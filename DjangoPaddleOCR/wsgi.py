@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoPaddleOCR.settings')
 
 application = get_wsgi_application()
+
+# 每个 worker 进程启动后台解析的调度线程，接手队列中（包括其他进程提交）的记录
+from parser_app.background import start_dispatcher  # noqa: E402
+
+start_dispatcher()
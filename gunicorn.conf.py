@@ -0,0 +1,44 @@
+# gunicorn.conf.py
+"""gunicorn 配置：worker 类型与 Prometheus 多进程指标
+
+上传进度的 SSE 连接最长保持 PROGRESS_STREAM_TIMEOUT（300秒），长轮询最长 25 秒，等待期间占用一个线程。
+默认的 sync worker 每个连接独占整个进程，几个打开的页面就会占满所有 worker，并被 30 秒的 WORKER TIMEOUT 掐断，
+因此使用 gthread：每个 worker GUNICORN_THREADS 个线程，超时时间大于 SSE 连接的最长时间。
+仍以单线程的 sync worker 运行时（如 -k sync），post_fork 设置 PROGRESS_STREAMING=0，进度改为短轮询（见 parser_app/progress.py）。
+
+每个 worker 把指标写到 PROMETHEUS_MULTIPROC_DIR 下的文件中，/metrics 汇总整个目录。
+环境变量必须在 worker 导入 prometheus_client 之前设置，因此放在这里而不是 settings.py。
+"""
+import os
+import shutil
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# 比 SSE 连接的最长时间（300秒）多留一分钟
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 360))
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+
+
+def on_starting(server):
+    # 清掉上一次运行留下的数据，否则计数器会从旧值继续累加
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # 在 worker 加载 Django 配置之前，按实际生效的 worker 类型（命令行 -k/--threads 可能覆盖上面的默认值）决定
+    from gunicorn.workers.sync import SyncWorker
+
+    single_threaded = isinstance(worker, SyncWorker) or worker.cfg.threads <= 1 and type(worker).__name__ == 'ThreadWorker'
+    os.environ['PROGRESS_STREAMING'] = '0' if single_threaded else '1'
+
+
+def child_exit(server, worker):
+    # 已退出 worker 的 livesum/livemax 类指标（进行中的解析、队列长度）不再计入
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,14 +1,22 @@
 # parser_app/admin.py
 from django.contrib import admin
 from .models import ImageUpload, ParseResult
+from .storage import RecordMedia
+from . import leases, retention, tracing
+from .background import wake_dispatcher
+from .ingest import UploadFailed, fail_processing, parse_record
+from datetime import datetime
 from django.utils.html import format_html
-from django.db.models import Count
+from django.db import transaction
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, Min
+from django.db.models.functions import Coalesce
 from django.contrib import messages
 from django.http import HttpResponseRedirect
-import requests
-import base64
-import os
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.conf import settings
+from django.utils import timezone
 
 
 class ParseResultInline(admin.TabularInline):
@@ -58,13 +66,16 @@ class ImageUploadAdmin(admin.ModelAdmin):
     actions = ['mark_as_completed', 'mark_as_failed', 'retry_processing']
 
     list_display = ['id', 'original_filename', 'file_size_display', 'upload_time_display',
-                    'status_display', 'results_count', 'processing_time_display',
-                    'image_preview_link', 'admin_actions']
-    list_filter = ['status', 'upload_time']
+                    'status_display', 'priority', 'results_count', 'queue_wait_display',
+                    'processing_time_display', 'image_preview_link', 'admin_actions']
+    list_filter = ['status', 'priority', 'upload_time']
     search_fields = ['original_filename', 'ip_address', 'error_message']
     readonly_fields = ['id', 'upload_time', 'processing_time', 'ip_address',
-                       'user_agent', 'error_message', 'image_preview',
-                       'file_size_display', 'duration_display', 'results_count_display']
+                       'user_agent', 'sha256', 'error_message', 'image_preview',
+                       'file_size_display', 'duration_display', 'results_count_display',
+                       'client_key', 'page_count', 'queued_at', 'started_at', 'queue_wait',
+                       'attempts', 'lease_owner', 'lease_expires_at', 'heartbeat_at',
+                       'archived_at', 'archive_name', 'reused_from', 'perceptual_hash']
     fieldsets = (
         ('基本信息', {
             'fields': ('id', 'original_filename', 'image', 'image_preview',
@@ -72,10 +83,19 @@ class ImageUploadAdmin(admin.ModelAdmin):
         }),
         ('处理信息', {
             'fields': ('status', 'processing_time', 'duration_display',
-                       'results_count_display', 'error_message')
+                       'results_count_display', 'reused_from', 'error_message')
+        }),
+        ('排队信息', {
+            'fields': ('priority', 'client_key', 'page_count', 'queued_at', 'started_at', 'queue_wait',
+                       'attempts', 'lease_owner', 'lease_expires_at', 'heartbeat_at'),
+            'classes': ('collapse',)
+        }),
+        ('归档信息', {
+            'fields': ('archived_at', 'archive_name'),
+            'classes': ('collapse',)
         }),
         ('系统信息', {
-            'fields': ('ip_address', 'user_agent'),
+            'fields': ('ip_address', 'user_agent', 'sha256', 'perceptual_hash'),
             'classes': ('collapse',)
         }),
     )
@@ -115,7 +135,7 @@ class ImageUploadAdmin(admin.ModelAdmin):
 
     def results_count(self, obj):
         """结果数量"""
-        count = obj.results.count()
+        count = obj.results_total
         color = 'green' if count > 0 else 'gray'
         return format_html(
             '<span style="color: {};">{}</span>',
@@ -124,6 +144,7 @@ class ImageUploadAdmin(admin.ModelAdmin):
         )
 
     results_count.short_description = '结果数量'
+    results_count.admin_order_field = 'results_total'
 
     def processing_time_display(self, obj):
         """处理时间显示"""
@@ -133,12 +154,21 @@ class ImageUploadAdmin(admin.ModelAdmin):
 
     processing_time_display.short_description = '处理时间'
 
+    def queue_wait_display(self, obj):
+        """排队时间显示"""
+        if obj.queue_wait is not None:
+            return f"{obj.queue_wait:.1f}秒"
+        return '-'
+
+    queue_wait_display.short_description = '排队时间'
+    queue_wait_display.admin_order_field = 'queue_wait'
+
     def image_preview_link(self, obj):
         """图片预览链接"""
         if obj.image:
             return format_html(
                 '<a href="{}" target="_blank" style="padding: 2px 8px; background: #417690; color: white; text-decoration: none; border-radius: 3px;">查看图片</a>',
-                obj.image.url
+                RecordMedia(obj).image_url
             )
         return '-'
 
@@ -174,7 +204,7 @@ class ImageUploadAdmin(admin.ModelAdmin):
             try:
                 return format_html(
                     '<img src="{}" style="max-width: 300px; max-height: 200px;" />',
-                    obj.image.url
+                    RecordMedia(obj).image_url
                 )
             except:
                 return '图片路径错误'
@@ -192,44 +222,37 @@ class ImageUploadAdmin(admin.ModelAdmin):
 
     def results_count_display(self, obj):
         """结果数量显示"""
-        count = obj.results.count()
-        return f"{count} 个"
+        return f"{obj.results_total} 个"
 
     results_count_display.short_description = '结果数量'
 
     # 自定义动作方法
     def mark_as_completed(self, request, queryset):
         """标记为已完成"""
-        updated = queryset.update(status='completed')
+        updated = queryset.update(status='completed', updated_at=timezone.now())
         self.message_user(request, f"成功标记 {updated} 条记录为已完成", messages.SUCCESS)
 
     mark_as_completed.short_description = "标记为已完成"
 
     def mark_as_failed(self, request, queryset):
         """标记为失败"""
-        updated = queryset.update(status='failed', error_message='管理员手动标记为失败')
+        updated = queryset.update(status='failed', error_message='管理员手动标记为失败',
+                                   updated_at=timezone.now())
         self.message_user(request, f"成功标记 {updated} 条记录为失败", messages.WARNING)
 
     mark_as_failed.short_description = "标记为失败"
 
     def retry_processing(self, request, queryset):
-        """重新处理选中的记录"""
-        for record in queryset:
-            if record.status in ['failed', 'pending'] and record.image:
-                try:
-                    # 重新处理逻辑
-                    record.status = 'processing'
-                    record.error_message = ''
-                    record.save()
-
-                    # 这里可以调用API重新处理
-                    # self._process_image(record)
-
-                except Exception as e:
-                    self.message_user(request, f"处理记录 {record.id} 时出错: {str(e)}", messages.ERROR)
-                    continue
+        """重新处理选中的记录：以"重新处理"优先级放回后台解析队列"""
+        now = timezone.now()
+        updated = queryset.filter(status__in=['failed', 'pending']).exclude(image='').update(
+            status='pending', priority=ImageUpload.PRIORITY_REPROCESS, error_message='',
+            queued_at=now, started_at=None, queue_wait=None, updated_at=now,
+        )
+        if updated:
+            transaction.on_commit(wake_dispatcher)
 
-        self.message_user(request, f"已开始重新处理 {queryset.count()} 条记录", messages.SUCCESS)
+        self.message_user(request, f"已将 {updated} 条记录加入解析队列", messages.SUCCESS)
 
         # 返回当前页面
         return HttpResponseRedirect(request.get_full_path())
@@ -237,48 +260,126 @@ class ImageUploadAdmin(admin.ModelAdmin):
     retry_processing.short_description = "重新处理"
 
     def _process_image(self, record):
-        """处理图片的内部方法"""
-        # 这里实现实际的图片处理逻辑
-        API_URL = "http://44239ef8.r20.cpolar.top/layout-parsing"
-
+        """同步解析一条记录：与上传、后台解析相同的流程（经过解析服务后端池），失败时记录错误"""
         try:
-            # 读取图片
-            image_path = record.image.path
-            with open(image_path, "rb") as file:
-                image_bytes = file.read()
-                image_data = base64.b64encode(image_bytes).decode("ascii")
-
-            # 调用API
-            payload = {
-                "file": image_data,
-                "fileType": 1,
-            }
-
-            response = requests.post(API_URL, json=payload, timeout=60)
-
-            if response.status_code == 200:
-                record.status = 'completed'
-                record.processing_time = 0  # 可以设置实际的处理时间
-                record.save()
-
-                # 保存解析结果
-                result_data = response.json()
-                # ... 保存结果的逻辑
-
-            else:
-                record.status = 'failed'
-                record.error_message = f"API请求失败: {response.status_code}"
-                record.save()
-
+            with leases.hold(record.id):
+                record.results.all().delete()
+                parse_record(record)
+        except UploadFailed:
+            pass
         except Exception as e:
-            record.status = 'failed'
-            record.error_message = f"处理失败: {str(e)}"
-            record.save()
+            fail_processing(record, e)
+
+    def get_urls(self):
+        urls = [
+            path('traces/', self.admin_site.admin_view(self.traces_view), name='parser_app_imageupload_traces'),
+            path('queue/', self.admin_site.admin_view(self.queue_view), name='parser_app_imageupload_queue'),
+        ]
+        return urls + super().get_urls()
+
+    def traces_view(self, request):
+        """最慢的上传链路（读取 TRACING_EXPORT_PATH）"""
+        context = {
+            **self.admin_site.each_context(request),
+            'title': '最慢链路',
+            'opts': self.model._meta,
+        }
+        trace_id = request.GET.get('trace')
+        if trace_id:
+            segments = [t for t in tracing.read_traces() if t['trace_id'] == trace_id]
+            context.update(trace_id=trace_id, segments=[self._segment_rows(t) for t in segments])
+        else:
+            traces = tracing.read_traces()
+            selected_name = request.GET.get('name', '')
+            context.update(
+                traces=[self._trace_summary(t) for t in tracing.slowest_traces(50, selected_name or None)],
+                names=sorted({t['name'] for t in traces}),
+                selected_name=selected_name,
+                scanned=len(traces),
+                export_path=settings.TRACING_EXPORT_PATH,
+            )
+        return TemplateResponse(request, 'admin/parser_app/traces.html', context)
+
+    def queue_view(self, request):
+        """后台队列：排队情况、处理中记录的租约、租约过期与重试过的记录"""
+        if request.method == 'POST':
+            if not self.has_change_permission(request):
+                raise PermissionDenied
+            requeued, failed = leases.reap()
+            if requeued:
+                transaction.on_commit(wake_dispatcher)
+            self.message_user(request, f"放回队列 {requeued} 条，标记失败 {failed} 条", messages.SUCCESS)
+            return HttpResponseRedirect(request.get_full_path())
+
+        now = timezone.now()
+        priorities = dict(ImageUpload.PRIORITY_CHOICES)
+        pending = [
+            {**row, 'label': priorities[row['priority']], 'oldest_wait': (now - row['oldest']).total_seconds()}
+            for row in ImageUpload.objects.filter(status='pending').values('priority')
+            .annotate(count=Count('id'), oldest=Min(Coalesce('queued_at', 'upload_time'))).order_by('priority')
+        ]
+        fields = ['id', 'original_filename', 'status', 'priority', 'client_key', 'attempts', 'lease_owner',
+                  'lease_expires_at', 'heartbeat_at', 'started_at', 'queue_wait', 'error_message', 'updated_at']
+        processing = list(ImageUpload.objects.filter(status='processing').order_by('lease_expires_at').only(*fields)[:100])
+        for record in processing:
+            record.lease_expired = record.lease_expires_at is not None and record.lease_expires_at < now
+            record.heartbeat_age = (now - record.heartbeat_at).total_seconds() if record.heartbeat_at else None
+        context = {
+            **self.admin_site.each_context(request),
+            'title': '后台队列',
+            'opts': self.model._meta,
+            'pending': pending,
+            'processing': processing,
+            'expired_count': sum(record.lease_expired for record in processing),
+            'retried': ImageUpload.objects.filter(attempts__gt=1).order_by('-updated_at').only(*fields)[:50],
+            'max_attempts': settings.PARSE_MAX_ATTEMPTS,
+        }
+        return TemplateResponse(request, 'admin/parser_app/queue.html', context)
+
+    def _trace_summary(self, trace):
+        children = [s for s in trace['spans'] if s['parent_id'] and s['name'] != trace['name']]
+        slowest = max(children, key=lambda s: s['duration'] or 0, default=None)
+        return {
+            **trace,
+            'started_at': datetime.fromtimestamp(trace['start'], tz=timezone.get_current_timezone()),
+            'duration_ms': (trace['duration'] or 0) * 1000,
+            'slowest_span': {'name': slowest['name'], 'duration_ms': slowest['duration'] * 1000} if slowest else None,
+        }
+
+    def _segment_rows(self, trace):
+        """按父子关系排出的 span 列表，附带缩进与时间线位置"""
+        spans = trace['spans']
+        by_parent = {}
+        for span in spans:
+            by_parent.setdefault(span['parent_id'], []).append(span)
+        ids = {span['span_id'] for span in spans}
+        total = trace['duration'] or 1e-9
+        rows = []
+
+        def walk(span, depth):
+            offset = span['start'] - trace['start']
+            duration = span['duration'] or 0
+            rows.append({
+                **span,
+                'indent': 8 + depth * 16,
+                'offset_ms': offset * 1000,
+                'duration_ms': duration * 1000,
+                'left': max(offset / total * 100, 0),
+                'width': max(duration / total * 100, 0.3),
+            })
+            for child in sorted(by_parent.get(span['span_id'], []), key=lambda s: s['start']):
+                walk(child, depth + 1)
+
+        # 根 span 的 parent_id 为空，或指向另一段（如后台任务指向上传请求）
+        for root in [s for s in spans if s['parent_id'] not in ids]:
+            walk(root, 0)
+        return {**trace, 'duration_ms': trace['duration'] * 1000, 'rows': rows}
 
     def get_queryset(self, request):
         """优化查询"""
         queryset = super().get_queryset(request)
-        queryset = queryset.prefetch_related('results')
+        # 结果数量用聚合查出；不再 prefetch 全部结果（会把 raw_data 等大字段一并读出）
+        queryset = queryset.annotate(results_total=Count('results'))
         return queryset
 
 
@@ -290,7 +391,7 @@ class ParseResultAdmin(admin.ModelAdmin):
     list_display = ['id', 'image_link', 'result_index', 'pruned_result_preview',
                     'markdown_preview', 'output_images_count', 'created_at_display']
     list_filter = ['created_at', 'image__status']
-    search_fields = ['pruned_result', 'markdown_text', 'image__original_filename']
+    search_fields = ['search_index__content', 'image__original_filename']
     readonly_fields = ['id', 'created_at', 'image_link', 'pruned_result_full',
                        'markdown_full', 'raw_data_preview', 'output_images_count']
     fieldsets = (
@@ -370,17 +471,23 @@ class ParseResultAdmin(admin.ModelAdmin):
     markdown_full.short_description = '完整的Markdown'
 
     def raw_data_preview(self, obj):
-        """原始数据预览"""
-        if obj.raw_data:
+        """原始数据预览（已归档的记录从归档中读取）"""
+        raw_data = obj.raw_data
+        if raw_data is None and obj.image.archived_at:
+            try:
+                raw_data = retention.load_raw_data(obj.image).get(obj.result_index)
+            except Exception as e:
+                return f"读取归档失败: {e}"
+        if raw_data:
             import json
             try:
-                formatted = json.dumps(obj.raw_data, indent=2, ensure_ascii=False)
+                formatted = json.dumps(raw_data, indent=2, ensure_ascii=False)
                 return format_html(
                     '<div style="max-height: 400px; overflow-y: auto; padding: 10px; background: #2d2d2d; color: #f8f8f2; border-radius: 4px; font-family: monospace; white-space: pre-wrap;">{}</div>',
                     formatted
                 )
             except:
-                return str(obj.raw_data)[:500] + '...'
+                return str(raw_data)[:500] + '...'
         return '-'
 
     raw_data_preview.short_description = '原始数据'
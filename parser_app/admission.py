@@ -0,0 +1,294 @@
+# parser_app/admission.py
+"""准入控制：按客户端限流与解析服务并发上限
+
+- 限流：令牌桶（以 GCRA 形式实现，每个客户端只需在缓存里存一个时间戳），按路由名在
+  RATELIMIT_RULES 中配置速率与突发量；客户端按 API 密钥（RATELIMIT_API_KEYS 中登记的）或IP区分。
+  状态保存在 RATELIMIT_CACHE 指向的缓存中，必须是各 worker 共享的后端（文件或Redis），
+  不能是进程内的 LocMemCache。读取与写回之间不加锁，同一客户端在同一瞬间打到多个 worker 时
+  最多多放行 worker 数个请求。
+- 并发上限：同一主机上所有 worker 同时进行的解析不超过 PARSER_MAX_IN_FLIGHT，
+  每个名额是 PARSER_SLOT_DIR 下的一个文件锁，进程退出时由操作系统释放，不会泄漏。
+  同步上传与 /api/parse/ 拿不到名额时立即返回 429；后台解析则排队等待。
+
+被拒绝的请求返回 429 与 Retry-After。
+"""
+import asyncio
+import functools
+import hashlib
+import ipaddress
+import math
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：退化为进程内的信号量
+    fcntl = None
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SLOT_POLL_INTERVAL = 0.05
+
+
+def too_many_requests(error, retry_after, reason):
+    """429 响应；reason 区分按客户端限流（rate_limited）与解析名额已满（parser_busy）"""
+    response = JsonResponse({'error': error, 'reason': reason, 'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+# 客户端标识
+def client_ip(request):
+    """客户端IP；在反向代理之后时从 CLIENT_IP_HEADER 指定的请求头读取（nginx 设置的 X-Real-IP）"""
+    if settings.CLIENT_IP_HEADER:
+        ip = request.META.get(settings.CLIENT_IP_HEADER, '').split(',')[0].strip()
+        try:
+            return str(ipaddress.ip_address(ip))
+        except ValueError:
+            pass
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def api_key(request):
+    """请求携带的已登记 API 密钥（X-API-Key 请求头），未登记的密钥视为没有"""
+    key = request.META.get('HTTP_X_API_KEY', '')
+    return key if key and key in settings.RATELIMIT_API_KEYS else ''
+
+
+def client_key(request):
+    key = api_key(request)
+    if key:
+        return 'key:' + hashlib.sha256(key.encode()).hexdigest()[:16]
+    return 'ip:' + client_ip(request)
+
+
+# 令牌桶
+def parse_rate(rate):
+    """'30/m' -> (30, 60)"""
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period[:1] or 's']
+
+
+class TokenBucket:
+    """速率为 rate（如 '30/m'）、容量为 burst 的令牌桶"""
+
+    def __init__(self, rate, burst=None):
+        count, period = parse_rate(rate)
+        self.interval = period / count
+        self.burst = burst or count
+
+    def take(self, cache, key, now=None):
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数
+
+        缓存中保存"理论到达时间"（tat）：桶空时下一个令牌可用的时刻。
+        每取一个令牌 tat 前移一个间隔，tat 超出当前时间 burst 个间隔时说明桶已空。
+        """
+        now = time.time() if now is None else now
+        tat = max(cache.get(key) or now, now)
+        new_tat = tat + self.interval
+        allowed_at = new_tat - self.burst * self.interval
+        if allowed_at > now:
+            return allowed_at - now
+        cache.set(key, new_tat, timeout=math.ceil(new_tat - now) + 1)
+        return 0
+
+
+@functools.lru_cache(maxsize=None)
+def _bucket(rate, burst):
+    return TokenBucket(rate, burst)
+
+
+def bucket_for(route):
+    rule = settings.RATELIMIT_RULES.get(route)
+    return _bucket(rule['rate'], rule.get('burst')) if rule else None
+
+
+def check_rate_limit(request, route):
+    """返回需要等待的秒数，0 表示放行"""
+    bucket = bucket_for(route)
+    if bucket is None:
+        return 0
+    cache = caches[settings.RATELIMIT_CACHE]
+    wait = bucket.take(cache, f"ratelimit:{route}:{client_key(request)}")
+    if wait:
+        metrics.record_admission_rejected(route, 'rate_limited')
+    return wait
+
+
+def _route_name(request):
+    try:
+        return resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+
+
+def _limited_response(request):
+    route = _route_name(request)
+    if route is None:
+        return None
+    wait = check_rate_limit(request, route)
+    if not wait:
+        return None
+    return too_many_requests('请求过于频繁，请稍后重试', max(math.ceil(wait), 1), 'rate_limited')
+
+
+@sync_and_async_middleware
+def ratelimit_middleware(get_response):
+    """按路由名与客户端限流，超出时返回 429"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if settings.RATELIMIT_ENABLED:
+                response = await sync_to_async(_limited_response, thread_sensitive=False)(request)
+                if response is not None:
+                    return response
+            return await get_response(request)
+    else:
+        def middleware(request):
+            if settings.RATELIMIT_ENABLED:
+                response = _limited_response(request)
+                if response is not None:
+                    return response
+            return get_response(request)
+    return middleware
+
+
+# 解析服务并发上限
+class ParserBusy(Exception):
+    """同时进行的解析已达上限"""
+
+    def __init__(self, retry_after):
+        super().__init__('解析服务繁忙')
+        self.retry_after = retry_after
+
+    def response(self):
+        return too_many_requests('解析服务繁忙，请稍后重试', self.retry_after, 'parser_busy')
+
+
+class FileSlots:
+    """用文件锁实现的跨进程计数信号量：N 个名额对应 N 个锁文件"""
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self):
+        """拿到名额返回持有的文件描述符，否则返回 None"""
+        start = random.randrange(self.size)
+        for i in range(self.size):
+            path = os.path.join(self.directory, f"slot{(start + i) % self.size}.lock")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class LocalSlots:
+    """没有 fcntl 时只在进程内限制"""
+
+    def __init__(self, size):
+        self._semaphore = threading.BoundedSemaphore(size)
+
+    def try_acquire(self):
+        return True if self._semaphore.acquire(blocking=False) else None
+
+    def release(self, token):
+        self._semaphore.release()
+
+
+_slots = None
+_slots_config = None
+
+
+def get_slots():
+    global _slots, _slots_config
+    config = (settings.PARSER_SLOT_DIR, settings.PARSER_MAX_IN_FLIGHT)
+    if _slots is None or _slots_config != config:
+        _slots = FileSlots(*config) if fcntl else LocalSlots(config[1])
+        _slots_config = config
+    return _slots
+
+
+def _deadline(wait):
+    return None if wait is None else time.monotonic() + wait
+
+
+def _expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _busy():
+    metrics.record_admission_rejected('parser', 'busy')
+    return ParserBusy(settings.PARSER_BUSY_RETRY_AFTER)
+
+
+def acquire_slot(wait=0):
+    """占用一个解析名额，返回交给 release_slot 的凭据；wait 秒内拿不到时抛出 ParserBusy，wait=None 一直等待"""
+    if not settings.PARSER_MAX_IN_FLIGHT:
+        return None
+    slots = get_slots()
+    deadline = _deadline(wait)
+    token = slots.try_acquire()
+    while token is None:
+        if _expired(deadline):
+            raise _busy()
+        time.sleep(SLOT_POLL_INTERVAL)
+        token = slots.try_acquire()
+    return slots, token
+
+
+async def aacquire_slot(wait=0):
+    """acquire_slot 的异步版本，等待时不占用事件循环"""
+    if not settings.PARSER_MAX_IN_FLIGHT:
+        return None
+    slots = get_slots()
+    deadline = _deadline(wait)
+    token = slots.try_acquire()
+    while token is None:
+        if _expired(deadline):
+            raise _busy()
+        await asyncio.sleep(SLOT_POLL_INTERVAL)
+        token = slots.try_acquire()
+    return slots, token
+
+
+def release_slot(held):
+    if held is not None:
+        slots, token = held
+        slots.release(token)
+
+
+@contextmanager
+def parser_slot(wait=0):
+    held = acquire_slot(wait)
+    try:
+        yield
+    finally:
+        release_slot(held)
+
+
+@asynccontextmanager
+async def aparser_slot(wait=0):
+    held = await aacquire_slot(wait)
+    try:
+        yield
+    finally:
+        release_slot(held)
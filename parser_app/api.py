@@ -0,0 +1,542 @@
+# parser_app/api.py
+"""版本化的解析 API（/api/v1/）
+
+    POST /api/v1/parse/?mode=sync|async     上传图片：请求体直接是图片（Content-Type: image/*），
+                                            或 multipart 表单的 image 字段
+    GET  /api/v1/jobs/<id>/                 作业（上传记录）状态
+    GET  /api/v1/jobs/<id>/results/         分页的解析结果，?page=&page_size=&fields=
+    GET  /api/v1/blocks/                    跨作业查询版面区块，?label=&job=&text=&group=page
+    POST /api/v1/uploads/                   创建分块上传会话（大文件、可续传，见 uploads.py）
+    GET|PUT|DELETE /api/v1/uploads/<id>/    查询进度 / 写入一块（请求头 Upload-Offset）/ 放弃
+    POST /api/v1/uploads/<id>/complete/     完成上传并解析，?mode= 与 /parse/ 相同
+
+与旧的 /api/parse/ 不同，图片不需要 base64 编码后再包进 JSON，上传与解析结果都会保存，
+与网页上传一样出现在历史记录中。
+- sync（默认）：占用解析名额同步解析，名额已满时返回 429，完成后直接返回第一页结果；
+- async：保存后进入后台解析队列（见 background.py、scheduler.py），立即返回 202 与作业地址。
+结果默认只包含 Markdown、精简结果与图片地址；raw 字段（解析服务的原始响应，含 base64 图片）与
+blocks 字段（版面区块，见 layout.py）需在 fields 中显式选择。
+结果逐条序列化后流式返回，大文档不必在内存中拼出完整的响应。
+近似重复检查（NEAR_DUPLICATE_MODE）只作用于网页上传，API 总是重新解析。
+"""
+import json
+import logging
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.db.models import Count, Prefetch
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import parse_header_parameters
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+
+from . import layout, leases, metrics, progress, retention, search, tracing, uploads
+from .admission import ParserBusy, client_key, parser_slot
+from .background import enqueue_upload
+from .ingest import (
+    ALLOWED_CONTENT_TYPES, MAX_UPLOAD_SIZE, UploadFailed, check_file, create_image_record, fail_processing,
+    parse_record,
+)
+from .media_serving import can_access_record, owner_client_key, signed_record_url
+from .models import ImageUpload, LayoutBlock, UploadSession
+from .scheduler import PRIORITY_LABELS
+from .storage import RecordMedia
+from .upload_handlers import StreamedUpload, streaming_uploads
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+RESULT_FIELDS = ('markdown', 'pruned_result', 'images', 'blocks', 'raw')
+DEFAULT_RESULT_FIELDS = ('markdown', 'pruned_result', 'images')
+# 未选择的字段不从数据库读取
+DEFERRED_COLUMNS = {
+    'markdown': ['markdown_text'],
+    'pruned_result': ['pruned_result'],
+    'images': ['markdown_image_paths', 'output_image_paths'],
+    'raw': ['raw_data'],
+}
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+# 上传
+def raw_filename(request, content_type):
+    """请求体直接是图片时的文件名：?filename=、Content-Disposition 的 filename，否则按类型生成"""
+    name = request.GET.get('filename')
+    if not name:
+        _, params = parse_header_parameters(request.headers.get('Content-Disposition', ''))
+        name = params.get('filename')
+    if name:
+        return os.path.basename(name.replace('\\', '/'))
+    return 'upload' + (mimetypes.guess_extension(content_type) or '.bin')
+
+
+def read_raw_upload(request):
+    """边接收请求体边写盘（见 upload_handlers.py），返回 (uploaded_file, 错误响应)"""
+    content_type = request.content_type or ''
+    length = request.META.get('CONTENT_LENGTH')
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_SIZE:
+        metrics.record_upload_outcome('rejected', 'too_large')
+        return None, error('文件大小不能超过10MB', status=413)
+
+    upload = StreamedUpload(raw_filename(request, content_type), content_type)
+    while True:
+        chunk = request.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        upload.write(chunk)
+        # 没有 Content-Length（分块传输）时边读边检查
+        if upload.size > MAX_UPLOAD_SIZE:
+            upload.abort()
+            metrics.record_upload_outcome('rejected', 'too_large')
+            return None, error('文件大小不能超过10MB', status=413)
+    if not upload.size:
+        upload.abort()
+        metrics.record_upload_outcome('rejected', 'missing_file')
+        return None, error('没有上传文件')
+    return upload.finish(), None
+
+
+def receive_upload(request):
+    """multipart 表单的 image 字段或整个请求体，返回 (uploaded_file, 错误响应)"""
+    with tracing.span('receive'):
+        if request.content_type == 'multipart/form-data':
+            uploaded_file = request.FILES.get('image')
+            if uploaded_file is None:
+                metrics.record_upload_outcome('rejected', 'missing_file')
+                return None, error('没有上传文件，multipart 请求需使用 image 字段')
+        else:
+            uploaded_file, error_response = read_raw_upload(request)
+            if error_response:
+                return None, error_response
+        error_response = check_file(uploaded_file)
+        if error_response:
+            uploaded_file.close()
+            return None, error_response
+        return uploaded_file, None
+
+
+# 序列化
+def isoformat(value):
+    return value.isoformat() if value else None
+
+
+def job_urls(request, record):
+    urls = {
+        'job': request.build_absolute_uri(reverse('api_v1_job', args=[record.id])),
+        'results': request.build_absolute_uri(reverse('api_v1_job_results', args=[record.id])),
+        'record': request.build_absolute_uri(reverse('record_detail', args=[record.id])),
+    }
+    if record.status in ('pending', 'processing'):
+        if progress.streaming_supported(request):
+            urls['events'] = request.build_absolute_uri(reverse('upload_events', args=[record.id]))
+        urls['progress'] = request.build_absolute_uri(reverse('upload_progress', args=[record.id]))
+    return urls
+
+
+def job_data(request, record, result_count=None):
+    data = {
+        'id': record.id,
+        'status': record.status,
+        'filename': record.original_filename,
+        'file_size': record.file_size,
+        'page_count': record.page_count,
+        'priority': PRIORITY_LABELS.get(record.priority, str(record.priority)),
+        'upload_time': isoformat(record.upload_time),
+        'queued_at': isoformat(record.queued_at),
+        'started_at': isoformat(record.started_at),
+        'queue_wait': record.queue_wait,
+        'processing_time': record.processing_time,
+        'error': record.error_message or None,
+        'reused_from': record.reused_from_id,
+        'archived': record.archived_at is not None,
+        'urls': job_urls(request, record),
+    }
+    if result_count is not None:
+        data['result_count'] = result_count
+    return data
+
+
+def result_data(request, media, result, fields, raw_data=None):
+    data = {'index': result.result_index}
+    if 'markdown' in fields:
+        data['markdown'] = result.markdown_text
+    if 'pruned_result' in fields:
+        data['pruned_result'] = search.load_structure(result.pruned_result)
+    if 'images' in fields:
+        def url(path):
+            return request.build_absolute_uri(signed_record_url(media.record, path))
+
+        data['images'] = {
+            'markdown_url': url(media.markdown_url(result.result_index)),
+            'markdown': {path: url(media.markdown_image_url(result.result_index, path))
+                         for path in result.markdown_image_paths},
+            'output': {name: url(media.output_image_url(name)) for name in result.output_image_paths},
+        }
+    if 'raw' in fields:
+        data['raw'] = raw_data.get(result.result_index) if raw_data is not None else result.raw_data
+    if 'blocks' in fields:
+        data['blocks'] = [layout.block_data(block) for block in result.blocks.all()]
+    return data
+
+
+def parse_fields(request):
+    """?fields=markdown,images；返回 (字段集合, 错误响应)"""
+    value = request.GET.get('fields')
+    if not value:
+        return set(DEFAULT_RESULT_FIELDS), None
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields - set(RESULT_FIELDS)
+    if unknown:
+        return None, error(f"未知的字段: {', '.join(sorted(unknown))}，可选 {', '.join(RESULT_FIELDS)}")
+    return fields, None
+
+
+def parse_page(request):
+    """?page=&page_size=；返回 (页码, 每页条数, 错误响应)"""
+    try:
+        page = int(request.GET.get('page', 1))
+        page_size = int(request.GET.get('page_size', settings.API_RESULTS_PAGE_SIZE))
+    except ValueError:
+        return None, None, error('page 与 page_size 必须是整数')
+    if page < 1 or not 1 <= page_size <= settings.API_RESULTS_MAX_PAGE_SIZE:
+        return None, None, error(f'page 从 1 开始，page_size 为 1 到 {settings.API_RESULTS_MAX_PAGE_SIZE}')
+    return page, page_size, None
+
+
+def next_page_url(request, path, page, has_more):
+    if not has_more:
+        return None
+    query = request.GET.copy()
+    query['page'] = page + 1
+    return request.build_absolute_uri(path + '?' + query.urlencode())
+
+
+def results_response(request, record, status=200):
+    """一页解析结果；外层信息先写出，结果逐条从数据库读取并序列化"""
+    fields, error_response = parse_fields(request)
+    if error_response:
+        return error_response
+    page, page_size, error_response = parse_page(request)
+    if error_response:
+        return error_response
+
+    total = record.results.count()
+    offset = (page - 1) * page_size
+    deferred = [column for field, columns in DEFERRED_COLUMNS.items() if field not in fields for column in columns]
+    results = record.results.order_by('result_index').defer(*deferred)
+    if 'blocks' in fields:
+        results = results.prefetch_related(Prefetch('blocks', queryset=LayoutBlock.objects.order_by('position')))
+    results = results[offset:offset + page_size]
+    # 已归档记录的 raw_data 在归档文件中
+    raw_data = retention.load_raw_data(record) if 'raw' in fields and record.archived_at else None
+
+    header = {
+        'job': job_data(request, record, result_count=total),
+        'page': page,
+        'page_size': page_size,
+        'next': next_page_url(request, reverse('api_v1_job_results', args=[record.id]), page,
+                              offset + page_size < total),
+    }
+    media = RecordMedia(record)
+
+    def stream():
+        yield json.dumps(header, ensure_ascii=False)[:-1] + ', "results": ['
+        for n, result in enumerate(results.iterator(chunk_size=page_size)):
+            item = json.dumps(result_data(request, media, result, fields, raw_data), ensure_ascii=False)
+            yield (', ' if n else '') + item
+        yield ']}'
+
+    return StreamingHttpResponse(stream(), status=status, content_type='application/json; charset=utf-8')
+
+
+def get_job(request, job_id):
+    """返回 (记录, 错误响应)"""
+    record = ImageUpload.objects.filter(id=job_id).first()
+    if record is None:
+        return None, error('作业不存在', status=404)
+    if not can_access_record(request, record):
+        return None, error('无权访问该作业', status=403)
+    return record, None
+
+
+def parse_mode(request):
+    """?mode=，同步模式还要检查结果参数（避免解析完才发现请求无效）；返回 (模式, 错误响应)"""
+    mode = request.GET.get('mode', 'sync')
+    if mode not in ('sync', 'async'):
+        return None, error('mode 只能是 sync 或 async')
+    if mode == 'sync':
+        _, error_response = parse_fields(request)
+        if error_response is None:
+            _, _, error_response = parse_page(request)
+        if error_response:
+            return None, error_response
+    return mode, None
+
+
+def run_upload(request, uploaded_file, mode):
+    """保存已检查过的文件并同步解析或排队，返回 (响应, 记录)；解析名额已满时不保存，记录为 None"""
+    if mode == 'async':
+        image_record = enqueue_upload(request, uploaded_file)
+        return JsonResponse(job_data(request, image_record), status=202), image_record
+
+    try:
+        with parser_slot():
+            image_record = create_image_record(request, uploaded_file)
+            with leases.hold(image_record.id):
+                try:
+                    parse_record(image_record)
+                except UploadFailed as e:
+                    return e.response(), image_record
+                except Exception as e:
+                    return fail_processing(image_record, e), image_record
+    except ParserBusy as e:
+        return e.response(), None
+    return results_response(request, image_record), image_record
+
+
+# 视图
+@streaming_uploads
+@csrf_exempt
+@require_POST
+def parse(request):
+    """上传图片并解析（同步）或排队（异步）"""
+    mode, error_response = parse_mode(request)
+    if error_response:
+        return error_response
+
+    try:
+        uploaded_file, error_response = receive_upload(request)
+        if error_response:
+            return error_response
+        try:
+            response, _ = run_upload(request, uploaded_file, mode)
+        finally:
+            # 请求体直接上传的文件不在 request.FILES 中，Django 不会替我们关闭（未保存时同时删除临时文件）
+            uploaded_file.close()
+        return response
+
+    except Exception as e:
+        logger.error(f"Unexpected error in api parse: {str(e)}", exc_info=True)
+        return error(f'服务器内部错误: {str(e)}', status=500)
+
+
+@require_GET
+def job(request, job_id):
+    """作业状态"""
+    record, error_response = get_job(request, job_id)
+    if error_response:
+        return error_response
+    result_count = record.results.count() if record.status == 'completed' else None
+    return JsonResponse(job_data(request, record, result_count=result_count))
+
+
+@require_GET
+def job_results(request, job_id):
+    """作业的解析结果（分页、可选字段）"""
+    record, error_response = get_job(request, job_id)
+    if error_response:
+        return error_response
+    if record.status != 'completed':
+        return JsonResponse({'error': '作业尚未完成', 'job': job_data(request, record)}, status=409)
+    return results_response(request, record)
+
+
+@require_GET
+def blocks(request):
+    """跨作业查询版面区块；group=page 时按页汇总（如“所有带表格的页面”）"""
+    page, page_size, error_response = parse_page(request)
+    if error_response:
+        return error_response
+    group = request.GET.get('group', '')
+    if group not in ('', 'page'):
+        return error('group 只能是 page')
+
+    queryset = LayoutBlock.objects.all()
+    owner = owner_client_key(request)
+    if owner is not None:
+        queryset = queryset.filter(image__client_key=owner)
+    labels = [label.strip() for label in request.GET.get('label', '').split(',') if label.strip()]
+    if labels:
+        queryset = queryset.filter(label__in=labels)
+    if request.GET.get('job'):
+        try:
+            queryset = queryset.filter(image_id=int(request.GET['job']))
+        except ValueError:
+            return error('job 必须是整数')
+    if request.GET.get('text'):
+        queryset = queryset.filter(text__icontains=request.GET['text'])
+
+    offset = (page - 1) * page_size
+    if group == 'page':
+        rows = queryset.values('image_id', 'page').annotate(blocks=Count('id')).order_by('-image_id', 'page')
+        total = rows.count()
+        items = [{
+            'job': row['image_id'],
+            'page': row['page'],
+            'blocks': row['blocks'],
+            # 结果按页码排序，每页一条即可定位到这一页
+            'result_url': request.build_absolute_uri(
+                reverse('api_v1_job_results', args=[row['image_id']]) + f"?page={row['page'] + 1}&page_size=1"),
+        } for row in rows[offset:offset + page_size]]
+    else:
+        rows = queryset.order_by('-image_id', 'page', 'position')
+        total = rows.count()
+        items = [dict(job=block.image_id, **layout.block_data(block)) for block in rows[offset:offset + page_size]]
+
+    return JsonResponse({
+        'page': page,
+        'page_size': page_size,
+        'total': total,
+        'next': next_page_url(request, reverse('api_v1_blocks'), page, offset + page_size < total),
+        'items': items,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+# 分块上传
+def session_data(request, session):
+    data = {
+        'id': str(session.id),
+        'filename': session.filename,
+        'content_type': session.content_type,
+        'size': session.size,
+        'offset': session.offset,
+        'status': session.status,
+        'sha256': session.sha256 or None,
+        'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+        'expires_at': isoformat(session.expires_at),
+        'urls': {
+            'upload': request.build_absolute_uri(reverse('api_v1_upload', args=[session.id])),
+            'complete': request.build_absolute_uri(reverse('api_v1_upload_complete', args=[session.id])),
+        },
+    }
+    if session.record_id:
+        data['urls']['job'] = request.build_absolute_uri(reverse('api_v1_job', args=[session.record_id]))
+    return data
+
+
+def session_response(request, session, status=200, data=None):
+    response = JsonResponse(data or session_data(request, session), status=status)
+    response['Upload-Offset'] = str(session.offset)
+    return response
+
+
+def upload_error(request, session, e):
+    return session_response(request, session, status=e.status, data={'error': str(e), 'offset': session.offset})
+
+
+def get_session(request, session_id):
+    """MEDIA_ACCESS=owner 时只能操作自己创建的会话，其他人的会话视为不存在"""
+    session = UploadSession.objects.filter(id=session_id).first()
+    owner = owner_client_key(request)
+    if session is None or (owner is not None and session.client_key != owner):
+        return None, error('上传会话不存在或已过期', status=404)
+    return session, None
+
+
+@csrf_exempt
+@require_POST
+def create_upload(request):
+    """创建分块上传会话：filename、size（字节），可选 content_type、sha256（JSON 或表单）"""
+    if request.content_type == 'application/json':
+        try:
+            params = json.loads(request.body)
+        except ValueError:
+            return error('请求体不是合法的 JSON')
+        if not isinstance(params, dict):
+            return error('请求体必须是 JSON 对象')
+    else:
+        params = request.POST
+
+    filename = os.path.basename(str(params.get('filename') or '').replace('\\', '/'))
+    content_type = params.get('content_type') or mimetypes.guess_type(filename)[0] or ''
+    checksum = str(params.get('sha256') or '')
+    try:
+        size = int(params.get('size'))
+    except (TypeError, ValueError):
+        return error('size 必须是文件的字节数')
+    if not filename:
+        return error('缺少 filename')
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        return error('不支持的文件类型，请上传图片文件')
+    if not 0 < size <= settings.CHUNKED_UPLOAD_MAX_SIZE:
+        return error(f'size 须在 1 到 {settings.CHUNKED_UPLOAD_MAX_SIZE} 字节之间', status=413)
+    if checksum and not re.fullmatch(r'[0-9a-fA-F]{64}', checksum):
+        return error('sha256 必须是64位十六进制')
+
+    session = uploads.create_session(filename, content_type, size, checksum, client_key(request))
+    return session_response(request, session, status=201)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'HEAD', 'PUT', 'DELETE'])
+def upload(request, session_id):
+    """查询进度（续传前先取 offset）、写入一块或放弃上传"""
+    session, error_response = get_session(request, session_id)
+    if error_response:
+        return error_response
+
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return HttpResponse(status=204)
+
+    if request.method == 'PUT':
+        offset = request.headers.get('Upload-Offset', '')
+        length = request.META.get('CONTENT_LENGTH', '')
+        if not offset.isdigit():
+            return error('缺少 Upload-Offset 请求头')
+        if not length.isdigit():
+            return error('需要 Content-Length', status=411)
+        try:
+            uploads.append_chunk(session, int(offset), request, int(length))
+        except uploads.UploadError as e:
+            return upload_error(request, session, e)
+
+    return session_response(request, session)
+
+
+@csrf_exempt
+@require_POST
+def complete_upload(request, session_id):
+    """完成分块上传：核对大小与校验和，把文件交给与 /parse/ 相同的流程"""
+    session, error_response = get_session(request, session_id)
+    if error_response:
+        return error_response
+    if session.status == 'completed' and session.record_id:
+        # 完成请求的响应丢失后重试，不再重复解析
+        return JsonResponse(job_data(request, session.record))
+    mode, error_response = parse_mode(request)
+    if error_response:
+        return error_response
+    if mode == 'sync' and settings.LAYOUT_PARSING_FILE_MODE == 'inline' and session.size > MAX_UPLOAD_SIZE:
+        # 内联方式要把整个文件 base64 编码进请求体，超过普通上传上限的文件改为排队，不在请求线程中编码
+        mode = 'async'
+
+    try:
+        uploaded_file = uploads.claim_file(session)
+    except uploads.UploadError as e:
+        return upload_error(request, session, e)
+
+    record = None
+    try:
+        response = check_file(uploaded_file, max_size=settings.CHUNKED_UPLOAD_MAX_SIZE)
+        if response is None:
+            response, record = run_upload(request, uploaded_file, mode)
+    except Exception as e:
+        logger.error(f"Unexpected error in complete upload: {str(e)}", exc_info=True)
+        response = error(f'服务器内部错误: {str(e)}', status=500)
+    finally:
+        uploaded_file.close()
+
+    if record is None:
+        # 文件还在，可以稍后再次完成
+        uploads.reopen(session)
+    else:
+        uploads.finish(session, record)
+    return response
+
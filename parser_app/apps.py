@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ParserAppConfig(AppConfig):
+    # 0001_initial 由 Django 6.0 生成，主键为 BigAutoField（6.0 起的默认值）；
+    # 在 Django 5.x 上需显式指定，否则 makemigrations 会生成修改所有主键的迁移
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'parser_app'
+
+    def ready(self):
+        from django.conf import settings
+
+        from .metrics import install_query_observer
+        from .profiling import install_template_timer
+
+        # 统计每个请求的数据库查询（见 metrics.observe_queries）
+        connection_created.connect(install_query_observer, dispatch_uid='parser_app.metrics')
+
+        if settings.PROFILING_ENABLED:
+            install_template_timer()
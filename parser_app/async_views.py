@@ -0,0 +1,129 @@
+# parser_app/async_views.py
+"""异步版本的上传与解析视图（需要以ASGI方式运行）
+
+等待解析服务期间不占用线程，一个进程可以同时挂起大量解析请求；
+文件读写、base64编码、数据库写入与模板渲染都放到线程中执行，不阻塞事件循环。
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+
+from . import leases, parser_client, parser_pool
+from .admission import ParserBusy, aparser_slot
+from .background import start_upload
+from .tracing import traced_view
+from .upload_handlers import streaming_uploads
+from .media_serving import can_access_record_id
+from .progress import sse_response, along_poll, record_not_found
+from .ingest import (
+    validate_upload, check_near_duplicate, create_image_record, encode_record_image,
+    fail_upload, finish_upload, fail_processing,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@streaming_uploads
+@require_POST
+@traced_view('upload_image')
+async def upload_image_async(request):
+    """处理图片上传和解析（异步）"""
+    try:
+        uploaded_file, error_response = await sync_to_async(validate_upload)(request)
+        if error_response:
+            return error_response
+
+        # 按 near_duplicate 模式提示或复用近似图片的已有结果
+        response, perceptual_hash = await sync_to_async(check_near_duplicate)(request, uploaded_file)
+        if response is not None:
+            return response
+
+        # 增量模式：立即返回，解析在后台进行
+        if request.POST.get('mode') == 'stream':
+            return await sync_to_async(start_upload)(request, uploaded_file, perceptual_hash)
+
+        # 解析名额已满时直接返回429，不保存文件
+        try:
+            async with aparser_slot():
+                return await _parse_upload(request, uploaded_file, perceptual_hash)
+        except ParserBusy as e:
+            return e.response()
+
+    except Exception as e:
+        logger.error(f"Unexpected error in upload_image_async: {str(e)}", exc_info=True)
+        return JsonResponse({'error': f'服务器内部错误: {str(e)}'}, status=500)
+
+
+async def _parse_upload(request, uploaded_file, perceptual_hash=None):
+    # 保存文件并创建ImageUpload记录
+    image_record = await sync_to_async(create_image_record)(request, uploaded_file, perceptual_hash=perceptual_hash)
+
+    async with leases.ahold(image_record.id):
+        return await _parse_record(request, image_record)
+
+
+async def _parse_record(request, image_record):
+    try:
+        with parser_pool.choose() as backend_call:
+            # 读取并编码图片（纯文件读写与CPU计算，不需要和ORM共用线程）
+            body = await sync_to_async(encode_record_image, thread_sensitive=False)(
+                image_record, backend_call.backend.file_mode)
+
+            # 调用API
+            logger.info(f"Calling API: {backend_call.backend.url}")
+            try:
+                response = await parser_client.apost(body, backend_call=backend_call)
+            except parser_client.ParserTimeout:
+                return await sync_to_async(fail_upload)(image_record, 'API请求超时，请稍后重试', status=504,
+                                                      error_type='timeout')
+            except parser_client.ParserRequestError as e:
+                return await sync_to_async(fail_upload)(image_record, f'网络请求错误: {str(e)}',
+                                                      error_type='network')
+
+        return await sync_to_async(finish_upload)(request, image_record, response)
+
+    except Exception as e:
+        return await sync_to_async(fail_processing)(image_record, e)
+
+
+async def upload_events_async(request, record_id):
+    """上传进度（Server-Sent Events，异步）"""
+    if not await sync_to_async(can_access_record_id)(request, record_id):
+        return record_not_found()
+    return sse_response(request, record_id, asynchronous=True)
+
+
+async def upload_progress_async(request, record_id):
+    """上传进度（长轮询，异步）"""
+    if not await sync_to_async(can_access_record_id)(request, record_id):
+        return record_not_found()
+    return await along_poll(request, record_id)
+
+
+async def api_parse_async(request):
+    """API接口（异步）"""
+    if request.method == 'POST':
+        data = json.loads(request.body)
+        image_data = data.get('image_data')
+
+        if not image_data:
+            return JsonResponse({'error': '没有图片数据'}, status=400)
+
+        body = json.dumps({
+            "file": image_data,
+            "fileType": 1,
+        }).encode('ascii')
+
+        try:
+            async with aparser_slot():
+                response = await parser_client.apost(body, timeout=30)
+            return JsonResponse(await sync_to_async(json.loads, thread_sensitive=False)(response.content))
+        except ParserBusy as e:
+            return e.response()
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': '只支持POST请求'}, status=400)
@@ -0,0 +1,165 @@
+# parser_app/background.py
+"""后台解析
+
+上传接口在保存文件、创建记录后立即返回，记录以 pending 状态进入数据库中的队列。
+每个 worker 进程有一个调度线程：本进程有空闲的解析线程、且拿到解析名额时，
+按 scheduler 的策略认领下一条记录交给线程池解析。队列在数据库中，哪个进程认领都可以；
+进度由 progress 模块从数据库读取后推送给浏览器。
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.http import JsonResponse
+from django.urls import reverse
+
+from . import leases, progress, scheduler, tracing
+from .admission import acquire_slot, release_slot
+from .ingest import UploadFailed, create_image_record, fail_processing, parse_record
+
+logger = logging.getLogger(__name__)
+
+# 本进程提交的记录的链路，本进程认领时后台步骤延续同一个 trace_id（被其他进程认领的条目按数量淘汰）
+# 请求线程写入、worker 线程取出，读写都要持有锁
+_trace_contexts = OrderedDict()
+_trace_contexts_lock = threading.Lock()
+MAX_TRACE_CONTEXTS = 1000
+
+
+def _keep_trace_context(record_id, context):
+    with _trace_contexts_lock:
+        _trace_contexts[record_id] = context
+        while len(_trace_contexts) > MAX_TRACE_CONTEXTS:
+            _trace_contexts.popitem(last=False)
+
+
+def _take_trace_context(record_id):
+    with _trace_contexts_lock:
+        return _trace_contexts.pop(record_id, None)
+
+
+class Dispatcher:
+    """进程内的调度线程与解析线程池"""
+
+    def __init__(self, workers):
+        self.capacity = threading.Semaphore(workers)
+        self.wakeup = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parse')
+        self.thread = threading.Thread(target=self.run, name='parse-dispatcher', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.capacity.acquire()
+            try:
+                image_record, slot = self.next_job()
+            except Exception as e:
+                logger.error(f"调度后台解析失败: {str(e)}", exc_info=True)
+                self.capacity.release()
+                self.wakeup.wait(settings.SCHEDULER_POLL_INTERVAL)
+                continue
+            self.executor.submit(self.execute, image_record, slot)
+
+    def next_job(self):
+        """等待队列中出现记录，占用解析名额后认领下一条"""
+        while True:
+            close_old_connections()
+            if scheduler.queue_depth():
+                slot = acquire_slot(wait=None)
+                image_record = scheduler.claim_next()
+                if image_record is not None:
+                    return image_record, slot
+                release_slot(slot)
+            self.wakeup.wait(settings.SCHEDULER_POLL_INTERVAL)
+            self.wakeup.clear()
+
+    def execute(self, image_record, slot):
+        try:
+            with leases.hold(image_record.id):
+                process_record(image_record, _take_trace_context(image_record.id))
+        finally:
+            release_slot(slot)
+            self.capacity.release()
+            self.wake()
+
+
+_dispatcher = None
+_dispatcher_pid = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_dispatcher():
+    """启动本进程的调度线程（可重复调用；fork 出的子进程会重新启动）"""
+    global _dispatcher, _dispatcher_pid
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher_pid != os.getpid():
+            _dispatcher = Dispatcher(settings.BACKGROUND_PARSE_WORKERS)
+            _dispatcher_pid = os.getpid()
+            _dispatcher.start()
+    # 续约与回收过期租约；放回队列的记录立即唤醒调度线程
+    leases.start_keeper(on_requeue=_dispatcher.wake)
+    return _dispatcher
+
+
+def process_record(image_record, trace_context=None):
+    """在后台线程中解析一条已认领的记录；trace_context 为提交任务时的链路"""
+    with tracing.root_span('background.parse', trace_context, record_id=image_record.id,
+                           priority=image_record.priority, queue_wait=image_record.queue_wait):
+        _process_record(image_record)
+
+
+def _process_record(image_record):
+    try:
+        # 重新处理时先清掉上一次的结果（媒体文件会被覆盖）
+        image_record.results.all().delete()
+        try:
+            parse_record(image_record)
+        except UploadFailed:
+            pass
+        except Exception as e:
+            fail_processing(image_record, e)
+    except Exception as e:
+        logger.error(f"后台解析记录 {image_record.id} 失败: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def enqueue_upload(request, uploaded_file, perceptual_hash=None):
+    """保存上传并放入后台解析队列，返回新记录"""
+    image_record = create_image_record(request, uploaded_file, status='pending',
+                                       priority=scheduler.request_priority(request),
+                                       perceptual_hash=perceptual_hash)
+    submit_parse(image_record.id)
+    return image_record
+
+
+def start_upload(request, uploaded_file, perceptual_hash=None):
+    """保存上传并排队解析，立即返回订阅进度所需的地址"""
+    image_record = enqueue_upload(request, uploaded_file, perceptual_hash)
+    return JsonResponse({
+        'id': image_record.id,
+        'status': image_record.status,
+        **progress.follow_urls(request, image_record.id),
+        'record_url': reverse('record_detail', args=[image_record.id]),
+    }, status=202)
+
+
+def submit_parse(record_id):
+    """事务提交后通知调度线程有新记录"""
+    context = tracing.trace_context()
+    if context is not None:
+        _keep_trace_context(record_id, context)
+    transaction.on_commit(wake_dispatcher)
+
+
+def wake_dispatcher():
+    start_dispatcher().wake()
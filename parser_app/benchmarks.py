@@ -0,0 +1,211 @@
+# parser_app/benchmarks.py
+"""上传解析流程的分阶段基准测试
+
+把 upload_image 拆成以下阶段分别计时（不访问解析服务）：
+- spool:          multipart 解析与上传文件落地（request.FILES，StreamingUploadHandler）
+- base64_encode:  原始图片 base64 编码
+- serialize:      请求体 JSON 序列化
+- json_decode:    解析服务响应 JSON 解码
+- write_media:    Markdown/图片 base64 解码并写入存储
+- insert_results: ParseResult 入库
+- render_result:  渲染 result.html
+
+每个阶段在 small/large/multipage 三组数据上运行，取多个样本中最快的一次，
+与 benchmark_baseline.json 中记录的基线比较，超过阈值即视为退化。
+为抵消机器负载和降频带来的整体波动，每组数据前后都会运行一段固定的校准负载，
+比较时按当前与记录基线时校准耗时的比值缩放基线。
+基线仍与机器相关，更换运行环境后应使用 `manage.py benchmark --record` 重新记录。
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import RequestFactory
+
+from .ingest import create_parse_result, render_upload_result, save_result_files, serialize_payload
+from .mock_parser import MockParserConfig, fake_image, make_response
+from .models import ImageUpload
+from .storage import LocalMediaStorage, RecordMedia, upload_name
+from .upload_handlers import StreamingUploadHandler
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.5  # 比基线慢50%以上视为退化
+MIN_DELTA = 0.0002  # 变慢不足0.2ms的阶段不计为退化，避免计时抖动
+MIN_SAMPLE_TIME = 0.05
+CALIBRATION_KEY = '_calibration'
+
+# 上传图片边长、响应页数、每页图片数、响应图片边长
+FIXTURES = {
+    'small': {'upload_size': 512, 'pages': 1, 'images_per_page': 1, 'image_size': 256},
+    'large': {'upload_size': 2048, 'pages': 1, 'images_per_page': 4, 'image_size': 1024},
+    'multipage': {'upload_size': 1024, 'pages': 8, 'images_per_page': 2, 'image_size': 512},
+}
+
+STAGES = ['spool', 'base64_encode', 'serialize', 'json_decode', 'write_media', 'insert_results', 'render_result']
+
+
+class Fixture:
+    """一组输入数据及各阶段需要的中间结果"""
+
+    def __init__(self, name, upload_size, pages, images_per_page, image_size):
+        self.name = name
+        self.image_bytes = fake_image(upload_size)
+        config = MockParserConfig(pages=pages, images_per_page=images_per_page, image_size=image_size, seed=0)
+        self.response_data = make_response(config)
+        self.response_body = json.dumps(self.response_data).encode('utf-8')
+        self.image_data = base64.b64encode(self.image_bytes).decode('ascii')
+        self.results = self.response_data['result']['layoutParsingResults']
+        self.factory = RequestFactory()
+
+    def record(self, saved=False):
+        name = upload_name('benchmark.jpg')
+        if saved:
+            return ImageUpload.objects.create(image=name, original_filename='benchmark.jpg',
+                                              file_size=len(self.image_bytes), status='processing')
+        return ImageUpload(id=1, image=name, original_filename='benchmark.jpg', file_size=len(self.image_bytes))
+
+
+def stage_spool(fixture, storage):
+    upload = SimpleUploadedFile('benchmark.jpg', fixture.image_bytes, content_type='image/jpeg')
+    request = fixture.factory.post('/upload/', {'image': upload})
+    request.upload_handlers = [StreamingUploadHandler(request)]
+    uploaded = request.FILES['image']
+    uploaded.read()
+    uploaded.close()
+
+
+def stage_base64_encode(fixture, storage):
+    base64.b64encode(fixture.image_bytes).decode('ascii')
+
+
+def stage_serialize(fixture, storage):
+    serialize_payload(fixture.image_data)
+
+
+def stage_json_decode(fixture, storage):
+    json.loads(fixture.response_body)
+
+
+def stage_write_media(fixture, storage):
+    record = fixture.record()
+    media = RecordMedia(record, storage=storage)
+    for i, res in enumerate(fixture.results):
+        save_result_files(record, media, i, res)
+
+
+def stage_insert_results(fixture, storage):
+    with transaction.atomic():
+        record = fixture.record(saved=True)
+        for i, res in enumerate(fixture.results):
+            create_parse_result(record, i, res, list(res['markdown']['images']), [])
+        transaction.set_rollback(True)
+
+
+def stage_render_result(fixture, storage):
+    record = fixture.record()
+    media = RecordMedia(record, storage=storage)
+    save_results = [{
+        'index': i,
+        'pruned_result': res['prunedResult'],
+        'markdown': res['markdown']['text'],
+        'markdown_url': media.markdown_url(i),
+        'image_id': record.id,
+    } for i, res in enumerate(fixture.results)]
+    render_upload_result(fixture.factory.get('/upload/'), record, save_results)
+
+
+STAGE_FUNCTIONS = {stage: globals()[f"stage_{stage}"] for stage in STAGES}
+
+
+def time_stage(func, fixture, storage, repeat, min_sample_time=MIN_SAMPLE_TIME):
+    """与 timeit 相同的做法：每个样本循环足够多次以减小计时误差，取 repeat 个样本中最快的单次耗时（秒）"""
+    func(fixture, storage)  # 预热
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func(fixture, storage)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_sample_time:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(fixture, storage)
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+_CALIBRATION_DATA = bytes(range(256)) * 4096
+_CALIBRATION_DOC = {'items': [{'id': i, 'text': 'x' * 32} for i in range(2000)]}
+
+
+def calibration_workload(fixture, storage):
+    """固定的CPU/内存负载，用于估计机器当前的相对速度"""
+    hashlib.sha256(_CALIBRATION_DATA).digest()
+    json.loads(json.dumps(_CALIBRATION_DOC))
+
+
+def run_benchmarks(fixtures=None, stages=None, repeat=5):
+    """运行基准测试，返回 {fixture: {stage: 秒}}，另含 CALIBRATION_KEY 记录校准耗时"""
+    results = {}
+    calibration = []
+    with tempfile.TemporaryDirectory() as media_root:
+        storage = LocalMediaStorage(location=media_root, base_url='/media/')
+        for name in fixtures or FIXTURES:
+            fixture = Fixture(name, **FIXTURES[name])
+            calibration.append(time_stage(calibration_workload, None, None, repeat))
+            results[name] = {
+                stage: time_stage(STAGE_FUNCTIONS[stage], fixture, storage, repeat)
+                for stage in stages or STAGES
+            }
+            calibration.append(time_stage(calibration_workload, None, None, repeat))
+    results[CALIBRATION_KEY] = sum(calibration) / len(calibration)
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def speed_factor(results, baseline):
+    """当前机器相对记录基线时慢了多少倍（缺少校准数据时为1）"""
+    current = results.get(CALIBRATION_KEY)
+    recorded = baseline.get(CALIBRATION_KEY)
+    if not current or not recorded:
+        return 1.0
+    return current / recorded
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """返回退化的阶段 [(fixture, stage, 当前耗时, 按校准缩放后的基线耗时)]，没有基线的阶段不参与比较"""
+    factor = speed_factor(results, baseline)
+    regressions = []
+    for fixture, stages in results.items():
+        if fixture == CALIBRATION_KEY:
+            continue
+        for stage, seconds in stages.items():
+            base = baseline.get(fixture, {}).get(stage)
+            if not base:
+                continue
+            base *= factor
+            if seconds > base * (1 + threshold) and seconds - base > MIN_DELTA:
+                regressions.append((fixture, stage, seconds, base))
+    return regressions
@@ -0,0 +1,106 @@
+# parser_app/fields.py
+"""压缩存储的长文本字段
+
+ParseResult.markdown_text 与 pruned_result 压缩率很高，却占了数据库的大部分体积。
+CompressedTextField 在 Python 侧与 TextField 一样是 str，数据库里保存为二进制：
+
+    b'\\xc7T' <版本 1> <编码>  正文
+    编码 0 = 未压缩的 UTF-8（短文本或压缩后没有变小）
+         1 = zlib
+         2 = zstd（需要 Python 3.14 的 compression.zstd 或 pip install zstandard）
+
+写入使用 settings.TEXT_COMPRESSION 指定的编码，读取按头部识别，旧的未压缩文本（不带头部）原样返回。
+b'\\xc7T' 不是合法的 UTF-8 开头，不会与旧文本混淆。
+压缩后的列不能在数据库里按内容查询（icontains 等），搜索使用 ResultSearchIndex（见 search.py）。
+"""
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+except ImportError:
+    try:
+        import zstandard as _zstd
+    except ImportError:
+        _zstd = None
+
+MAGIC = b'\xc7T'
+VERSION = 1
+CODEC_PLAIN = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {'none': CODEC_PLAIN, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+MIN_COMPRESS_BYTES = 128  # 更短的文本压缩不划算，直接保存
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _require_zstd():
+    if _zstd is None:
+        raise ImproperlyConfigured('zstd 压缩需要 Python 3.14 或 pip install zstandard')
+    return _zstd
+
+
+def _zstd_compress(data):
+    # 两个实现的模块级 compress 都会在帧头写入原始长度，decompress 可以直接解出
+    return _require_zstd().compress(data, ZSTD_LEVEL)
+
+
+def _zstd_decompress(data):
+    return _require_zstd().decompress(data)
+
+
+def compress_text(text, codec=None):
+    """str -> 带头部的 bytes"""
+    data = text.encode('utf-8')
+    codec = CODECS[codec or settings.TEXT_COMPRESSION]
+    if codec != CODEC_PLAIN and len(data) >= MIN_COMPRESS_BYTES:
+        packed = zlib.compress(data, ZLIB_LEVEL) if codec == CODEC_ZLIB else _zstd_compress(data)
+        if len(packed) < len(data):
+            return MAGIC + bytes((VERSION, codec)) + packed
+    return MAGIC + bytes((VERSION, CODEC_PLAIN)) + data
+
+
+def decompress_text(value):
+    """数据库中的值 -> str；兼容未压缩的旧文本"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not value.startswith(MAGIC):
+        return value.decode('utf-8')
+    codec, body = value[len(MAGIC) + 1], value[len(MAGIC) + 2:]
+    if codec == CODEC_ZLIB:
+        body = zlib.decompress(body)
+    elif codec == CODEC_ZSTD:
+        body = _zstd_decompress(body)
+    elif codec != CODEC_PLAIN:
+        raise ValueError(f'未知的文本压缩编码: {codec}')
+    return body.decode('utf-8')
+
+
+class CompressedTextField(models.TextField):
+    """以压缩后的二进制保存的长文本"""
+
+    description = '压缩存储的文本'
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return super().to_python(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return connection.Database.Binary(compress_text(value))
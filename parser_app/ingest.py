@@ -0,0 +1,452 @@
+# parser_app/ingest.py
+"""上传解析流程中与调用方式无关的步骤
+
+同步视图 upload_image 与异步视图 upload_image_async 共用这里的函数，
+区别只在于如何调用解析服务（parser_client.post / parser_client.apost）。
+"""
+import base64
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+
+from . import layout, leases, metrics, parser_client, parser_pool, search, similarity, tracing
+from .admission import client_ip, client_key
+from .media_serving import parser_file_url
+from .models import ImageUpload, ParseResult
+from .storage import RecordMedia, upload_name
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_CONTENT_TYPES = ['image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/bmp']
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+
+
+def validate_upload(request):
+    """检查上传文件，返回 (uploaded_file, 错误响应)"""
+    # 访问 request.FILES 时才会读取并解析 multipart 请求体
+    with tracing.span('receive'):
+        return _validate_upload(request)
+
+
+def _validate_upload(request):
+    # 检查是否有文件上传
+    if 'image' not in request.FILES:
+        logger.error("No file in request.FILES")
+        metrics.record_upload_outcome('rejected', 'missing_file')
+        return None, JsonResponse({'error': '没有上传文件'}, status=400)
+
+    uploaded_file = request.FILES['image']
+    error_response = check_file(uploaded_file)
+    if error_response:
+        return None, error_response
+    return uploaded_file, None
+
+
+def check_file(uploaded_file, max_size=MAX_UPLOAD_SIZE):
+    """检查文件类型与大小，不合格时返回错误响应"""
+    logger.info(f"Received file: {uploaded_file.name}, size: {uploaded_file.size}")
+
+    # 验证文件类型
+    if uploaded_file.content_type not in ALLOWED_CONTENT_TYPES:
+        logger.error(f"Invalid file type: {uploaded_file.content_type}")
+        metrics.record_upload_outcome('rejected', 'content_type')
+        return JsonResponse({'error': '不支持的文件类型，请上传图片文件'}, status=400)
+
+    # 验证文件大小（普通上传10MB，分块上传见 CHUNKED_UPLOAD_MAX_SIZE）
+    if uploaded_file.size > max_size:
+        logger.error(f"File too large: {uploaded_file.size} bytes")
+        metrics.record_upload_outcome('rejected', 'too_large')
+        return JsonResponse({'error': f'文件大小不能超过{max_size // (1024 * 1024)}MB'}, status=400)
+
+    return None
+
+
+def inspect_upload(uploaded_file):
+    """上传图片的 (感知哈希, 帧数)；边接收边落盘的上传在接收完成时已经算好，其他文件对象解码一次"""
+    if hasattr(uploaded_file, 'page_count'):
+        return uploaded_file.perceptual_hash, uploaded_file.page_count
+    return similarity.inspect(uploaded_file)
+
+
+def create_image_record(request, uploaded_file, status='processing', priority=ImageUpload.PRIORITY_INTERACTIVE,
+                        perceptual_hash=None):
+    """保存上传文件并创建 ImageUpload 记录；status 为 pending 时进入后台解析队列"""
+    file_hash, page_count = inspect_upload(uploaded_file)
+    if perceptual_hash is None:
+        perceptual_hash = file_hash
+
+    # 保存文件（路径由存储层统一生成；边接收边落盘的上传已在最终目录，本地存储只需改名）
+    name = getattr(uploaded_file, 'storage_name', None) or upload_name(uploaded_file.name)
+    with tracing.span('save', bytes=uploaded_file.size):
+        saved_filename = default_storage.save(name, uploaded_file)
+    metrics.record_media_written('upload', uploaded_file.size)
+
+    with tracing.span('db.create_record'):
+        image_record = ImageUpload.objects.create(
+            image=saved_filename,
+            original_filename=uploaded_file.name,
+            file_size=uploaded_file.size,  # 确保提供file_size
+            status=status,
+            ip_address=client_ip(request) or None,
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            priority=priority,
+            client_key=client_key(request),
+            page_count=page_count,
+            perceptual_hash=perceptual_hash,
+            sha256=getattr(uploaded_file, 'sha256', None) or '',
+            queued_at=timezone.now() if status == 'pending' else None,
+            **(dict(leases.lease_fields(), attempts=1) if status == 'processing' else {}),
+        )
+    tracing.set_attributes(record_id=image_record.id)
+    return image_record
+
+
+def serialize_payload(image_data):
+    """把base64编码后的图片（或解析服务可以下载的地址）序列化为请求体"""
+    return json.dumps({
+        "file": image_data,
+        "fileType": 1,
+    }).encode('ascii')
+
+
+def build_payload(image_bytes):
+    """构造解析服务的请求体（已序列化的JSON字节串）"""
+    image_data = base64.b64encode(image_bytes).decode("ascii")
+    logger.info(f"Image encoded, size: {len(image_data)} characters")
+    return serialize_payload(image_data)
+
+
+def encode_record_image(image_record, file_mode=None):
+    """构造记录的请求体：inline 时读取原始图片内联，url 时只发送签名地址，由解析服务自己下载
+
+    file_mode 为所选后端的设置，默认 LAYOUT_PARSING_FILE_MODE。
+    """
+    with tracing.span('encode') as span:
+        if (file_mode or settings.LAYOUT_PARSING_FILE_MODE) == 'url':
+            body = serialize_payload(parser_file_url(image_record))
+        else:
+            body = build_payload(RecordMedia(image_record).read_image())
+        if span is not None:
+            span.set(bytes=len(body))
+    return body
+
+
+def mark_failed(image_record, error_msg, error_type='error'):
+    """记录失败状态"""
+    logger.error(error_msg)
+    image_record.status = 'failed'
+    image_record.error_message = error_msg[:500]
+    image_record.save()
+    metrics.record_upload_outcome('failed', error_type)
+
+
+class UploadFailed(Exception):
+    """解析失败（记录已标记为失败）"""
+
+    def __init__(self, error_msg, status=500, user_error=None, details=None):
+        super().__init__(error_msg)
+        self.error_msg = error_msg
+        self.status = status
+        self.user_error = user_error or error_msg
+        self.details = details
+
+    def response(self):
+        data = {'error': self.user_error}
+        if self.details is not None:
+            data['details'] = self.details
+        return JsonResponse(data, status=self.status)
+
+
+def fail(image_record, error_msg, status=500, user_error=None, details=None, error_type='error'):
+    """标记记录失败并抛出 UploadFailed"""
+    mark_failed(image_record, error_msg, error_type)
+    raise UploadFailed(error_msg, status=status, user_error=user_error, details=details)
+
+
+def fail_upload(image_record, error_msg, status=500, user_error=None, error_type='error'):
+    """记录失败并返回错误响应"""
+    mark_failed(image_record, error_msg, error_type)
+    return JsonResponse({'error': user_error or error_msg}, status=status)
+
+
+def save_result_files(image_record, media, i, res):
+    """保存单个解析结果的Markdown与图片，返回 (markdown图片路径, 输出图片文件名)"""
+    markdown_image_paths = []
+    images_data = res.get("markdown", {}).get("images", {})
+
+    # 保存markdown文本
+    media.save_markdown(i, res.get("markdown", {}).get("text", ""))
+
+    # 保存Markdown图片并记录路径
+    for img_path, img_data in images_data.items():
+        try:
+            media.save_markdown_image(i, img_path, base64.b64decode(img_data))
+
+            # 记录相对路径（相对于markdown目录）
+            markdown_image_paths.append(img_path)
+
+        except Exception as e:
+            logger.error(f"保存Markdown图片失败: {str(e)}")
+            continue
+
+    # 收集输出图片路径
+    output_image_paths = []
+    output_images_data = res.get("outputImages", {})
+
+    for img_name, img_data in output_images_data.items():
+        try:
+            # 生成输出图片文件名
+            img_filename = f"{img_name}_{image_record.id}_{i}.jpg"
+
+            # 保存输出图片
+            media.save_output_image(img_filename, base64.b64decode(img_data))
+
+            # 记录文件名
+            output_image_paths.append(img_filename)
+
+        except Exception as e:
+            logger.error(f"保存输出图片失败: {str(e)}")
+            continue
+
+    return markdown_image_paths, output_image_paths
+
+
+def create_parse_result(image_record, i, res, markdown_image_paths, output_image_paths):
+    """创建单个解析结果的 ParseResult 记录"""
+    with tracing.span('db.insert_result', result_index=i):
+        result = ParseResult.objects.create(
+            image=image_record,
+            result_index=i,
+            pruned_result=res.get("prunedResult", ""),
+            markdown_text=res.get("markdown", {}).get("text", ""),
+            raw_data=res,
+            markdown_image_paths=markdown_image_paths,
+            output_image_paths=output_image_paths
+        )
+        search.index_new_result(result)
+        layout.index_new_result(result)
+        return result
+
+
+def save_parse_results(image_record, media, results_data):
+    """保存每个解析结果的Markdown、图片与 ParseResult 记录，返回结果页需要的摘要"""
+    save_results = []
+
+    # 处理每个解析结果
+    layout_results = results_data.get("layoutParsingResults", [])
+    for i, res in enumerate(layout_results):
+        with tracing.span('media.write_result', result_index=i):
+            markdown_image_paths, output_image_paths = save_result_files(image_record, media, i, res)
+
+        save_results.append({
+            'index': i,
+            'pruned_result': res.get("prunedResult", ""),
+            'markdown': res.get("markdown", {}).get("text", ""),
+            'markdown_url': media.markdown_url(i),
+            'image_id': image_record.id
+        })
+
+        create_parse_result(image_record, i, res, markdown_image_paths, output_image_paths)
+
+    return save_results
+
+
+def apply_parser_response(image_record, response):
+    """处理解析服务的响应：保存结果并更新状态，返回结果页需要的摘要；失败时抛出 UploadFailed"""
+    logger.info(f"API response received in {response.elapsed:.2f}s, status: {response.status_code}")
+
+    # 更新处理时间
+    image_record.processing_time = response.elapsed
+
+    if response.status_code != 200:
+        fail(image_record, f"API请求失败: {response.status_code}",
+             user_error=f'API请求失败 (状态码: {response.status_code})',
+             details=response.text[:200] if response.content else '', error_type='api_status')
+
+    with tracing.span('decode', bytes=len(response.content)):
+        result = json.loads(response.content)
+    logger.info(f"API returned result with keys: {list(result.keys())}")
+
+    if "result" not in result:
+        fail(image_record, f"API返回格式错误: {result}", user_error='API返回数据格式不正确',
+             error_type='bad_response')
+
+    save_results = save_parse_results(image_record, RecordMedia(image_record), result["result"])
+
+    # 更新状态为完成
+    image_record.status = 'completed'
+    with tracing.span('db.update_record'):
+        image_record.save()
+    metrics.record_upload_outcome('completed')
+    return save_results
+
+
+def check_near_duplicate(request, uploaded_file):
+    """按 near_duplicate 模式处理近似的已解析上传（见 similarity.py）
+
+    返回 (响应, 图片哈希)；响应为 None 时继续正常解析，哈希交给 create_image_record 保存。
+    """
+    perceptual_hash, _ = inspect_upload(uploaded_file)
+    mode = similarity.request_mode(request)
+    if mode == 'off' or perceptual_hash is None:
+        return None, perceptual_hash
+
+    with tracing.span('near_duplicate.lookup', mode=mode):
+        candidates = similarity.near_duplicates(perceptual_hash)
+    if not candidates:
+        return None, perceptual_hash
+    if mode == 'offer':
+        return near_duplicate_offer(candidates), perceptual_hash
+    return reuse_upload(request, uploaded_file, candidates[0][1], perceptual_hash), perceptual_hash
+
+
+def near_duplicate_offer(candidates):
+    """发现近似记录时不保存文件，返回候选记录由调用方决定"""
+    return JsonResponse({
+        'error': '已有近似的图片解析过',
+        'near_duplicates': [{
+            'id': record.id,
+            'original_filename': record.original_filename,
+            'distance': distance,
+            'upload_time': record.upload_time.isoformat(),
+            'record_url': reverse('record_detail', args=[record.id]),
+        } for distance, record in candidates],
+        'hint': '以 near_duplicate=reuse 重新上传可直接复用最接近的结果，near_duplicate=off 则重新解析',
+    }, status=409)
+
+
+def _copy_file(source_media, media, source_name, name, kind):
+    try:
+        with source_media.storage.open(source_name, 'rb') as f:
+            media.write(name, f.read(), kind=kind)
+        return True
+    except FileNotFoundError:
+        logger.warning(f"复用结果时缺少文件: {source_name}")
+        return False
+
+
+def copy_parse_results(source, image_record):
+    """把已有记录的解析结果与媒体文件复制到新记录，返回结果页需要的摘要"""
+    source_media, media = RecordMedia(source), RecordMedia(image_record)
+    save_results = []
+    for result in source.results.order_by('result_index'):
+        i = result.result_index
+        _copy_file(source_media, media, source_media.markdown_name(i), media.markdown_name(i), 'markdown')
+        for img_path in result.markdown_image_paths:
+            _copy_file(source_media, media, source_media.markdown_image_name(i, img_path),
+                       media.markdown_image_name(i, img_path), 'markdown_image')
+
+        # 输出图片的文件名带有记录 id
+        output_image_paths = []
+        suffix = f"_{source.id}_{i}.jpg"
+        for img_filename in result.output_image_paths:
+            new_filename = (img_filename[:-len(suffix)] + f"_{image_record.id}_{i}.jpg"
+                            if img_filename.endswith(suffix) else img_filename)
+            if _copy_file(source_media, media, source_media.output_image_name(img_filename),
+                          media.output_image_name(new_filename), 'output_image'):
+                output_image_paths.append(new_filename)
+
+        with tracing.span('db.insert_result', result_index=i):
+            copy = ParseResult.objects.create(
+                image=image_record,
+                result_index=i,
+                pruned_result=result.pruned_result,
+                markdown_text=result.markdown_text,
+                markdown_image_paths=result.markdown_image_paths,
+                output_image_paths=output_image_paths,
+            )
+            search.index_new_result(copy)
+            layout.index_new_result(copy)
+        save_results.append({
+            'index': i,
+            'pruned_result': result.pruned_result,
+            'markdown': result.markdown_text,
+            'markdown_url': media.markdown_url(i),
+            'image_id': image_record.id,
+        })
+    return save_results
+
+
+def reuse_upload(request, uploaded_file, source, perceptual_hash):
+    """保存上传并复用近似记录的解析结果，不调用解析服务"""
+    start = time.perf_counter()
+    image_record = create_image_record(request, uploaded_file, perceptual_hash=perceptual_hash)
+    with leases.hold(image_record.id), tracing.span('near_duplicate.reuse', source_id=source.id):
+        try:
+            save_results = copy_parse_results(source, image_record)
+        except Exception as e:
+            return fail_processing(image_record, e)
+        image_record.status = 'completed'
+        image_record.reused_from = source
+        image_record.processing_time = time.perf_counter() - start
+        image_record.save()
+    metrics.record_upload_outcome('reused')
+    logger.info(f"记录 {image_record.id} 复用了近似记录 {source.id} 的解析结果")
+
+    if request.POST.get('mode') == 'stream':
+        return JsonResponse({
+            'id': image_record.id,
+            'status': image_record.status,
+            'reused_from': source.id,
+            'events_url': reverse('upload_events', args=[image_record.id]),
+            'progress_url': reverse('upload_progress', args=[image_record.id]),
+            'record_url': reverse('record_detail', args=[image_record.id]),
+        })
+    return render_upload_result(request, image_record, save_results)
+
+
+def render_upload_result(request, image_record, save_results):
+    """结果页面"""
+    media = RecordMedia(image_record)
+    context = {
+        'original_image_url': media.image_url,
+        'results': save_results,
+        'image_id': image_record.id,
+        'filename': image_record.original_filename,
+        'media_dir': media.directory,
+    }
+    with tracing.span('render'):
+        return render(request, 'result.html', context)
+
+
+def finish_upload(request, image_record, response):
+    """处理解析服务的响应并返回结果页或错误"""
+    try:
+        save_results = apply_parser_response(image_record, response)
+    except UploadFailed as e:
+        return e.response()
+    return render_upload_result(request, image_record, save_results)
+
+
+def parse_record(image_record):
+    """同步完成一条记录的解析（读取、调用解析服务、保存结果），失败时抛出 UploadFailed"""
+    with parser_pool.choose() as backend_call:
+        body = encode_record_image(image_record, backend_call.backend.file_mode)
+
+        logger.info(f"Calling API: {backend_call.backend.url}")
+        try:
+            response = parser_client.post(body, backend_call=backend_call)
+        except parser_client.ParserTimeout:
+            fail(image_record, 'API请求超时，请稍后重试', status=504, error_type='timeout')
+        except parser_client.ParserRequestError as e:
+            fail(image_record, f'网络请求错误: {str(e)}', error_type='network')
+
+    return apply_parser_response(image_record, response)
+
+
+def fail_processing(image_record, e):
+    """处理过程中出现未预期的异常"""
+    error_msg = f'处理错误: {str(e)}'
+    logger.error(f"Error processing file: {error_msg}", exc_info=True)
+    image_record.status = 'failed'
+    image_record.error_message = error_msg[:500]
+    image_record.save()
+    metrics.record_upload_outcome('failed', 'exception')
+    return JsonResponse({'error': error_msg}, status=500)
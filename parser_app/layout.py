@@ -0,0 +1,99 @@
+# parser_app/layout.py
+"""版面区块表
+
+每条解析结果的精简结果中有版面区块列表（parsing_res_list：block_label、block_bbox、block_order、block_content）。
+写入结果时把区块提取到 LayoutBlock 表，类型、页码、位置都是普通列并建有索引，
+“所有带表格的页面”这类跨文档查询直接走索引，不再逐行解压、解析 pruned_result。
+没有 parsing_res_list 的旧结果退回使用版面检测框（layout_det_res.boxes，只有类型与坐标）。
+已有数据用 python manage.py backfill_layout_blocks 补齐。
+"""
+from .models import LayoutBlock
+from .search import load_structure
+
+
+def _bbox(value):
+    """[x0, y0, x1, y1]；多边形（点列表或扁平坐标）取外接矩形，无法识别时返回 None"""
+    if not isinstance(value, (list, tuple)):
+        return None
+    numbers = []
+    for item in value:
+        if isinstance(item, (list, tuple)):
+            numbers.extend(item)
+        else:
+            numbers.append(item)
+    if len(numbers) < 4 or len(numbers) % 2 or not all(isinstance(n, (int, float)) for n in numbers):
+        return None
+    if len(numbers) == 4:
+        return [float(n) for n in numbers]
+    xs, ys = numbers[0::2], numbers[1::2]
+    return [float(min(xs)), float(min(ys)), float(max(xs)), float(max(ys))]
+
+
+def _order(value):
+    return value if isinstance(value, int) and value >= 0 else None
+
+
+def extract(pruned_result):
+    """精简结果中的区块 [{label, order, bbox, text}]，按列表中的顺序"""
+    structure = load_structure(pruned_result)
+    if not isinstance(structure, dict):
+        return []
+    blocks = structure.get('parsing_res_list')
+    if isinstance(blocks, list):
+        return [{
+            'label': str(block.get('block_label') or 'unknown')[:50],
+            'order': _order(block.get('block_order')),
+            'bbox': _bbox(block.get('block_bbox')),
+            'text': block.get('block_content') if isinstance(block.get('block_content'), str) else '',
+        } for block in blocks if isinstance(block, dict)]
+    boxes = (structure.get('layout_det_res') or {}).get('boxes')
+    if isinstance(boxes, list):
+        return [{
+            'label': str(box.get('label') or 'unknown')[:50],
+            'order': None,
+            'bbox': _bbox(box.get('coordinate')),
+            'text': '',
+        } for box in boxes if isinstance(box, dict)]
+    return []
+
+
+def blocks_for(result):
+    """结果的 LayoutBlock 对象（未保存）"""
+    entries = []
+    for position, block in enumerate(extract(result.pruned_result)):
+        x0, y0, x1, y1 = block['bbox'] or (None, None, None, None)
+        entries.append(LayoutBlock(
+            result_id=result.pk, image_id=result.image_id, page=result.result_index, position=position,
+            order=block['order'], label=block['label'], x0=x0, y0=y0, x1=x1, y1=y1, text=block['text'],
+        ))
+    return entries
+
+
+def index_new_result(result):
+    """为新建的结果写入区块"""
+    LayoutBlock.objects.bulk_create(blocks_for(result))
+
+
+def rebuild(results):
+    """批量重建区块；results 为 ParseResult 的可迭代对象，返回写入的区块数"""
+    results = list(results)
+    entries = [entry for result in results for entry in blocks_for(result)]
+    LayoutBlock.objects.filter(result_id__in=[result.pk for result in results]).delete()
+    LayoutBlock.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def image_ids_with(label):
+    """含有该类型区块的记录的 id（子查询）"""
+    return LayoutBlock.objects.filter(label=label).values('image_id')
+
+
+def block_data(block):
+    return {
+        'page': block.page,
+        'position': block.position,
+        'order': block.order,
+        'label': block.label,
+        'bbox': block.bbox,
+        'text': block.text,
+    }
@@ -0,0 +1,155 @@
+# parser_app/leases.py
+"""处理中记录的租约
+
+记录进入 processing 时写入处理者（主机名:进程号）和租约到期时间，处理次数加一。
+每个 worker 进程有一个心跳线程，定期为本进程正在处理的记录续约，并顺带回收过期的租约：
+- worker 被杀（超时、OOM、重新部署）后不再续约，租约过期的记录放回 pending 重新调度；
+- 处理次数达到 PARSE_MAX_ATTEMPTS 的记录不再重试，标记为失败。
+也可以用 manage.py reap_leases 手动回收。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import metrics
+from .models import ImageUpload
+
+logger = logging.getLogger(__name__)
+
+LEASE_EXPIRED_MESSAGE = '处理中断（租约过期）次数过多，不再重试'
+
+
+def owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_fields(now=None):
+    """开始处理一条记录时写入的字段（处理次数由调用方加一）"""
+    now = now or timezone.now()
+    return {
+        'lease_owner': owner(),
+        'lease_expires_at': now + timedelta(seconds=settings.PARSE_LEASE_SECONDS),
+        'heartbeat_at': now,
+    }
+
+
+def renew(record_ids, now=None):
+    """为本进程持有的记录续约，返回续约成功的条数"""
+    if not record_ids:
+        return 0
+    now = now or timezone.now()
+    return ImageUpload.objects.filter(id__in=record_ids, status='processing', lease_owner=owner()).update(
+        lease_expires_at=now + timedelta(seconds=settings.PARSE_LEASE_SECONDS), heartbeat_at=now,
+    )
+
+
+def release(record_id):
+    """处理结束后清除租约"""
+    ImageUpload.objects.filter(id=record_id, lease_owner=owner()).update(lease_owner='', lease_expires_at=None)
+
+
+def expired(now=None):
+    return ImageUpload.objects.filter(status='processing', lease_expires_at__lt=now or timezone.now())
+
+
+def reap(now=None):
+    """回收过期的租约，返回 (放回队列的条数, 标记失败的条数)"""
+    now = now or timezone.now()
+    stale = expired(now)
+    failed = stale.filter(attempts__gte=settings.PARSE_MAX_ATTEMPTS).update(
+        status='failed', error_message=LEASE_EXPIRED_MESSAGE,
+        lease_owner='', lease_expires_at=None, updated_at=now,
+    )
+    requeued = stale.update(
+        status='pending', queued_at=now, started_at=None,
+        lease_owner='', lease_expires_at=None, updated_at=now,
+    )
+    if requeued or failed:
+        logger.warning(f"回收过期租约：放回队列 {requeued} 条，标记失败 {failed} 条")
+        metrics.record_leases_reaped(requeued, failed)
+    return requeued, failed
+
+
+class LeaseKeeper:
+    """本进程正在处理的记录与心跳线程"""
+
+    def __init__(self):
+        self.active = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='lease-heartbeat', daemon=True)
+        self.on_requeue = None
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, record_id):
+        with self.lock:
+            self.active.add(record_id)
+
+    def discard(self, record_id):
+        with self.lock:
+            self.active.discard(record_id)
+
+    def run(self):
+        while True:
+            time.sleep(settings.PARSE_HEARTBEAT_INTERVAL)
+            try:
+                close_old_connections()
+                with self.lock:
+                    active = list(self.active)
+                renewed = renew(active)
+                if renewed < len(active):
+                    logger.warning(f"{len(active) - renewed} 条记录的租约已失效（可能已被放回队列）")
+                requeued, _ = reap()
+                if requeued and self.on_requeue:
+                    self.on_requeue()
+            except Exception as e:
+                logger.error(f"续约或回收租约失败: {str(e)}", exc_info=True)
+
+
+_keeper = LeaseKeeper()
+_keeper_pid = None
+_keeper_lock = threading.Lock()
+
+
+def start_keeper(on_requeue=None):
+    """启动本进程的心跳线程（可重复调用；fork 出的子进程会重新启动）"""
+    global _keeper, _keeper_pid
+    with _keeper_lock:
+        if _keeper_pid != os.getpid():
+            if _keeper_pid is not None:
+                _keeper = LeaseKeeper()
+            _keeper.on_requeue = on_requeue
+            _keeper_pid = os.getpid()
+            _keeper.start()
+    return _keeper
+
+
+@contextmanager
+def hold(record_id):
+    """处理期间由心跳线程续约，结束后清除租约"""
+    _keeper.add(record_id)
+    try:
+        yield
+    finally:
+        _keeper.discard(record_id)
+        release(record_id)
+
+
+@asynccontextmanager
+async def ahold(record_id):
+    _keeper.add(record_id)
+    try:
+        yield
+    finally:
+        _keeper.discard(record_id)
+        await sync_to_async(release)(record_id)
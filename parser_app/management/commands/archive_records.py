@@ -0,0 +1,76 @@
+# parser_app/management/commands/archive_records.py
+"""归档旧记录
+
+把超过保留期（--days，默认 RETENTION_DAYS）的已完成记录的结果文件与 raw_data 打包成
+每条记录一个 zip（见 parser_app/retention.py），删除原文件并清空 raw_data。
+查看已归档的记录时会自动解压到还原缓存。--vacuum 在归档后整理数据库文件，真正归还磁盘空间。
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from parser_app import retention
+from parser_app.management.commands.loadtest import format_bytes
+
+
+class Command(BaseCommand):
+    help = '把超过保留期的记录的结果文件与原始数据打包归档'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help=f'归档多少天前上传的记录（默认 RETENTION_DAYS={settings.RETENTION_DAYS}）')
+        parser.add_argument('--limit', type=int, default=None, help='本次最多归档的记录数')
+        parser.add_argument('--dry-run', action='store_true', help='只列出将要归档的记录')
+        parser.add_argument('--vacuum', action='store_true', help='归档后整理数据库（SQLite 执行 VACUUM）')
+
+    def handle(self, *args, **options):
+        records = retention.archivable(options['days']).order_by('upload_time')
+        if options['limit']:
+            records = records[:options['limit']]
+
+        archived = failed = 0
+        media_bytes = archive_bytes = payload_bytes = 0
+        for record in records.iterator():
+            if options['dry_run']:
+                self.stdout.write(f"{record.id} {record.original_filename} 上传于 {record.upload_time:%Y-%m-%d}")
+                archived += 1
+                continue
+            try:
+                stats = retention.archive_record(record)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{record.id} {record.original_filename} 归档失败: {e}")
+                continue
+            archived += 1
+            media_bytes += stats.media_bytes
+            archive_bytes += stats.archive_bytes
+            payload_bytes += stats.payload_bytes
+            self.stdout.write(
+                f"{record.id} {record.original_filename}: {stats.files} 个文件 "
+                f"{format_bytes(stats.media_bytes)} -> {format_bytes(stats.archive_bytes)}"
+            )
+
+        if options['dry_run']:
+            self.stdout.write(f"将归档 {archived} 条记录")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"归档 {archived} 条记录（失败 {failed} 条）：媒体文件 {format_bytes(media_bytes)} -> "
+            f"归档 {format_bytes(archive_bytes)}，数据库清空原始数据 {format_bytes(payload_bytes)}"
+        ))
+        if options['vacuum']:
+            self.vacuum()
+
+    def vacuum(self):
+        if connection.vendor == 'sqlite':
+            path = connection.settings_dict['NAME']
+            before = os.path.getsize(path)
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write(f"数据库文件 {format_bytes(before)} -> {format_bytes(os.path.getsize(path))}")
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM ANALYZE parser_app_parseresult')
+            self.stdout.write('已对 parser_app_parseresult 执行 VACUUM ANALYZE')
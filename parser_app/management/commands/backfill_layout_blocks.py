@@ -0,0 +1,33 @@
+# parser_app/management/commands/backfill_layout_blocks.py
+"""从已有结果的精简结果中提取版面区块（见 parser_app/layout.py）
+
+新上传的结果写入时就会提取；升级前的结果、用 bulk_create 直接导入的结果，或修改了提取规则后，用本命令补齐。
+"""
+from django.core.management.base import BaseCommand
+
+from parser_app import layout
+from parser_app.models import ParseResult
+
+
+class Command(BaseCommand):
+    help = '从已有解析结果中提取版面区块'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='只处理还没有区块的结果')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        results = ParseResult.objects.order_by('pk').only('pk', 'image_id', 'result_index', 'pruned_result')
+        if options['missing']:
+            results = results.filter(blocks__isnull=True)
+
+        total_results = total_blocks = 0
+        last = 0
+        while True:
+            batch = list(results.filter(pk__gt=last)[:options['batch_size']])
+            if not batch:
+                break
+            total_blocks += layout.rebuild(batch)
+            total_results += len(batch)
+            last = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"已为 {total_results} 条结果提取 {total_blocks} 个版面区块"))
@@ -0,0 +1,69 @@
+# parser_app/management/commands/benchmark.py
+"""运行上传解析流程的分阶段基准测试
+
+    python manage.py benchmark                 与基线比较，有阶段退化时返回非零
+    python manage.py benchmark --record        重新记录基线
+    python manage.py benchmark --fixture large --stage write_media --repeat 20
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from parser_app.benchmarks import (
+    BASELINE_PATH, CALIBRATION_KEY, DEFAULT_THRESHOLD, FIXTURES, STAGES,
+    find_regressions, load_baseline, run_benchmarks, save_baseline, speed_factor,
+)
+
+
+class Command(BaseCommand):
+    help = '分阶段测量上传解析流程的耗时，并与记录的基线比较'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture', action='append', choices=list(FIXTURES), help='只运行指定数据集，可重复')
+        parser.add_argument('--stage', action='append', choices=STAGES, help='只运行指定阶段，可重复')
+        parser.add_argument('--repeat', type=int, default=5, help='每个阶段的样本数（取最快的一次）')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='相对基线允许的变慢比例')
+        parser.add_argument('--baseline', default=BASELINE_PATH, help='基线文件')
+        parser.add_argument('--record', action='store_true', help='把本次结果写入基线文件')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(options['fixture'], options['stage'], options['repeat'])
+        baseline = load_baseline(options['baseline'])
+        factor = speed_factor(results, baseline)
+
+        self.stdout.write(f"校准系数: {factor:.2f}（当前机器相对基线的耗时比例，基线按此缩放）")
+        self.stdout.write(f"{'数据集':<10} {'阶段':<16} {'耗时(ms)':>10} {'基线(ms)':>10} {'变化':>8}")
+        for fixture, stages in results.items():
+            if fixture == CALIBRATION_KEY:
+                continue
+            for stage, seconds in stages.items():
+                base = baseline.get(fixture, {}).get(stage)
+                base = base * factor if base else None
+                change = f"{(seconds / base - 1) * 100:+.0f}%" if base else '-'
+                base_ms = f"{base * 1000:.2f}" if base else '-'
+                self.stdout.write(f"{fixture:<12} {stage:<18} {seconds * 1000:>10.2f} {base_ms:>10} {change:>8}")
+
+        if options['record']:
+            # 只覆盖本次运行的部分，保留其他数据集/阶段的基线
+            # 校准耗时按本次结果整体缩放已有基线，保持两者一致
+            if factor != 1.0:
+                for fixture, stages in baseline.items():
+                    if fixture != CALIBRATION_KEY:
+                        for stage in stages:
+                            stages[stage] *= factor
+            for fixture, stages in results.items():
+                if fixture == CALIBRATION_KEY:
+                    baseline[fixture] = stages
+                else:
+                    baseline.setdefault(fixture, {}).update(stages)
+            save_baseline(baseline, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"基线已写入 {options['baseline']}"))
+            return
+
+        regressions = find_regressions(results, baseline, options['threshold'])
+        if regressions:
+            lines = [
+                f"{fixture}/{stage}: {seconds * 1000:.2f}ms > 基线 {base * 1000:.2f}ms"
+                for fixture, stage, seconds, base in regressions
+            ]
+            raise CommandError(f"以下阶段比基线慢 {options['threshold'] * 100:.0f}% 以上:\n" + '\n'.join(lines))
+        self.stdout.write(self.style.SUCCESS('没有阶段超过退化阈值'))
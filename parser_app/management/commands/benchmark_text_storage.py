@@ -0,0 +1,146 @@
+# parser_app/management/commands/benchmark_text_storage.py
+"""比较解析结果正文明文存储与压缩存储的数据库大小、读取与搜索耗时
+
+    python manage.py benchmark_text_storage --rows 5000 --codec zlib
+
+用 mock_parser 生成与真实接口结构相同的结果（Markdown 由区块内容拼成，含 HTML 表格），
+分别写入两个临时 SQLite 数据库：
+- plain:      markdown_text / pruned_result 为 TEXT（压缩前的表结构），搜索直接 LIKE 正文；
+- compressed: 两列为 CompressedTextField 的二进制格式，另建搜索索引表（见 parser_app/search.py）。
+写入耗时包含压缩与生成搜索文本，读取耗时包含解压，搜索耗时为一次全表 LIKE 匹配。mock_parser 的文字来自很小的词表，
+压缩率比真实文档高，应以真实数据库上的结果为准（迁移前后各执行一次 VACUUM 再比较文件大小）。
+"""
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from parser_app.fields import CODECS, compress_text, decompress_text
+from parser_app.management.commands.loadtest import format_bytes
+from parser_app.mock_parser import MockParserConfig, fake_text, make_page_result
+from parser_app.search import search_text
+
+SCHEMAS = {
+    'plain': [
+        'CREATE TABLE result (id INTEGER PRIMARY KEY, image_id INTEGER, pruned_result TEXT, markdown_text TEXT)',
+    ],
+    'compressed': [
+        'CREATE TABLE result (id INTEGER PRIMARY KEY, image_id INTEGER, pruned_result BLOB, markdown_text BLOB)',
+        'CREATE TABLE search_index (result_id INTEGER PRIMARY KEY, image_id INTEGER, content TEXT)',
+        'CREATE INDEX search_index_image ON search_index (image_id)',
+    ],
+}
+SEARCH_SQL = {
+    'plain': 'SELECT DISTINCT image_id FROM result WHERE pruned_result LIKE ? OR markdown_text LIKE ?',
+    'compressed': 'SELECT DISTINCT image_id FROM search_index WHERE content LIKE ?',
+}
+
+
+def table_html(rnd, rows=6, cols=4):
+    cells = ''.join(
+        '<tr>' + ''.join(f"<td>{fake_text(rnd, 12)}</td>" for _ in range(cols)) + '</tr>' for _ in range(rows)
+    )
+    return f"<html><body><table>{cells}</table></body></html>"
+
+
+def generate_rows(count, blocks, seed):
+    """与真实接口一样，Markdown 由各区块的内容拼成（表格区块的内容是 HTML）"""
+    config = MockParserConfig(markdown_chars=0, images_per_page=1, image_size=16, blocks_per_page=blocks,
+                              output_images=False, seed=seed)
+    for i in range(count):
+        pruned = make_page_result(config, i % 8)['prunedResult']
+        sections = []
+        for block in pruned['parsing_res_list']:
+            if block['block_label'] == 'table':
+                block['block_content'] = table_html(config.random)
+            if block['block_label'] in ('doc_title', 'paragraph_title'):
+                sections.append('# ' + block['block_content'])
+            elif block['block_content']:
+                sections.append(block['block_content'])
+        yield i + 1, i // 2 + 1, pruned, '\n\n'.join(sections)
+
+
+class Command(BaseCommand):
+    help = '比较结果正文明文与压缩存储的数据库大小、读取与搜索耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='结果行数')
+        parser.add_argument('--blocks', type=int, default=24, help='每条结果（每页）的区块数')
+        parser.add_argument('--codec', choices=[codec for codec in CODECS if codec != 'none'], default='zlib')
+        parser.add_argument('--reads', type=int, default=2000, help='按主键随机读取的次数')
+        parser.add_argument('--searches', type=int, default=20, help='搜索次数')
+        parser.add_argument('--query', default='段落 OCR', help='搜索词')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows = list(generate_rows(options['rows'], options['blocks'], options['seed']))
+        with tempfile.TemporaryDirectory() as directory:
+            results = {layout: self.measure(layout, os.path.join(directory, f"{layout}.sqlite3"), rows, options)
+                       for layout in SCHEMAS}
+
+        self.stdout.write(f"{options['rows']} 条结果，编码 {options['codec']}")
+        self.stdout.write(f"{'':<12} {'数据库大小':>12} {'写入(s)':>10} {'读取p50(ms)':>12} {'读取p99(ms)':>12} {'搜索(ms)':>10}")
+        for layout, result in results.items():
+            self.stdout.write(
+                f"{layout:<12} {format_bytes(result['size']):>12} {result['write']:>10.2f} "
+                f"{result['read_p50'] * 1000:>12.3f} {result['read_p99'] * 1000:>12.3f} {result['search'] * 1000:>10.2f}"
+            )
+        plain, compressed = results['plain'], results['compressed']
+        self.stdout.write(self.style.SUCCESS(
+            f"数据库大小 {compressed['size'] / plain['size']:.0%}，读取 p50 {compressed['read_p50'] / plain['read_p50']:.2f} 倍，"
+            f"搜索 {compressed['search'] / plain['search']:.2f} 倍"
+        ))
+
+    def measure(self, layout, path, rows, options):
+        conn = sqlite3.connect(path)
+        for statement in SCHEMAS[layout]:
+            conn.execute(statement)
+
+        start = time.perf_counter()
+        with conn:
+            if layout == 'plain':
+                conn.executemany('INSERT INTO result VALUES (?, ?, ?, ?)', [
+                    (pk, image_id, str(pruned), markdown) for pk, image_id, pruned, markdown in rows
+                ])
+            else:
+                conn.executemany('INSERT INTO result VALUES (?, ?, ?, ?)', [
+                    (pk, image_id, compress_text(str(pruned), options['codec']), compress_text(markdown, options['codec']))
+                    for pk, image_id, pruned, markdown in rows
+                ])
+                conn.executemany('INSERT INTO search_index VALUES (?, ?, ?)', [
+                    (pk, image_id, search_text(markdown, pruned)) for pk, image_id, pruned, markdown in rows
+                ])
+        write = time.perf_counter() - start
+        conn.execute('VACUUM')
+        size = os.path.getsize(path)
+
+        rnd = random.Random(options['seed'])
+        timings = []
+        for _ in range(options['reads']):
+            pk = rnd.randint(1, len(rows))
+            start = time.perf_counter()
+            pruned, markdown = conn.execute(
+                'SELECT pruned_result, markdown_text FROM result WHERE id = ?', (pk,)).fetchone()
+            decompress_text(pruned), decompress_text(markdown)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        pattern = f"%{options['query']}%"
+        params = (pattern, pattern) if layout == 'plain' else (pattern,)
+        start = time.perf_counter()
+        for _ in range(options['searches']):
+            conn.execute(SEARCH_SQL[layout], params).fetchall()
+        search = (time.perf_counter() - start) / options['searches']
+        conn.close()
+
+        return {
+            'size': size,
+            'write': write,
+            'read_p50': statistics.median(timings),
+            'read_p99': timings[int(len(timings) * 0.99) - 1],
+            'search': search,
+        }
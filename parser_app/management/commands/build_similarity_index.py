@@ -0,0 +1,59 @@
+# parser_app/management/commands/build_similarity_index.py
+"""为上传记录计算图片哈希并写入近似图片索引的快照（见 parser_app/similarity.py）
+
+worker 进程启动后首次查找时读取快照，只需从数据库追加快照之后的新记录，不必重建整棵树。
+可以定期运行（如每天一次）让快照保持较新；--backfill 为升级前上传、还没有哈希的记录补算。
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from parser_app import similarity
+from parser_app.models import ImageUpload
+from parser_app.storage import RecordMedia
+
+BACKFILL_BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = '计算上传图片的感知哈希并保存近似图片索引快照'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true', help='为没有哈希的记录补算')
+        parser.add_argument('--output', default=None, help='快照路径（默认 SIMILARITY_INDEX_PATH）')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill()
+
+        start = time.perf_counter()
+        index = similarity.build_index()
+        path = options['output'] or settings.SIMILARITY_INDEX_PATH
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"已索引 {index.tree.size} 条记录（最大 id {index.max_id}），用时 {time.perf_counter() - start:.2f}s，写入 {path}"
+        ))
+
+    def backfill(self):
+        records = ImageUpload.objects.filter(perceptual_hash__isnull=True).exclude(image='').order_by('id')
+        hashed = unreadable = 0
+        last = 0
+        while True:
+            batch = list(records.filter(id__gt=last).only('id', 'image')[:BACKFILL_BATCH_SIZE])
+            if not batch:
+                break
+            last = batch[-1].id
+            for record in batch:
+                media = RecordMedia(record)
+                try:
+                    with media.storage.open(record.image.name, 'rb') as f:
+                        record.perceptual_hash = similarity.file_hash(f)
+                except FileNotFoundError:
+                    record.perceptual_hash = None
+                if record.perceptual_hash is None:
+                    unreadable += 1
+                else:
+                    hashed += 1
+            ImageUpload.objects.bulk_update([r for r in batch if r.perceptual_hash is not None], ['perceptual_hash'])
+        self.stdout.write(f"补算哈希 {hashed} 条，无法读取 {unreadable} 条")
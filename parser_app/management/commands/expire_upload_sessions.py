@@ -0,0 +1,27 @@
+# parser_app/management/commands/expire_upload_sessions.py
+"""清理过期的分块上传会话（见 parser_app/uploads.py）
+
+会话在最后一次写入后 CHUNKED_UPLOAD_EXPIRE_HOURS 小时过期，未完成的临时文件随之删除。建议用 cron 定期运行。
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from parser_app import uploads
+from parser_app.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = '删除过期的分块上传会话与临时文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只列出过期的会话')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['dry_run']:
+            for session in UploadSession.objects.filter(expires_at__lt=now).order_by('expires_at'):
+                self.stdout.write(f"{session.id} {session.filename} {session.offset}/{session.size} "
+                                  f"{session.get_status_display()} 过期于 {session.expires_at:%Y-%m-%d %H:%M:%S}")
+            return
+        count = uploads.expire_sessions(now)
+        self.stdout.write(self.style.SUCCESS(f"已清理 {count} 个过期的上传会话"))
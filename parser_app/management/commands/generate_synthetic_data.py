@@ -0,0 +1,242 @@
+# parser_app/management/commands/generate_synthetic_data.py
+"""批量生成模拟的上传记录与解析结果，用于在大数据量下测试历史记录、统计、导出与管理后台
+
+    python manage.py generate_synthetic_data --records 1000000 --days 365
+    python manage.py generate_synthetic_data --delete
+
+分布参照线上数据：约 90% 完成、10% 失败；上传时间在 --days 天内、越近越密集；
+文件大小与 Markdown 长度为对数正态分布；大多数记录 1 页，少数多页文档最多 30 页。
+不生成 pending / processing 的记录，以免后台调度线程认领这些没有文件的记录去解析。
+
+记录与结果按批 bulk_create（每批一个事务），正文仍经过 CompressedTextField 压缩；
+搜索索引与版面区块随每批一起写入（--no-index 跳过，之后可用 rebuild_search_index / backfill_layout_blocks 补齐）。
+--media 同时写出原始图片与 Markdown 文件，详情页与文件下发才能完整访问，速度慢很多。
+生成的记录 user_agent 为 synthetic-data，--delete 只删除这些记录。
+"""
+import ipaddress
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from parser_app import layout, search
+from parser_app.mock_parser import BLOCK_LABELS, fake_image, fake_text
+from parser_app.models import ImageUpload, LayoutBlock, ParseResult, ResultSearchIndex
+from parser_app.storage import RecordMedia, upload_name
+
+SYNTHETIC_AGENT = 'synthetic-data'
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+CORPUS_CHARS = 200_000
+EXTENSIONS = ['jpg'] * 6 + ['png'] * 3 + ['gif']
+ERRORS = [
+    ('API请求超时，请稍后重试', 4),
+    ('API请求失败: 500', 3),
+    ('网络请求错误: Connection reset by peer', 2),
+    ('处理错误: cannot identify image file', 1),
+]
+PRIORITIES = [ImageUpload.PRIORITY_INTERACTIVE] * 7 + [ImageUpload.PRIORITY_BATCH] * 2 + [ImageUpload.PRIORITY_REPROCESS]
+DELETE_BATCH_SIZE = 5000
+
+
+@contextmanager
+def preserve_timestamps(*fields):
+    """临时关闭 auto_now / auto_now_add，bulk_create 时保留生成的时间"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field, _, _ in saved:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def insert_rows(model, columns, rows):
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ', '.join(connection.ops.quote_name(model._meta.get_field(column).column) for column in columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({names}) VALUES ({placeholders})', rows)
+
+
+class Generator:
+    """按固定种子生成记录与结果"""
+
+    def __init__(self, seed, days, raw_data):
+        self.rnd = random.Random(seed)
+        self.now = timezone.now()
+        self.days = days
+        self.raw_data = raw_data
+        # 正文从一段预先生成的文字中截取，逐字生成在百万行时太慢
+        self.corpus = fake_text(self.rnd, CORPUS_CHARS)
+        self.errors = [message for message, weight in ERRORS for _ in range(weight)]
+        self.network = ipaddress.ip_network('10.0.0.0/16')
+
+    def lognormal(self, median, sigma, low, high):
+        return int(min(max(self.rnd.lognormvariate(math.log(median), sigma), low), high))
+
+    def page_count(self):
+        roll = self.rnd.random()
+        if roll < 0.8:
+            return 1
+        if roll < 0.95:
+            return self.rnd.randint(2, 5)
+        return self.rnd.randint(6, 30)
+
+    def upload_time(self):
+        # 平方使近期更密集（业务量逐渐增长）
+        return self.now - timedelta(seconds=self.rnd.random() ** 2 * self.days * 86400)
+
+    def text(self, length):
+        start = self.rnd.randrange(0, CORPUS_CHARS - length)
+        return self.corpus[start:start + length]
+
+    def record(self, n):
+        rnd = self.rnd
+        uploaded = self.upload_time()
+        failed = rnd.random() < 0.1
+        processing_time = round(rnd.lognormvariate(math.log(8), 0.6), 2)
+        queue_wait = round(rnd.expovariate(1 / 3), 2)
+        ext = rnd.choice(EXTENSIONS)
+        return ImageUpload(
+            image=upload_name(f'scan.{ext}'),
+            original_filename=f'scan_{n:07d}.{ext}',
+            file_size=self.lognormal(600 * 1024, 0.9, 20 * 1024, MAX_UPLOAD_SIZE),
+            upload_time=uploaded,
+            updated_at=uploaded + timedelta(seconds=queue_wait + processing_time),
+            status='failed' if failed else 'completed',
+            error_message=rnd.choice(self.errors) if failed else '',
+            processing_time=None if failed and rnd.random() < 0.5 else processing_time,
+            ip_address=str(self.network[rnd.randrange(1, self.network.num_addresses - 1)]),
+            user_agent=SYNTHETIC_AGENT,
+            priority=rnd.choice(PRIORITIES),
+            client_key='synthetic',
+            page_count=self.page_count(),
+            queued_at=uploaded,
+            started_at=uploaded + timedelta(seconds=queue_wait),
+            queue_wait=queue_wait,
+            attempts=1,
+        )
+
+    def pruned_result(self, page, sections):
+        blocks = []
+        height = 1754
+        for order, (label, content) in enumerate(sections):
+            top = int(height * order / len(sections))
+            blocks.append({
+                'block_label': label,
+                'block_content': content,
+                'block_bbox': [60, top + 10, 1180, top + int(height / len(sections)) - 10],
+                'block_id': order,
+                'block_order': order + 1,
+            })
+        return {'page_index': page, 'width': 1240, 'height': height, 'parsing_res_list': blocks}
+
+    def results(self, record):
+        """已完成记录每页一条结果"""
+        results = []
+        for page in range(record.page_count):
+            length = self.lognormal(2000, 0.8, 50, 50_000)
+            blocks = self.rnd.randint(3, 12)
+            chunk = max(length // blocks, 1)
+            sections = [(self.rnd.choice(BLOCK_LABELS), self.text(chunk)) for _ in range(blocks)]
+            markdown = '\n\n'.join(('# ' if label.endswith('title') else '') + content for label, content in sections)
+            pruned = self.pruned_result(page, sections)
+            results.append(ParseResult(
+                image=record,
+                result_index=page,
+                # 与 ingest 一样传入 dict（保存时转为字符串），生成索引时不必再解析
+                pruned_result=pruned,
+                markdown_text=markdown,
+                raw_data={'prunedResult': pruned, 'markdown': {'text': markdown, 'images': {}}} if self.raw_data else None,
+                created_at=record.updated_at,
+            ))
+        return results
+
+
+class Command(BaseCommand):
+    help = '批量生成模拟的上传记录与解析结果（大数据量测试用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=10000, help='生成的上传记录数')
+        parser.add_argument('--days', type=int, default=365, help='上传时间分布在最近多少天内')
+        parser.add_argument('--batch-size', type=int, default=2000, help='每批（每个事务）的记录数')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--raw-data', action='store_true', help='同时填充 raw_data（不含图片）')
+        parser.add_argument('--media', action='store_true', help='同时写出原始图片与 Markdown 文件')
+        parser.add_argument('--no-index', action='store_true', help='不写入搜索索引与版面区块')
+        parser.add_argument('--delete', action='store_true', help='删除以前生成的模拟记录')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            self.delete()
+            return
+
+        generator = Generator(options['seed'], options['days'], options['raw_data'])
+        image = fake_image(64) if options['media'] else None
+        total_records = total_results = 0
+        start = time.perf_counter()
+        with preserve_timestamps(ImageUpload._meta.get_field('upload_time'),
+                                 ImageUpload._meta.get_field('updated_at'),
+                                 ParseResult._meta.get_field('created_at')):
+            while total_records < options['records']:
+                count = min(options['batch_size'], options['records'] - total_records)
+                records = [generator.record(total_records + i) for i in range(count)]
+                with transaction.atomic():
+                    ImageUpload.objects.bulk_create(records)
+                    results = [result for record in records if record.status == 'completed'
+                               for result in generator.results(record)]
+                    ParseResult.objects.bulk_create(results)
+                    if not options['no_index']:
+                        self.write_indexes(results)
+                if image is not None:
+                    self.write_media(records, results, image)
+
+                total_records += count
+                total_results += len(results)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{total_records}/{options['records']} 条记录，{total_results} 条结果，"
+                                  f"{total_records / elapsed:.0f} 条/秒")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"生成 {total_records} 条记录、{total_results} 条结果，用时 {time.perf_counter() - start:.1f}s"))
+
+    def write_indexes(self, results):
+        """搜索索引与版面区块；区块行数是结果的十几倍，直接 executemany，跳过模型实例化与逐字段的值转换"""
+        insert_rows(ResultSearchIndex, ['result_id', 'image_id', 'content'], [
+            (result.pk, result.image_id, search.search_text(result.markdown_text, result.pruned_result))
+            for result in results
+        ])
+        insert_rows(LayoutBlock, ['result_id', 'image_id', 'page', 'position', 'order', 'label',
+                                  'x0', 'y0', 'x1', 'y1', 'text'], [
+            (result.pk, result.image_id, result.result_index, position, block['order'], block['label'],
+             *(block['bbox'] or (None, None, None, None)), block['text'])
+            for result in results for position, block in enumerate(layout.extract(result.pruned_result))
+        ])
+
+    def write_media(self, records, results, image):
+        for record in records:
+            default_storage.save(record.image.name, ContentFile(image))
+        for result in results:
+            RecordMedia(result.image).save_markdown(result.result_index, result.markdown_text)
+
+    def delete(self):
+        records = ImageUpload.objects.filter(user_agent=SYNTHETIC_AGENT)
+        deleted = 0
+        while True:
+            batch = list(records.order_by('pk').values_list('pk', flat=True)[:DELETE_BATCH_SIZE])
+            if not batch:
+                break
+            for record in ImageUpload.objects.filter(pk__in=batch).only('pk', 'image'):
+                RecordMedia(record).delete_all()
+            ImageUpload.objects.filter(pk__in=batch).delete()
+            deleted += len(batch)
+            self.stdout.write(f"已删除 {deleted} 条")
+        self.stdout.write(self.style.SUCCESS(f"删除 {deleted} 条模拟记录"))
@@ -0,0 +1,356 @@
+# parser_app/management/commands/loadtest.py
+"""对 /upload/ 做端到端压测
+
+先启动模拟解析服务和应用，再运行本命令，例如:
+    python manage.py mock_parser --latency 1 --latency-sigma 0.3 &
+    LAYOUT_PARSING_API_URL=http://127.0.0.1:8866/layout-parsing gunicorn ... &
+    python manage.py loadtest --url http://127.0.0.1:8000 --concurrency 32 --requests 500 --server-pid <pid>
+
+报告吞吐量、p50/p95/p99 延迟、错误率、服务进程峰值RSS，以及数据库与媒体目录的增长。
+数据库大小通过本进程的 DATABASES 配置读取，需与被测服务一致。
+
+被测服务默认按客户端IP限流（每分钟30次上传），从一台机器压测时绝大多数请求会得到429，
+需要以 RATELIMIT_ENABLED=0 启动被测服务（或调高 RATELIMIT_UPLOAD_RATE、stream 模式下还有进度接口的限额）。
+429 按原因分别计数：rate_limited 为限流，parser_busy 为解析名额已满（PARSER_MAX_IN_FLIGHT），后者是被测的正常结果。
+"""
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from parser_app.mock_parser import fake_image
+
+
+def percentile(sorted_values, p):
+    """最近秩法求百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def process_tree(pid):
+    """pid 及其所有子进程（gunicorn 的 master 与 worker）"""
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """定期采样服务进程（含子进程）的RSS总和，记录峰值"""
+
+    def __init__(self, pids, interval=0.2):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        total = 0
+        for pid in self.pids:
+            total += sum(rss_bytes(p) for p in set(process_tree(pid)))
+        self.peak = max(self.peak, total)
+        return total
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def database_size():
+    """当前数据库占用的字节数，无法获取时返回 None"""
+    if connection.vendor == 'sqlite':
+        name = str(connection.settings_dict['NAME'])
+        return sum(os.path.getsize(path) for path in (name, name + '-wal') if os.path.exists(path))
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_database_size(current_database())')
+            return cursor.fetchone()[0]
+    return None
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fname in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass
+    return total
+
+
+def format_bytes(value):
+    if value is None:
+        return '未知'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024 or unit == 'GB':
+            return f"{value:.1f} {unit}" if unit != 'B' else f"{value} B"
+        value /= 1024
+
+
+RATE_LIMITED = 'HTTP 429 rate_limited'
+
+
+def failure(response):
+    """失败响应的结果名；429 附上原因，区分限流与解析名额已满"""
+    if response.status_code != 429:
+        return f"HTTP {response.status_code}"
+    try:
+        reason = response.json().get('reason', '')
+    except ValueError:
+        reason = ''
+    return f"HTTP 429 {reason}".rstrip()
+
+
+def retry_after(response, default=1.0):
+    try:
+        return max(float(response.headers.get('Retry-After', default)), 0.1)
+    except ValueError:
+        return default
+
+
+class LoadTest:
+    """按给定并发驱动 /upload/，每个工作线程使用自己的会话"""
+
+    def __init__(self, base_url, image_bytes, filename, content_type, mode='sync', timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.image_bytes = image_bytes
+        self.filename = filename
+        self.content_type = content_type
+        self.mode = mode
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = {}
+        self.throttled_polls = 0
+
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            # 首页会设置 csrftoken Cookie
+            session.get(self.base_url + '/', timeout=self.timeout)
+            self.local.session = session
+        return session
+
+    def upload_once(self):
+        session = self.session()
+        token = session.cookies.get('csrftoken', '')
+        data = {'csrfmiddlewaretoken': token}
+        if self.mode == 'stream':
+            data['mode'] = 'stream'
+        response = session.post(
+            self.base_url + '/upload/',
+            data=data,
+            files={'image': (self.filename, self.image_bytes, self.content_type)},
+            headers={'X-CSRFToken': token, 'Referer': self.base_url + '/'},
+            timeout=self.timeout,
+        )
+        if self.mode != 'stream':
+            return 'ok' if response.status_code == 200 else failure(response)
+        if response.status_code != 202:
+            return failure(response)
+        return self.wait_for_completion(session, response.json())
+
+    def wait_for_completion(self, session, job):
+        """与页面相同地跟踪进度：带上已知状态做长轮询；服务端不支持长轮询时（poll_interval）按间隔短轮询"""
+        poll_interval = job.get('poll_interval')
+        after, status = 0, ''
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            params = {'after': after, 'status': status}
+            if poll_interval:
+                params['wait'] = 0
+            response = session.get(self.base_url + job['progress_url'], params=params, timeout=self.timeout)
+            if response.status_code == 429:
+                # 进度接口被限流时按 Retry-After 退避，不计为失败但单独统计
+                with self.lock:
+                    self.throttled_polls += 1
+                time.sleep(min(retry_after(response), max(deadline - time.monotonic(), 0)))
+                continue
+            if response.status_code != 200:
+                return failure(response)
+            data = response.json()
+            after += len(data.get('results', []))
+            status = data.get('status', '')
+            if status == 'completed':
+                return 'ok'
+            if status == 'failed':
+                return 'failed'
+            if poll_interval:
+                time.sleep(poll_interval)
+        return 'timeout'
+
+    def run_one(self):
+        start = time.perf_counter()
+        try:
+            outcome = self.upload_once()
+        except requests.exceptions.Timeout:
+            outcome = 'timeout'
+        except requests.exceptions.RequestException as e:
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+            if outcome != 'ok':
+                self.errors[outcome] = self.errors.get(outcome, 0) + 1
+
+    def run(self, concurrency, total=None, duration=None):
+        counter = iter(range(total)) if total else None
+        counter_lock = threading.Lock()
+        deadline = time.monotonic() + duration if duration else None
+
+        def worker():
+            while True:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                if counter is not None:
+                    with counter_lock:
+                        if next(counter, None) is None:
+                            return
+                self.run_one()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = ('以目标并发压测 /upload/，报告吞吐量、延迟分位数、错误率、峰值RSS和数据库增长。'
+            '被测服务需以 RATELIMIT_ENABLED=0 启动，否则单个IP的请求大多会被限流（429）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='被测服务地址')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=100, help='总请求数')
+        parser.add_argument('--duration', type=float, default=None, help='按时长压测（秒），优先于 --requests')
+        parser.add_argument('--mode', choices=['sync', 'stream'], default='sync',
+                            help='sync: 等待结果页; stream: 202后轮询进度直到完成')
+        parser.add_argument('--image', default=None, help='上传的图片，默认生成一张JPEG')
+        parser.add_argument('--image-size', type=int, default=1024, help='生成图片的边长（像素）')
+        parser.add_argument('--timeout', type=float, default=300)
+        parser.add_argument('--server-pid', type=int, action='append', default=[],
+                            help='被测服务进程（包括其子进程）的pid，可重复；用于采样峰值RSS')
+        parser.add_argument('--json', dest='json_path', default=None, help='把结果写入JSON文件')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency 必须大于0')
+
+        if options['image']:
+            with open(options['image'], 'rb') as f:
+                image_bytes = f.read()
+            filename = os.path.basename(options['image'])
+            content_type = 'image/png' if filename.lower().endswith('.png') else 'image/jpeg'
+        else:
+            image_bytes = fake_image(options['image_size'])
+            filename, content_type = 'loadtest.jpg', 'image/jpeg'
+
+        test = LoadTest(options['url'], image_bytes, filename, content_type,
+                        mode=options['mode'], timeout=options['timeout'])
+
+        db_before = database_size()
+        media_before = directory_size(settings.MEDIA_ROOT)
+        sampler = RssSampler(options['server_pid']) if options['server_pid'] else None
+        if sampler:
+            sampler.start()
+
+        self.stdout.write(
+            f"压测 {options['url']}/upload/ 并发 {options['concurrency']}, "
+            + (f"时长 {options['duration']}s" if options['duration'] else f"请求 {options['requests']} 个")
+            + f", 图片 {format_bytes(len(image_bytes))}"
+        )
+        wall = test.run(options['concurrency'], total=options['requests'], duration=options['duration'])
+
+        if sampler:
+            sampler.stop()
+        db_after = database_size()
+        media_after = directory_size(settings.MEDIA_ROOT)
+
+        latencies = sorted(test.latencies)
+        count = len(latencies)
+        error_count = sum(test.errors.values())
+        report = {
+            'requests': count,
+            'concurrency': options['concurrency'],
+            'mode': options['mode'],
+            'wall_time': wall,
+            'throughput': count / wall if wall else 0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+            'error_rate': error_count / count if count else 0,
+            'errors': test.errors,
+            'rate_limited': test.errors.get(RATE_LIMITED, 0),
+            'progress_rate_limited': test.throttled_polls,
+            'peak_rss': sampler.peak if sampler else None,
+            'db_growth': db_after - db_before if db_before is not None and db_after is not None else None,
+            'media_growth': media_after - media_before,
+        }
+        self.print_report(report)
+        if report['rate_limited']:
+            self.stderr.write(self.style.WARNING(
+                f"{report['rate_limited']} 个请求被限流（429），结果不反映服务能力；"
+                "请以 RATELIMIT_ENABLED=0 启动被测服务，或调高 RATELIMIT_UPLOAD_RATE"
+            ))
+        if report['progress_rate_limited']:
+            self.stderr.write(self.style.WARNING(
+                f"进度接口被限流 {report['progress_rate_limited']} 次（已按 Retry-After 退避），"
+                "端到端延迟包含退避时间；请以 RATELIMIT_ENABLED=0 启动被测服务"
+            ))
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    def print_report(self, report):
+        def ms(value):
+            return f"{value * 1000:.0f} ms" if value is not None else '-'
+
+        self.stdout.write(f"请求数:     {report['requests']}  (耗时 {report['wall_time']:.2f}s)")
+        self.stdout.write(f"吞吐量:     {report['throughput']:.2f} req/s")
+        self.stdout.write(f"延迟:       p50 {ms(report['p50'])}  p95 {ms(report['p95'])}  "
+                          f"p99 {ms(report['p99'])}  max {ms(report['max'])}")
+        self.stdout.write(f"错误率:     {report['error_rate'] * 100:.2f}%"
+                          + (f"  {report['errors']}" if report['errors'] else ''))
+        if report['progress_rate_limited']:
+            self.stdout.write(f"进度限流:   {report['progress_rate_limited']} 次")
+        self.stdout.write(f"峰值RSS:    {format_bytes(report['peak_rss']) if report['peak_rss'] else '未采样（使用 --server-pid）'}")
+        self.stdout.write(f"数据库增长: {format_bytes(report['db_growth'])}")
+        self.stdout.write(f"媒体增长:   {format_bytes(report['media_growth'])}")
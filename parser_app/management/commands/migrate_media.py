@@ -0,0 +1,129 @@
+# parser_app/management/commands/migrate_media.py
+"""把旧布局下的媒体文件迁移到分片目录
+
+旧版 upload_image 在 Linux 上会把文件写到以下几类位置：
+- MEDIA_ROOT/<image.name>                       原始文件（名字里的反斜杠被去掉）
+- MEDIA_ROOT\\<doc_dir>/markdown_<id>_<i>/...   与 MEDIA_ROOT 同级、名字带反斜杠的目录
+- MEDIA_ROOT/<doc_dir>/...                       Windows 上的预期布局
+- MEDIA_ROOT/markdown_<id>_<i>/...              更早期的平铺布局
+本命令逐条查找这些位置，把文件写入当前存储后端的分片目录并更新记录。
+"""
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from parser_app.models import ImageUpload
+from parser_app.storage import RECORDS_PREFIX, RecordMedia, upload_name
+
+
+def legacy_doc_dir(image_name):
+    """从旧的 image.name 还原出当时的文档目录名（即生成的 <uuid>.<ext>）"""
+    if '/' in image_name:
+        return image_name.split('/')[0]
+    # Linux 上 "abc.png\\abc.png" 被清洗成 "abc.pngabc.png"
+    half = len(image_name) // 2
+    if len(image_name) % 2 == 0 and image_name[:half] == image_name[half:]:
+        return image_name[:half]
+    return image_name
+
+
+def legacy_roots(doc_dir):
+    """旧文件可能所在的根目录"""
+    media_root = str(settings.MEDIA_ROOT)
+    return [
+        os.path.join(media_root, doc_dir),
+        f"{media_root}\\{doc_dir}",
+        media_root,
+    ]
+
+
+def find_existing(candidates):
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class Command(BaseCommand):
+    help = '把旧布局的媒体文件迁移到按哈希分片的存储目录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只列出将要迁移的文件')
+        parser.add_argument('--keep-source', action='store_true', help='迁移后保留旧文件')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        keep_source = options['keep_source']
+        migrated = skipped = missing = 0
+
+        records = (
+            ImageUpload.objects.exclude(image__startswith=f"{RECORDS_PREFIX}/")
+            .prefetch_related('results')
+            .order_by('id')
+        )
+        for record in records.iterator(chunk_size=200):
+            doc_dir = legacy_doc_dir(record.image.name)
+            roots = legacy_roots(doc_dir)
+            source_image = find_existing([
+                os.path.join(str(settings.MEDIA_ROOT), record.image.name),
+                os.path.join(roots[0], doc_dir),
+            ])
+            if source_image is None:
+                self.stderr.write(f"记录 {record.id}: 找不到原始文件 {record.image.name}，跳过")
+                missing += 1
+                continue
+
+            token = os.path.splitext(doc_dir)[0] or f"legacy{record.id}"
+            new_name = upload_name(record.original_filename or doc_dir, token=token)
+
+            # 收集需要搬迁的文件：(本地路径, 新存储路径)
+            old_media = RecordMedia(record)
+            record.image.name = new_name
+            new_media = RecordMedia(record)
+            moves = [(source_image, new_name)]
+            source_dirs = []
+            for result in record.results.all():
+                md_dirname = os.path.basename(old_media.markdown_dir(result.result_index))
+                md_dir = find_existing(os.path.join(root, md_dirname) for root in roots)
+                if md_dir:
+                    source_dirs.append(md_dir)
+                    for dirpath, _, filenames in os.walk(md_dir):
+                        for fname in filenames:
+                            path = os.path.join(dirpath, fname)
+                            rel = os.path.relpath(path, md_dir).replace(os.sep, '/')
+                            moves.append((path, f"{new_media.markdown_dir(result.result_index)}/{rel}"))
+                for img_filename in result.output_image_paths:
+                    path = find_existing(os.path.join(root, img_filename) for root in roots)
+                    if path:
+                        moves.append((path, new_media.output_image_name(img_filename)))
+
+            if dry_run:
+                for src, dest in moves:
+                    self.stdout.write(f"{src} -> {dest}")
+                skipped += 1
+                continue
+
+            for src, dest in moves:
+                with open(src, 'rb') as f:
+                    new_media.write(dest, f.read())
+
+            ImageUpload.objects.filter(pk=record.pk).update(image=new_name, updated_at=timezone.now())
+            migrated += 1
+
+            if not keep_source:
+                for src, _ in moves:
+                    if os.path.exists(src):
+                        os.remove(src)
+                for path in source_dirs:
+                    shutil.rmtree(path, ignore_errors=True)
+                for root in roots[:2]:
+                    if os.path.isdir(root) and not os.listdir(root):
+                        os.rmdir(root)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"迁移完成: 成功 {migrated} 条, 找不到文件 {missing} 条"
+            + (f", 预览 {skipped} 条" if dry_run else '')
+        ))
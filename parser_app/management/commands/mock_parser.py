@@ -0,0 +1,63 @@
+# parser_app/management/commands/mock_parser.py
+"""启动本地模拟的布局解析服务
+
+示例:
+    python manage.py mock_parser --port 8866 --latency 1.5 --latency-sigma 0.4 --error-rate 0.02
+    LAYOUT_PARSING_API_URL=http://127.0.0.1:8866/layout-parsing python manage.py runserver
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from parser_app.mock_parser import MockParserConfig, MockParserServer
+
+
+class Command(BaseCommand):
+    help = '启动返回 layoutParsingResults 结构的本地模拟解析服务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8866)
+        parser.add_argument('--latency', type=float, default=1.0, help='延迟中位数（秒）')
+        parser.add_argument('--latency-sigma', type=float, default=0.0,
+                            help='延迟的对数正态分布sigma，0表示固定延迟')
+        parser.add_argument('--latency-per-page', type=float, default=0.0, help='每页额外延迟（秒）')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的比例（0~1）')
+        parser.add_argument('--timeout-rate', type=float, default=0.0, help='不响应直到客户端超时的比例（0~1）')
+        parser.add_argument('--pages', type=int, default=1, help='每个响应的页数')
+        parser.add_argument('--images-per-page', type=int, default=1, help='每页Markdown图片数')
+        parser.add_argument('--image-size', type=int, default=256, help='图片边长（像素），决定响应大小')
+        parser.add_argument('--blocks-per-page', type=int, default=8)
+        parser.add_argument('--markdown-chars', type=int, default=2000, help='每页Markdown文本长度')
+        parser.add_argument('--no-output-images', action='store_true', help='不返回 outputImages')
+        parser.add_argument('--fresh-response', action='store_true',
+                            help='每个请求重新生成响应（默认复用同一份）')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        config = MockParserConfig(
+            latency=options['latency'],
+            latency_sigma=options['latency_sigma'],
+            latency_per_page=options['latency_per_page'],
+            error_rate=options['error_rate'],
+            timeout_rate=options['timeout_rate'],
+            pages=options['pages'],
+            images_per_page=options['images_per_page'],
+            image_size=options['image_size'],
+            blocks_per_page=options['blocks_per_page'],
+            markdown_chars=options['markdown_chars'],
+            output_images=not options['no_output_images'],
+            seed=options['seed'],
+        )
+        server = MockParserServer((options['host'], options['port']), config,
+                                  reuse_response=not options['fresh_response'])
+        if server.cached_response is not None:
+            size = len(json.dumps(server.cached_response))
+            self.stdout.write(f"响应大小: {size / 1024:.1f} KB")
+        self.stdout.write(self.style.SUCCESS(f"模拟解析服务已启动: {server.url}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
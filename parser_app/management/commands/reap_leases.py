@@ -0,0 +1,34 @@
+# parser_app/management/commands/reap_leases.py
+"""回收过期的处理租约
+
+worker 进程的心跳线程会定期回收（见 parser_app/leases.py），本命令用于没有 worker 在运行时
+或需要立即处理卡住的记录：租约过期的 processing 记录放回 pending，处理次数已满的标记为失败。
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from parser_app import leases
+
+
+class Command(BaseCommand):
+    help = '把租约过期的处理中记录放回队列（处理次数已满的标记为失败）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只列出租约过期的记录')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        stale = leases.expired(now).order_by('lease_expires_at')
+        for record in stale.only('id', 'original_filename', 'lease_owner', 'lease_expires_at', 'attempts'):
+            action = '标记失败' if record.attempts >= settings.PARSE_MAX_ATTEMPTS else '放回队列'
+            self.stdout.write(
+                f"{record.id} {record.original_filename} 处理者={record.lease_owner} "
+                f"过期于 {record.lease_expires_at:%Y-%m-%d %H:%M:%S} 处理次数={record.attempts} -> {action}"
+            )
+
+        if options['dry_run']:
+            return
+
+        requeued, failed = leases.reap(now)
+        self.stdout.write(self.style.SUCCESS(f"放回队列 {requeued} 条，标记失败 {failed} 条"))
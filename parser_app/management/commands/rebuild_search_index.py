@@ -0,0 +1,32 @@
+# parser_app/management/commands/rebuild_search_index.py
+"""重建解析结果的搜索索引（见 parser_app/search.py）
+
+正常上传会随结果一起写入索引；用 bulk_create 直接导入的结果，或修改了搜索文本的生成规则后，用本命令重建。
+"""
+from django.core.management.base import BaseCommand
+
+from parser_app import search
+from parser_app.models import ParseResult
+
+
+class Command(BaseCommand):
+    help = '重建解析结果的搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='只为还没有索引的结果建立索引')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        results = ParseResult.objects.order_by('pk').only('pk', 'image_id', 'markdown_text', 'pruned_result')
+        if options['missing']:
+            results = results.filter(search_index__isnull=True)
+
+        total = 0
+        last = 0
+        while True:
+            batch = list(results.filter(pk__gt=last)[:options['batch_size']])
+            if not batch:
+                break
+            total += search.rebuild(batch)
+            last = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"已为 {total} 条结果建立搜索索引"))
@@ -0,0 +1,192 @@
+# parser_app/media_serving.py
+"""记录媒体文件的下发
+
+权限检查在 Django 里完成，字节传输尽量交给 nginx：
+- 配置了 MEDIA_ACCEL_REDIRECT_PREFIX 时返回 X-Accel-Redirect，由 nginx 的 internal location 发送文件；
+- 否则（开发环境）用 Python 直接读取存储，支持单段 Range 请求；
+- 非本地磁盘的存储后端（如S3）重定向到存储后端自己的URL。
+
+MEDIA_ACCESS=owner 时按记录鉴权：管理员、上传者（请求的 client_key 与记录相同，即同一IP或同一 API 密钥），
+或者链接带有该记录的有效签名（?sig=，API 返回的文件地址都带签名，MEDIA_LINK_MAX_AGE 秒内有效）。
+同一检查也用于详情页、结果页与进度接口，无权访问时与记录不存在一样返回404。
+
+解析服务以 url 方式取文件（LAYOUT_PARSING_FILE_MODE=url）时，请求体中只有一个短期有效的签名地址，
+签名本身就是授权，不检查登录。
+"""
+import mimetypes
+import posixpath
+import re
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import http_date
+
+from .admission import client_key
+from .models import ImageUpload
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+PARSER_FILE_SALT = 'parser_app.parser_file'
+RECORD_FILE_SALT = 'parser_app.record_file'
+
+
+def parse_range(header, size):
+    """解析单段 Range 头，返回 (start, end)；无效或不支持时返回 None，无法满足时返回 False"""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N 表示最后N个字节
+        length = int(end)
+        if length == 0:
+            return False
+        start = max(size - length, 0)
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _iter_range(f, start, length):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _set_disposition(response, filename, as_attachment):
+    if as_attachment:
+        response['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+def accel_redirect_response(name, filename, as_attachment=False):
+    """交给nginx发送文件"""
+    response = HttpResponse()
+    response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(name)
+    # 由nginx根据文件扩展名决定Content-Type
+    del response['Content-Type']
+    _set_disposition(response, filename, as_attachment)
+    return response
+
+
+def ranged_file_response(request, storage, name, filename, as_attachment=False):
+    """由Python读取并返回文件，支持单段 Range"""
+    size = storage.size(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header:
+        byte_range = parse_range(range_header, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+    f = storage.open(name, 'rb')
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_iter_range(f, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(length)
+    else:
+        response = FileResponse(f, content_type=content_type)
+        response['Content-Length'] = str(size)
+
+    response['Accept-Ranges'] = 'bytes'
+    try:
+        response['Last-Modified'] = http_date(storage.get_modified_time(name).timestamp())
+    except (NotImplementedError, OSError):
+        pass
+    _set_disposition(response, filename, as_attachment)
+    return response
+
+
+def signed_record_url(record, url):
+    """给记录的文件地址加上签名，持有者在 MEDIA_LINK_MAX_AGE 秒内不需要是上传者也能访问"""
+    token = signing.TimestampSigner(salt=RECORD_FILE_SALT).sign(str(record.id))
+    return f"{url}?{urlencode({'sig': token})}"
+
+
+def has_record_signature(request, record):
+    token = request.GET.get('sig')
+    if not token:
+        return False
+    try:
+        value = signing.TimestampSigner(salt=RECORD_FILE_SALT).unsign(token, max_age=settings.MEDIA_LINK_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == str(record.id)
+
+
+def can_access_record(request, record):
+    """是否允许访问记录的媒体文件（见模块说明）"""
+    if settings.MEDIA_ACCESS != 'owner':
+        return True
+    if request.user.is_staff:
+        return True
+    if record.client_key and record.client_key == client_key(request):
+        return True
+    return has_record_signature(request, record)
+
+
+def can_access_record_id(request, record_id):
+    """按记录 id 检查访问权限（只读取 client_key）；owner 模式下记录不存在时返回 False"""
+    if settings.MEDIA_ACCESS != 'owner':
+        return True
+    record = ImageUpload.objects.filter(id=record_id).only('id', 'client_key').first()
+    return record is not None and can_access_record(request, record)
+
+
+def owner_client_key(request):
+    """跨记录查询时只能看到自己上传的记录：返回应限定的 client_key，不限制时返回 None"""
+    if settings.MEDIA_ACCESS != 'owner' or request.user.is_staff:
+        return None
+    return client_key(request)
+
+
+def media_file_response(request, storage, name, filename, as_attachment=False):
+    """根据部署方式选择文件下发方式"""
+    if not isinstance(storage, FileSystemStorage):
+        return HttpResponseRedirect(storage.url(name))
+    if getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', ''):
+        return accel_redirect_response(name, filename, as_attachment)
+    return ranged_file_response(request, storage, name, filename, as_attachment)
+
+
+def parser_file_url(record):
+    """供解析服务下载原始图片的签名地址，LAYOUT_PARSING_FILE_URL_MAX_AGE 秒内有效"""
+    base_url = settings.LAYOUT_PARSING_FILE_BASE_URL
+    if not base_url:
+        raise ImproperlyConfigured('LAYOUT_PARSING_FILE_MODE=url 时必须设置 LAYOUT_PARSING_FILE_BASE_URL')
+    token = signing.TimestampSigner(salt=PARSER_FILE_SALT).sign(str(record.id))
+    path = reverse('parser_file', args=[token, posixpath.basename(record.image.name)])
+    return base_url.rstrip('/') + path
+
+
+def parser_file_record_id(token):
+    """校验签名地址中的令牌，返回记录 id；无效或过期时返回 None"""
+    try:
+        value = signing.TimestampSigner(salt=PARSER_FILE_SALT).unsign(
+            token, max_age=settings.LAYOUT_PARSING_FILE_URL_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return int(value)
@@ -0,0 +1,219 @@
+# parser_app/metrics.py
+"""Prometheus 指标
+
+gunicorn 多个 worker 各自计数，/metrics 需要汇总所有进程：
+设置 PROMETHEUS_MULTIPROC_DIR 后 prometheus_client 把每个进程的数值写到该目录下的mmap文件，
+/metrics 读取目录汇总（gunicorn.conf.py 负责清空目录并在 worker 退出时清理）。
+未设置时（runserver、单进程 uvicorn）直接使用进程内的默认注册表。
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** n for n in range(10, 28, 2))  # 1KB ~ 128MB
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+QUERY_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+PARSER_LATENCY = Histogram(
+    'parser_request_duration_seconds', '调用解析服务的耗时', ['outcome'], buckets=LATENCY_BUCKETS)
+PARSER_REQUEST_BYTES = Histogram(
+    'parser_request_bytes', '发送给解析服务的请求体大小', buckets=BYTES_BUCKETS)
+PARSER_RESPONSE_BYTES = Histogram(
+    'parser_response_bytes', '解析服务的响应体大小', buckets=BYTES_BUCKETS)
+PARSER_IN_FLIGHT = Gauge(
+    'parser_requests_in_flight', '正在等待解析服务响应的请求数', multiprocess_mode='livesum')
+PARSER_BACKEND_LATENCY = Histogram(
+    'parser_backend_request_duration_seconds', '各解析服务后端的调用耗时', ['backend', 'outcome'],
+    buckets=LATENCY_BUCKETS)
+PARSER_BACKEND_HEALTHY = Gauge(
+    'parser_backend_healthy', '解析服务后端是否可用（1 可用，0 已摘除）', ['backend'], multiprocess_mode='livemin')
+PARSER_BACKEND_EJECTIONS = Counter(
+    'parser_backend_ejections_total', '解析服务后端被摘除的次数', ['backend', 'reason'])
+PARSE_QUEUE_DEPTH = Gauge(
+    'parse_queue_depth', '待处理（pending）的解析任务数', multiprocess_mode='livemax')
+QUEUE_WAIT = Histogram(
+    'parse_queue_wait_seconds', '解析任务从入队到开始处理的等待时间', ['priority'], buckets=LATENCY_BUCKETS)
+
+LEASES_REAPED = Counter(
+    'parse_leases_reaped_total', '租约过期后被放回队列或标记失败的记录数', ['outcome'])
+UPLOAD_OUTCOMES = Counter(
+    'upload_outcomes_total', '上传解析结果', ['status', 'error_type'])
+MEDIA_BYTES_WRITTEN = Counter(
+    'media_bytes_written_total', '写入存储的媒体字节数', ['kind'])
+ARCHIVE_BYTES = Counter(
+    'archive_bytes_total', '归档的媒体文件字节数（original 为打包前，archived 为归档文件）', ['kind'])
+REHYDRATIONS = Counter(
+    'archive_rehydrations_total', '访问已归档记录时的还原缓存命中情况', ['outcome'])
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'HTTP请求数', ['view', 'method', 'status'])
+HTTP_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP请求耗时（流式响应只计到返回响应头）', ['view'],
+    buckets=LATENCY_BUCKETS)
+ADMISSION_REJECTED = Counter(
+    'admission_rejected_total', '被限流或因解析服务繁忙拒绝的请求数', ['route', 'reason'])
+DB_QUERIES = Counter(
+    'db_queries_total', '数据库查询数', ['view'])
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', '单个请求的数据库查询数', ['view'], buckets=QUERY_COUNT_BUCKETS)
+DB_QUERY_TIME_PER_REQUEST = Histogram(
+    'db_query_seconds_per_request', '单个请求的数据库查询总耗时', ['view'], buckets=QUERY_TIME_BUCKETS)
+
+
+# 解析服务
+@contextmanager
+def parser_call(body, backend=None):
+    """统计一次解析服务调用；调用方把 outcome 和 response_bytes 写入返回的字典，backend 为后端名称"""
+    PARSER_IN_FLIGHT.inc()
+    PARSER_REQUEST_BYTES.observe(len(body))
+    call = {'outcome': 'error', 'response_bytes': None}
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        elapsed = time.perf_counter() - start
+        PARSER_IN_FLIGHT.dec()
+        PARSER_LATENCY.labels(call['outcome']).observe(elapsed)
+        if backend is not None:
+            PARSER_BACKEND_LATENCY.labels(backend, call['outcome']).observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.parser_calls += 1
+            stats.parser_time += elapsed
+        if call['response_bytes'] is not None:
+            PARSER_RESPONSE_BYTES.observe(call['response_bytes'])
+
+
+def set_parser_backend_health(backend, healthy):
+    PARSER_BACKEND_HEALTHY.labels(backend).set(1 if healthy else 0)
+
+
+def record_parser_backend_ejection(backend, reason):
+    PARSER_BACKEND_EJECTIONS.labels(backend, reason).inc()
+
+
+def record_upload_outcome(status, error_type=''):
+    UPLOAD_OUTCOMES.labels(status, error_type).inc()
+
+
+def record_leases_reaped(requeued, failed):
+    LEASES_REAPED.labels('requeued').inc(requeued)
+    LEASES_REAPED.labels('failed').inc(failed)
+
+
+def record_media_written(kind, size):
+    MEDIA_BYTES_WRITTEN.labels(kind).inc(size)
+
+
+def record_archived(media_bytes, archive_bytes):
+    ARCHIVE_BYTES.labels('original').inc(media_bytes)
+    ARCHIVE_BYTES.labels('archived').inc(archive_bytes)
+
+
+def record_rehydration(outcome):
+    REHYDRATIONS.labels(outcome).inc()
+
+
+def record_admission_rejected(route, reason):
+    ADMISSION_REJECTED.labels(route, reason).inc()
+
+
+# 每个请求的数据库查询、模板渲染与解析服务调用统计
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0  # 仅在开启 PROFILING_ENABLED 时统计
+        self.parser_calls = 0
+        self.parser_time = 0.0
+
+
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def current_request_stats():
+    return _request_stats.get()
+
+
+def observe_queries(execute, sql, params, many, context):
+    """数据库连接的 execute_wrapper，把查询计入当前请求
+
+    统计对象放在 ContextVar 中，sync_to_async 会复制上下文，
+    因此异步视图在线程里执行的查询同样会计入发起它的请求。
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+
+def install_query_observer(sender, connection, **kwargs):
+    """connection_created 信号：给新建的数据库连接挂上查询统计"""
+    if observe_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe_queries)
+
+
+def _view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match else None) or 'unresolved'
+
+
+def _record_request(request, response, stats, start):
+    view = _view_label(request)
+    HTTP_REQUESTS.labels(view, request.method, str(response.status_code)).inc()
+    HTTP_LATENCY.labels(view).observe(time.perf_counter() - start)
+    DB_QUERIES.labels(view).inc(stats.queries)
+    DB_QUERIES_PER_REQUEST.labels(view).observe(stats.queries)
+    DB_QUERY_TIME_PER_REQUEST.labels(view).observe(stats.query_time)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """记录每个请求的耗时与数据库查询"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = RequestStats()
+            token = _request_stats.set(stats)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _request_stats.reset(token)
+            _record_request(request, response, stats, start)
+            return response
+    else:
+        def middleware(request):
+            stats = RequestStats()
+            token = _request_stats.set(stats)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _request_stats.reset(token)
+            _record_request(request, response, stats, start)
+            return response
+    return middleware
+
+
+# 导出
+def collect():
+    """当前所有进程的指标（Prometheus 文本格式）"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
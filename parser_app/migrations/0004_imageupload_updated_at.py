@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0003_remove_parseresult_output_images_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+    ]
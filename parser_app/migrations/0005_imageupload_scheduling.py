@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:37
+
+from django.db import migrations, models
+
+
+def queue_pending(apps, schema_editor):
+    # 已有的待处理记录按上传时间排队
+    ImageUpload = apps.get_model('parser_app', 'ImageUpload')
+    ImageUpload.objects.filter(status='pending', queued_at__isnull=True).update(queued_at=models.F('upload_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0004_imageupload_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='client_key',
+            field=models.CharField(blank=True, max_length=64, verbose_name='客户端'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='page_count',
+            field=models.PositiveIntegerField(default=1, verbose_name='页数'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, '交互'), (1, '重新处理'), (2, '批量')], default=0, verbose_name='优先级'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='queue_wait',
+            field=models.FloatField(blank=True, null=True, verbose_name='排队时间(秒)'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='入队时间'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='开始处理时间'),
+        ),
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['status', 'priority', 'queued_at'], name='imageupload_queue_idx'),
+        ),
+        migrations.RunPython(queue_pending, migrations.RunPython.noop),
+    ]
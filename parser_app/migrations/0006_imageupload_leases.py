@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:40
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def lease_processing(apps, schema_editor):
+    # 升级前就处于 processing 的记录给一个租约，到期仍未完成的由 reaper 放回队列
+    ImageUpload = apps.get_model('parser_app', 'ImageUpload')
+    ImageUpload.objects.filter(status='processing').update(
+        lease_owner='migration', lease_expires_at=timezone.now() + timedelta(minutes=10), attempts=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0005_imageupload_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='处理次数'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最近心跳'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='租约到期时间'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=100, verbose_name='处理者'),
+        ),
+        migrations.RunPython(lease_processing, migrations.RunPython.noop),
+    ]
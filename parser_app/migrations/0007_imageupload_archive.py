@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0006_imageupload_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='archive_name',
+            field=models.CharField(blank=True, max_length=255, verbose_name='归档文件'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='归档时间'),
+        ),
+    ]
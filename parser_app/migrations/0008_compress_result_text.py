@@ -0,0 +1,118 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import parser_app.fields
+
+BATCH_SIZE = 500
+
+
+def batches(ParseResult, *fields):
+    """按主键分批读取，避免一次把所有正文读进内存"""
+    last = 0
+    while True:
+        batch = list(ParseResult.objects.filter(pk__gt=last).order_by('pk').only('pk', 'image_id', *fields)[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def compress_and_index(apps, schema_editor):
+    from parser_app.search import search_text
+
+    ParseResult = apps.get_model('parser_app', 'ParseResult')
+    ResultSearchIndex = apps.get_model('parser_app', 'ResultSearchIndex')
+    for batch in batches(ParseResult, 'markdown_text', 'pruned_result'):
+        for result in batch:
+            result.markdown_blob = result.markdown_text
+            result.pruned_blob = result.pruned_result
+        ParseResult.objects.bulk_update(batch, ['markdown_blob', 'pruned_blob'])
+        ResultSearchIndex.objects.bulk_create([
+            ResultSearchIndex(result_id=result.pk, image_id=result.image_id,
+                              content=search_text(result.markdown_text, result.pruned_result))
+            for result in batch
+        ])
+
+
+def decompress(apps, schema_editor):
+    ParseResult = apps.get_model('parser_app', 'ParseResult')
+    for batch in batches(ParseResult, 'markdown_blob', 'pruned_blob'):
+        for result in batch:
+            result.markdown_text = result.markdown_blob or ''
+            result.pruned_result = result.pruned_blob or ''
+        ParseResult.objects.bulk_update(batch, ['markdown_text', 'pruned_result'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0007_imageupload_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultSearchIndex',
+            fields=[
+                ('result', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='parser_app.parseresult', verbose_name='解析结果')),
+                ('content', models.TextField(verbose_name='搜索文本')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parser_app.imageupload', verbose_name='原始图片')),
+            ],
+            options={
+                'verbose_name': '搜索索引',
+                'verbose_name_plural': '搜索索引',
+            },
+        ),
+        # 文本列改为二进制列：先写入新列再替换，PostgreSQL 上 text 不能直接改为 bytea
+        migrations.AddField(
+            model_name='parseresult',
+            name='markdown_blob',
+            field=parser_app.fields.CompressedTextField(null=True, verbose_name='Markdown内容'),
+        ),
+        migrations.AddField(
+            model_name='parseresult',
+            name='pruned_blob',
+            field=parser_app.fields.CompressedTextField(null=True, verbose_name='精简结果'),
+        ),
+        migrations.RunPython(compress_and_index, decompress),
+        # 删除前给旧列加默认值，回滚时重新加回的列才能容纳已有的行
+        migrations.AlterField(
+            model_name='parseresult',
+            name='markdown_text',
+            field=models.TextField(default='', verbose_name='Markdown内容'),
+        ),
+        migrations.AlterField(
+            model_name='parseresult',
+            name='pruned_result',
+            field=models.TextField(default='', verbose_name='精简结果'),
+        ),
+        migrations.RemoveField(
+            model_name='parseresult',
+            name='markdown_text',
+        ),
+        migrations.RemoveField(
+            model_name='parseresult',
+            name='pruned_result',
+        ),
+        migrations.RenameField(
+            model_name='parseresult',
+            old_name='markdown_blob',
+            new_name='markdown_text',
+        ),
+        migrations.RenameField(
+            model_name='parseresult',
+            old_name='pruned_blob',
+            new_name='pruned_result',
+        ),
+        migrations.AlterField(
+            model_name='parseresult',
+            name='markdown_text',
+            field=parser_app.fields.CompressedTextField(verbose_name='Markdown内容'),
+        ),
+        migrations.AlterField(
+            model_name='parseresult',
+            name='pruned_result',
+            field=parser_app.fields.CompressedTextField(verbose_name='精简结果'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0008_compress_result_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='感知哈希'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='reused_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reuses', to='parser_app.imageupload', verbose_name='复用自'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0009_imageupload_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayoutBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.PositiveIntegerField(help_text='即结果索引，从0开始', verbose_name='页码')),
+                ('position', models.PositiveIntegerField(help_text='在精简结果区块列表中的位置', verbose_name='位置')),
+                ('order', models.PositiveIntegerField(blank=True, null=True, verbose_name='阅读顺序')),
+                ('label', models.CharField(max_length=50, verbose_name='类型')),
+                ('x0', models.FloatField(blank=True, null=True)),
+                ('y0', models.FloatField(blank=True, null=True)),
+                ('x1', models.FloatField(blank=True, null=True)),
+                ('y1', models.FloatField(blank=True, null=True)),
+                ('text', models.TextField(blank=True, verbose_name='内容')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layout_blocks', to='parser_app.imageupload', verbose_name='原始图片')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='parser_app.parseresult', verbose_name='解析结果')),
+            ],
+            options={
+                'verbose_name': '版面区块',
+                'verbose_name_plural': '版面区块',
+                'indexes': [models.Index(fields=['label', 'image', 'page'], name='layoutblock_label_idx'), models.Index(fields=['image', 'page', 'position'], name='layoutblock_page_idx')],
+            },
+        ),
+    ]
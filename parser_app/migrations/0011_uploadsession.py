@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:06
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0010_layoutblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='文件名')),
+                ('content_type', models.CharField(max_length=100, verbose_name='文件类型')),
+                ('size', models.BigIntegerField(help_text='字节', verbose_name='文件大小')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='已上传字节')),
+                ('checksum', models.CharField(blank=True, max_length=64, verbose_name='预期SHA-256')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+                ('status', models.CharField(choices=[('open', '上传中'), ('completed', '已完成')], default='open', max_length=20, verbose_name='状态')),
+                ('client_key', models.CharField(blank=True, max_length=64, verbose_name='客户端')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='过期时间')),
+                ('record', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='parser_app.imageupload', verbose_name='上传记录')),
+            ],
+            options={
+                'verbose_name': '分块上传',
+                'verbose_name_plural': '分块上传',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parser_app', '0011_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, help_text='上传时边接收边计算', max_length=64, verbose_name='SHA-256'),
+        ),
+    ]
@@ -0,0 +1,208 @@
+# parser_app/mock_parser.py
+"""本地模拟的布局解析服务
+
+返回与 PaddleX layout-parsing 接口相同结构（layoutParsingResults）的响应，
+可配置延迟分布、错误率、页数、每页图片数和图片大小，用于压测与基准测试，
+避免依赖远程解析服务。
+"""
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BLOCK_LABELS = ['doc_title', 'paragraph_title', 'text', 'text', 'text', 'table', 'image', 'figure_title']
+
+
+class MockParserConfig:
+    """模拟解析服务的参数"""
+
+    def __init__(self, latency=1.0, latency_sigma=0.0, latency_per_page=0.0, error_rate=0.0,
+                 timeout_rate=0.0, pages=1, images_per_page=1, image_size=256, blocks_per_page=8,
+                 markdown_chars=2000, output_images=True, seed=None):
+        self.latency = latency                    # 延迟中位数（秒）
+        self.latency_sigma = latency_sigma        # 对数正态分布的sigma，0表示固定延迟
+        self.latency_per_page = latency_per_page  # 每页额外延迟（秒）
+        self.error_rate = error_rate              # 返回500的比例
+        self.timeout_rate = timeout_rate          # 不返回（挂起到客户端超时）的比例
+        self.pages = pages
+        self.images_per_page = images_per_page
+        self.image_size = image_size              # 生成图片的边长（像素），决定响应大小
+        self.blocks_per_page = blocks_per_page
+        self.markdown_chars = markdown_chars      # 每页Markdown文本长度
+        self.output_images = output_images        # 是否返回 outputImages
+        self.random = random.Random(seed)
+
+    def sample_latency(self):
+        base = self.latency
+        if self.latency_sigma > 0 and base > 0:
+            base = math.exp(self.random.gauss(math.log(base), self.latency_sigma))
+        return base + self.latency_per_page * self.pages
+
+
+_image_cache = {}
+
+
+def fake_image(size, seed=0):
+    """生成一张 size×size 的JPEG图片（带噪声，避免压缩得过小）"""
+    key = (size, seed)
+    if key not in _image_cache:
+        from PIL import Image
+
+        rnd = random.Random(seed)
+        image = Image.effect_noise((size, size), 64 + rnd.randint(0, 32)).convert('RGB')
+        buf = io.BytesIO()
+        image.save(buf, 'JPEG', quality=85)
+        _image_cache[key] = buf.getvalue()
+    return _image_cache[key]
+
+
+def fake_text(rnd, length):
+    words = ['版面', '解析', '表格', '文本', '标题', 'layout', 'parsing', 'result', 'page', 'block', 'OCR', '段落']
+    parts = []
+    total = 0
+    while total < length:
+        word = rnd.choice(words)
+        parts.append(word)
+        total += len(word) + 1
+    return ' '.join(parts)[:length]
+
+
+def make_page_result(config, page_index):
+    """单页的解析结果，字段与真实接口一致"""
+    rnd = config.random
+    width, height = 1240, 1754
+    blocks = []
+    boxes = []
+    for order in range(config.blocks_per_page):
+        label = BLOCK_LABELS[order % len(BLOCK_LABELS)]
+        top = int(height * order / config.blocks_per_page)
+        bbox = [60, top + 10, width - 60, top + int(height / config.blocks_per_page) - 10]
+        blocks.append({
+            'block_label': label,
+            'block_content': fake_text(rnd, 120) if label not in ('image',) else '',
+            'block_bbox': bbox,
+            'block_id': order,
+            'block_order': order + 1 if label != 'image' else None,
+        })
+        boxes.append({
+            'cls_id': BLOCK_LABELS.index(label),
+            'label': label,
+            'score': round(0.8 + rnd.random() * 0.2, 4),
+            'coordinate': [float(v) for v in bbox],
+        })
+
+    images = {}
+    image_links = []
+    for n in range(config.images_per_page):
+        path = f"imgs/img_in_image_box_{page_index}_{n}.jpg"
+        images[path] = base64.b64encode(fake_image(config.image_size, n)).decode('ascii')
+        image_links.append(f'<div style="text-align: center;"><img src="{path}" alt="Image" width="50%" /></div>')
+
+    text = f"# 第 {page_index + 1} 页\n\n" + fake_text(rnd, config.markdown_chars) + '\n\n' + '\n\n'.join(image_links)
+
+    result = {
+        'prunedResult': {
+            'page_index': page_index,
+            'width': width,
+            'height': height,
+            'model_settings': {'use_doc_preprocessor': False, 'use_table_recognition': True},
+            'parsing_res_list': blocks,
+            'layout_det_res': {'boxes': boxes},
+        },
+        'markdown': {
+            'text': text,
+            'isStart': True,
+            'isEnd': True,
+            'images': images,
+        },
+    }
+    if config.output_images:
+        preview = base64.b64encode(fake_image(config.image_size, 99)).decode('ascii')
+        result['outputImages'] = {'layout_det_res': preview, 'layout_order_res': preview}
+    return result
+
+
+def make_response(config):
+    """完整的成功响应"""
+    return {
+        'logId': str(uuid.uuid4()),
+        'errorCode': 0,
+        'errorMsg': 'Success',
+        'result': {
+            'layoutParsingResults': [make_page_result(config, i) for i in range(config.pages)],
+            'dataInfo': {'type': 'image', 'width': 1240, 'height': 1754},
+        },
+    }
+
+
+def make_error_response():
+    return {'logId': str(uuid.uuid4()), 'errorCode': 500, 'errorMsg': 'Internal Server Error'}
+
+
+class MockParserHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # 与 PaddleX 服务化部署相同的健康检查接口
+        if self.path.split('?')[0] != '/health':
+            return self._send(404, {'logId': str(uuid.uuid4()), 'errorCode': 404, 'errorMsg': 'Not Found'})
+        self._send(200, {'logId': str(uuid.uuid4()), 'errorCode': 0, 'errorMsg': 'Healthy'})
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict) or 'file' not in payload:
+            return self._send(422, {'logId': str(uuid.uuid4()), 'errorCode': 422, 'errorMsg': 'file is required'})
+
+        roll = config.random.random()
+        time.sleep(config.sample_latency())
+        if roll < config.timeout_rate:
+            # 模拟挂起：等到客户端超时断开
+            time.sleep(3600)
+            return
+        if roll < config.timeout_rate + config.error_rate:
+            return self._send(500, make_error_response())
+        self._send(200, self.server.cached_response or make_response(config))
+
+    def _send(self, status, data):
+        out = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockParserServer(ThreadingHTTPServer):
+    """模拟解析服务，每个请求一个线程"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config, reuse_response=True):
+        super().__init__(address, MockParserHandler)
+        self.config = config
+        # 响应内容与请求无关，默认只生成一次，避免模拟服务本身成为瓶颈
+        self.cached_response = make_response(config) if reuse_response else None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/layout-parsing"
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
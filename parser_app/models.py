@@ -1,15 +1,14 @@
 # parser_app/models.py
 from django.db import models
-from DjangoPaddleOCR import settings
+from .fields import CompressedTextField
+from .storage import RecordMedia, upload_name
 import os
 import uuid
 
 
 def user_directory_path(instance, filename):
     """文件上传路径"""
-    ext = filename.split('.')[-1]
-    filename = f"{uuid.uuid4().hex[:10]}.{ext}"
-    return os.path.join('uploads', filename)
+    return upload_name(filename)
 
 
 class ImageUpload(models.Model):
@@ -21,6 +20,16 @@ class ImageUpload(models.Model):
         ('failed', '失败'),
     ]
 
+    # 后台解析的优先级，数值越小越优先（见 scheduler.py）
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_REPROCESS = 1
+    PRIORITY_BATCH = 2
+    PRIORITY_CHOICES = [
+        (PRIORITY_INTERACTIVE, '交互'),
+        (PRIORITY_REPROCESS, '重新处理'),
+        (PRIORITY_BATCH, '批量'),
+    ]
+
     image = models.ImageField(upload_to=user_directory_path, verbose_name='图片文件')
     original_filename = models.CharField(max_length=255, verbose_name='原始文件名')
     file_size = models.BigIntegerField(verbose_name='文件大小', help_text='字节')
@@ -30,11 +39,42 @@ class ImageUpload(models.Model):
     processing_time = models.FloatField(null=True, blank=True, verbose_name='处理时间(秒)')
     ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name='IP地址')
     user_agent = models.TextField(blank=True, verbose_name='用户代理')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    # 后台解析排队
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_INTERACTIVE,
+                                                verbose_name='优先级')
+    client_key = models.CharField(max_length=64, blank=True, verbose_name='客户端')
+    page_count = models.PositiveIntegerField(default=1, verbose_name='页数')
+    queued_at = models.DateTimeField(null=True, blank=True, verbose_name='入队时间')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='开始处理时间')
+    queue_wait = models.FloatField(null=True, blank=True, verbose_name='排队时间(秒)')
+
+    # 处理中的租约（见 leases.py）：处理者定期续约，进程退出后租约过期，记录被放回队列
+    lease_owner = models.CharField(max_length=100, blank=True, verbose_name='处理者')
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name='租约到期时间')
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='最近心跳')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='处理次数')
+
+    # 文件内容的 SHA-256（见 upload_handlers.py）
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True, verbose_name='SHA-256',
+                              help_text='上传时边接收边计算')
+    # 近似重复检测（见 similarity.py）：图片的差值哈希；复用其他记录的解析结果时指向该记录
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, verbose_name='感知哈希')
+    reused_from = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name='reuses', verbose_name='复用自')
+
+    # 归档（见 retention.py）：结果文件与 raw_data 已打包到 archive_name，查看时按需还原
+    archived_at = models.DateTimeField(null=True, blank=True, verbose_name='归档时间')
+    archive_name = models.CharField(max_length=255, blank=True, verbose_name='归档文件')
 
     class Meta:
         ordering = ['-upload_time']
         verbose_name = '图片上传记录'
         verbose_name_plural = '图片上传记录'
+        indexes = [
+            models.Index(fields=['status', 'priority', 'queued_at'], name='imageupload_queue_idx'),
+        ]
 
     def __str__(self):
         return f"{self.original_filename} ({self.upload_time.strftime('%Y-%m-%d %H:%M')})"
@@ -55,8 +95,9 @@ class ParseResult(models.Model):
     """解析结果模型"""
     image = models.ForeignKey(ImageUpload, on_delete=models.CASCADE, related_name='results', verbose_name='原始图片')
     result_index = models.IntegerField(default=0, verbose_name='结果索引')
-    pruned_result = models.TextField(verbose_name='精简结果')
-    markdown_text = models.TextField(verbose_name='Markdown内容')
+    # 压缩存储（见 fields.py），不能按内容查询，搜索使用 ResultSearchIndex
+    pruned_result = CompressedTextField(verbose_name='精简结果')
+    markdown_text = CompressedTextField(verbose_name='Markdown内容')
     output_images_count = models.IntegerField(default=0, verbose_name='输出图片数量')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     raw_data = models.JSONField(null=True, blank=True, verbose_name='原始数据')
@@ -94,22 +135,22 @@ class ParseResult(models.Model):
 
     def get_markdown_images_info(self):
         """获取Markdown图片详细信息"""
+        media = RecordMedia(self.image)
         images_info = []
         for img_path in self.markdown_image_paths:
             # 提取文件名
             filename = os.path.basename(img_path) if img_path else 'unknown'
-            # 构建完整URL路径
-            relative_path = f"markdown_{self.image.id}_{self.result_index}/imgs/{img_path}"
             images_info.append({
                 'path': img_path,
                 'filename': filename,
-                'url': f"{settings.MEDIA_URL}{relative_path}",
-                'relative_path': relative_path
+                'url': media.markdown_image_url(self.result_index, img_path),
+                'relative_path': media.markdown_image_name(self.result_index, img_path)
             })
         return images_info
 
     def get_output_images_info(self):
         """获取输出图片详细信息"""
+        media = RecordMedia(self.image)
         images_info = []
         for img_path in self.output_image_paths:
             # 提取文件名
@@ -117,6 +158,97 @@ class ParseResult(models.Model):
             images_info.append({
                 'path': img_path,
                 'filename': filename,
-                'url': f"{settings.MEDIA_URL}{img_path}"
+                'url': media.output_image_url(img_path)
             })
-        return images_info
\ No newline at end of file
+        return images_info
+
+
+class ResultSearchIndex(models.Model):
+    """解析结果的搜索文本（见 search.py）"""
+    result = models.OneToOneField(ParseResult, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='search_index', verbose_name='解析结果')
+    image = models.ForeignKey(ImageUpload, on_delete=models.CASCADE, related_name='+', verbose_name='原始图片')
+    content = models.TextField(verbose_name='搜索文本')
+
+    class Meta:
+        verbose_name = '搜索索引'
+        verbose_name_plural = '搜索索引'
+
+
+class LayoutBlock(models.Model):
+    """从精简结果中提取的版面区块（见 layout.py），按类型跨文档查询时不必逐行解析 JSON"""
+    # 历史记录筛选中列出的常见类型；解析服务返回的其他类型同样会保存
+    LABEL_CHOICES = [
+        ('doc_title', '文档标题'),
+        ('paragraph_title', '段落标题'),
+        ('text', '文本'),
+        ('table', '表格'),
+        ('image', '图片'),
+        ('chart', '图表'),
+        ('figure_title', '图表标题'),
+        ('formula', '公式'),
+        ('seal', '印章'),
+        ('header', '页眉'),
+        ('footer', '页脚'),
+    ]
+
+    result = models.ForeignKey(ParseResult, on_delete=models.CASCADE, related_name='blocks', verbose_name='解析结果')
+    image = models.ForeignKey(ImageUpload, on_delete=models.CASCADE, related_name='layout_blocks',
+                              verbose_name='原始图片')
+    page = models.PositiveIntegerField(verbose_name='页码', help_text='即结果索引，从0开始')
+    position = models.PositiveIntegerField(verbose_name='位置', help_text='在精简结果区块列表中的位置')
+    order = models.PositiveIntegerField(null=True, blank=True, verbose_name='阅读顺序')
+    label = models.CharField(max_length=50, verbose_name='类型')
+    x0 = models.FloatField(null=True, blank=True)
+    y0 = models.FloatField(null=True, blank=True)
+    x1 = models.FloatField(null=True, blank=True)
+    y1 = models.FloatField(null=True, blank=True)
+    text = models.TextField(blank=True, verbose_name='内容')
+
+    class Meta:
+        verbose_name = '版面区块'
+        verbose_name_plural = '版面区块'
+        indexes = [
+            models.Index(fields=['label', 'image', 'page'], name='layoutblock_label_idx'),
+            models.Index(fields=['image', 'page', 'position'], name='layoutblock_page_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.image_id} 第{self.page}页 {self.label}"
+
+    @property
+    def bbox(self):
+        if self.x0 is None:
+            return None
+        return [self.x0, self.y0, self.x1, self.y1]
+
+
+class UploadSession(models.Model):
+    """分块上传的会话（见 uploads.py），offset 为已确认写入磁盘的字节数"""
+    STATUS_CHOICES = [
+        ('open', '上传中'),
+        ('completed', '已完成'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255, verbose_name='文件名')
+    content_type = models.CharField(max_length=100, verbose_name='文件类型')
+    size = models.BigIntegerField(verbose_name='文件大小', help_text='字节')
+    offset = models.BigIntegerField(default=0, verbose_name='已上传字节')
+    checksum = models.CharField(max_length=64, blank=True, verbose_name='预期SHA-256')
+    sha256 = models.CharField(max_length=64, blank=True, verbose_name='SHA-256')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open', verbose_name='状态')
+    client_key = models.CharField(max_length=64, blank=True, verbose_name='客户端')
+    record = models.ForeignKey(ImageUpload, null=True, blank=True, on_delete=models.SET_NULL, related_name='+',
+                               verbose_name='上传记录')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='过期时间')
+
+    class Meta:
+        verbose_name = '分块上传'
+        verbose_name_plural = '分块上传'
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
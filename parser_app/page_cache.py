@@ -0,0 +1,92 @@
+# parser_app/page_cache.py
+"""详情页缓存与条件请求支持
+
+记录详情页与结果详情页的内容只取决于对应的 ImageUpload 及其解析结果，
+因此以记录ID和修改时间戳 (updated_at) 作为版本号：
+- 渲染后的整页HTML按版本号缓存，记录变化后旧版本自然失效；
+- 同一版本号生成 ETag / Last-Modified，浏览器和nginx可以条件请求拿到304。
+MEDIA_ACCESS=owner 时无权访问的记录视为不存在，条件请求与页面都返回404。
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .media_serving import can_access_record
+from .models import ImageUpload
+
+PAGE_CACHE_PREFIX = 'page'
+
+
+def record_stamp(request, record_id):
+    """获取记录的修改时间（每个请求只查询一次）；记录不存在或无权访问时返回 None"""
+    stamps = getattr(request, '_record_stamps', None)
+    if stamps is None:
+        stamps = request._record_stamps = {}
+    if record_id not in stamps:
+        record = ImageUpload.objects.filter(id=record_id).only('id', 'updated_at', 'client_key').first()
+        accessible = record is not None and can_access_record(request, record)
+        stamps[record_id] = record.updated_at if accessible else None
+    return stamps[record_id]
+
+
+def record_version(record_id, updated_at):
+    """记录的版本号"""
+    return f"{record_id}-{int(updated_at.timestamp() * 1000000)}"
+
+
+def record_detail_etag(request, record_id):
+    """record_detail 的 ETag"""
+    updated_at = record_stamp(request, record_id)
+    if updated_at is None:
+        return None
+    return f"record-{record_version(record_id, updated_at)}"
+
+
+def record_detail_last_modified(request, record_id):
+    """record_detail 的 Last-Modified"""
+    return record_stamp(request, record_id)
+
+
+def result_detail_etag(request, image_id, result_index):
+    """result_detail 的 ETag"""
+    updated_at = record_stamp(request, image_id)
+    if updated_at is None:
+        return None
+    return f"result-{record_version(image_id, updated_at)}-{result_index}"
+
+
+def result_detail_last_modified(request, image_id, result_index):
+    """result_detail 的 Last-Modified"""
+    return record_stamp(request, image_id)
+
+
+record_detail_condition = condition(
+    etag_func=record_detail_etag,
+    last_modified_func=record_detail_last_modified,
+)
+
+result_detail_condition = condition(
+    etag_func=result_detail_etag,
+    last_modified_func=result_detail_last_modified,
+)
+
+
+def page_cache_key(view_name, version, *parts):
+    """整页缓存的键"""
+    suffix = ''.join(f":{part}" for part in parts)
+    return f"{PAGE_CACHE_PREFIX}:{view_name}:{version}{suffix}"
+
+
+def render_cached(request, cache_key, template_name, build_context):
+    """渲染模板并按版本缓存，命中时跳过 build_context 与模板渲染"""
+    content = cache.get(cache_key)
+    if content is None:
+        content = render_to_string(template_name, build_context(), request)
+        cache.set(cache_key, content, settings.PAGE_CACHE_TIMEOUT)
+    response = HttpResponse(content)
+    # 允许缓存但每次使用前都需要重新验证
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,156 @@
+# parser_app/parser_client.py
+"""布局解析服务客户端
+
+同步调用使用共享的 requests.Session，异步调用使用 httpx.AsyncClient，
+两者都复用连接池。不同HTTP库的异常统一转换为 ParserTimeout / ParserRequestError。
+每次调用的地址由 parser_pool 从后端池中选择，调用结果（网络错误、超时与 5xx 计为失败）回报给后端池。
+"""
+import asyncio
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from . import metrics, parser_pool, tracing
+
+REQUEST_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+class ParserRequestError(Exception):
+    """调用解析服务失败"""
+
+
+class ParserTimeout(ParserRequestError):
+    """调用解析服务超时"""
+
+
+class ParserResponse:
+    """解析服务的响应"""
+
+    def __init__(self, status_code, content, elapsed):
+        self.status_code = status_code
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+_session = None
+
+
+def get_session():
+    """进程内共享的 requests.Session"""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.LAYOUT_PARSING_MAX_CONNECTIONS,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def _target(url, backend_call):
+    """请求地址与计入指标的后端名称；指定 url 时不经过后端池"""
+    if url is not None:
+        return url, None
+    return backend_call.backend.url, backend_call.backend.name
+
+
+def _report(backend_call, ok):
+    if backend_call is not None:
+        backend_call.ok = ok
+
+
+def post(body, timeout=None, url=None, backend_call=None):
+    """同步调用解析服务，body 为已经序列化好的JSON字节串
+
+    backend_call 为调用方已经选好的后端（parser_pool.choose()，请求体与后端有关时使用），
+    url 与 backend_call 都不指定时由后端池选择。
+    """
+    if url is None and backend_call is None:
+        with parser_pool.choose() as backend_call:
+            return post(body, timeout, backend_call=backend_call)
+    timeout = timeout or settings.LAYOUT_PARSING_TIMEOUT
+    target, backend = _target(url, backend_call)
+    start_time = time.time()
+    with metrics.parser_call(body, backend) as call, \
+            tracing.span('parser.call', bytes=len(body), backend=backend) as span:
+        headers = {**REQUEST_HEADERS, **tracing.traceparent_headers()}
+        try:
+            response = get_session().post(target, data=body, timeout=timeout, headers=headers)
+        except requests.exceptions.Timeout as e:
+            call['outcome'] = 'timeout'
+            _report(backend_call, False)
+            raise ParserTimeout(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            _report(backend_call, False)
+            raise ParserRequestError(str(e)) from e
+        _report(backend_call, response.status_code < 500)
+        call['outcome'] = str(response.status_code)
+        call['response_bytes'] = len(response.content)
+        if span is not None:
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
+    return ParserResponse(response.status_code, response.content, time.time() - start_time)
+
+
+# 每个事件循环一个 AsyncClient，循环结束后随之回收
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """当前事件循环共享的 httpx.AsyncClient"""
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            headers=REQUEST_HEADERS,
+            limits=httpx.Limits(
+                max_connections=settings.LAYOUT_PARSING_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LAYOUT_PARSING_MAX_CONNECTIONS,
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def apost(body, timeout=None, url=None, backend_call=None):
+    """异步调用解析服务，body 为已经序列化好的JSON字节串；backend_call、url 的含义与 post 相同"""
+    import httpx
+
+    if url is None and backend_call is None:
+        with parser_pool.choose() as backend_call:
+            return await apost(body, timeout, backend_call=backend_call)
+    timeout = timeout or settings.LAYOUT_PARSING_TIMEOUT
+    target, backend = _target(url, backend_call)
+    start_time = time.time()
+    with metrics.parser_call(body, backend) as call, \
+            tracing.span('parser.call', bytes=len(body), backend=backend) as span:
+        try:
+            response = await get_async_client().post(target, content=body, timeout=timeout,
+                                                     headers=tracing.traceparent_headers())
+        except httpx.TimeoutException as e:
+            call['outcome'] = 'timeout'
+            _report(backend_call, False)
+            raise ParserTimeout(str(e)) from e
+        except httpx.HTTPError as e:
+            _report(backend_call, False)
+            raise ParserRequestError(str(e)) from e
+        _report(backend_call, response.status_code < 500)
+        call['outcome'] = str(response.status_code)
+        call['response_bytes'] = len(response.content)
+        if span is not None:
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
+    return ParserResponse(response.status_code, response.content, time.time() - start_time)
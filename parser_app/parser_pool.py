@@ -0,0 +1,257 @@
+# parser_app/parser_pool.py
+"""解析服务后端池
+
+settings.LAYOUT_PARSING_BACKENDS 列出多个解析服务（未设置时只有 LAYOUT_PARSING_API_URL 一个），
+每次调用由 parser_client 从池中选择一个后端：
+- 路由：LAYOUT_PARSING_ROUTING=least_outstanding（默认）选择“进行中请求数 / 权重”最小的后端，
+  weighted 按权重平滑轮询（与 nginx 的加权轮询相同）；
+- 被动摘除：连续 LAYOUT_PARSING_EJECT_FAILURES 次失败（网络错误、超时、5xx）后摘除 LAYOUT_PARSING_EJECT_SECONDS 秒，
+  到期后重新接收请求，再失败一次立即再次摘除；
+- 主动探测：多于一个后端时，后台线程每 LAYOUT_PARSING_HEALTH_INTERVAL 秒请求各后端的健康检查地址
+  （默认为同一主机的 /health，PaddleX 服务化部署提供该接口），失败即摘除，成功即恢复；
+  探测成功不会提前结束被动摘除的时间窗口（/health 正常不代表解析请求不会继续失败）；
+- 所有后端都被摘除时退回使用全部后端，不因探测误判拒绝所有请求。
+状态在每个进程内各自维护（进行中请求数也只统计本进程），各后端的耗时、错误与健康状态见 /metrics。
+池在进程内缓存，fork 后或 LAYOUT_PARSING_* 设置变化（setting_changed 信号，测试中的 override_settings）时重新创建。
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HEALTH_TIMEOUT = 3  # 秒
+
+
+class Backend:
+    """一个解析服务实例及其在本进程中的状态"""
+
+    def __init__(self, url, name=None, weight=1, health_url=None, file_mode=None):
+        self.url = url
+        self.name = name or urlsplit(url).netloc or url
+        self.weight = max(int(weight), 1)
+        self.health_url = health_url or urljoin(url, '/health')
+        # 解析服务获取图片的方式，未设置时使用 LAYOUT_PARSING_FILE_MODE
+        self.file_mode = file_mode or settings.LAYOUT_PARSING_FILE_MODE
+        self.outstanding = 0
+        self.failures = 0
+        # 被动摘除（连续失败）到期的时间
+        self.ejected_until = 0.0
+        # 最近一次主动探测失败
+        self.probe_failed = False
+        self.current_weight = 0
+
+    def available(self, now):
+        return not self.probe_failed and now >= self.ejected_until
+
+    def __repr__(self):
+        return f"Backend({self.name!r})"
+
+
+class BackendPool:
+    def __init__(self, backends, routing='least_outstanding', eject_failures=3, eject_seconds=30):
+        if not backends:
+            raise ValueError('至少需要一个解析服务后端')
+        self.backends = backends
+        self.routing = routing
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.lock = threading.Lock()
+        self._next = 0
+        for backend in backends:
+            metrics.set_parser_backend_health(backend.name, True)
+
+    def candidates(self, now):
+        available = [backend for backend in self.backends if backend.available(now)]
+        return available or self.backends
+
+    def _pick_least_outstanding(self, candidates):
+        # 并列时从上一次的位置之后开始找，负载相同的后端轮流使用
+        self._next = (self._next + 1) % len(candidates)
+        ordered = candidates[self._next:] + candidates[:self._next]
+        return min(ordered, key=lambda backend: (backend.outstanding + 1) / backend.weight)
+
+    def _pick_weighted(self, candidates):
+        total = 0
+        best = None
+        for backend in candidates:
+            backend.current_weight += backend.weight
+            total += backend.weight
+            if best is None or backend.current_weight > best.current_weight:
+                best = backend
+        best.current_weight -= total
+        return best
+
+    def pick(self):
+        """选择一个后端并计入进行中的请求；调用结束后必须 release"""
+        with self.lock:
+            candidates = self.candidates(time.monotonic())
+            if self.routing == 'weighted':
+                backend = self._pick_weighted(candidates)
+            else:
+                backend = self._pick_least_outstanding(candidates)
+            backend.outstanding += 1
+        return backend
+
+    def release(self, backend, ok):
+        """一次调用结束：ok 为 False 时计一次失败，连续失败达到阈值后摘除；None 表示没有发出请求"""
+        with self.lock:
+            backend.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                backend.failures = 0
+                return
+            backend.failures += 1
+            if backend.failures < self.eject_failures:
+                return
+            was_available = backend.available(time.monotonic())
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+        if was_available:
+            logger.warning(f"解析服务 {backend.name} 连续失败 {backend.failures} 次，摘除 {self.eject_seconds} 秒")
+            metrics.record_parser_backend_ejection(backend.name, 'failures')
+            metrics.set_parser_backend_health(backend.name, False)
+
+    def mark_probe(self, backend, healthy):
+        """主动探测的结果：失败立即摘除，成功后恢复（被动摘除的窗口仍要等到期）"""
+        with self.lock:
+            now = time.monotonic()
+            was_available = backend.available(now)
+            backend.probe_failed = not healthy
+            available = backend.available(now)
+        if was_available and not available:
+            logger.warning(f"解析服务 {backend.name} 健康检查失败，摘除")
+            metrics.record_parser_backend_ejection(backend.name, 'probe')
+        elif available and not was_available:
+            logger.info(f"解析服务 {backend.name} 健康检查恢复，重新接收请求")
+        metrics.set_parser_backend_health(backend.name, available)
+
+    def status(self):
+        now = time.monotonic()
+        return [{
+            'name': backend.name,
+            'url': backend.url,
+            'weight': backend.weight,
+            'available': backend.available(now),
+            'outstanding': backend.outstanding,
+            'failures': backend.failures,
+        } for backend in self.backends]
+
+
+def probe(backend, session=None):
+    """请求后端的健康检查地址，2xx 视为健康"""
+    try:
+        response = (session or requests).get(backend.health_url, timeout=HEALTH_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logger.debug(f"解析服务 {backend.name} 健康检查失败: {e}")
+        return False
+    return 200 <= response.status_code < 300
+
+
+class HealthChecker:
+    """本进程的主动探测线程"""
+
+    def __init__(self, pool, interval):
+        self.pool = pool
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.session = requests.Session()
+        self.thread = threading.Thread(target=self.run, name='parser-health', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def check_all(self):
+        for backend in self.pool.backends:
+            self.pool.mark_probe(backend, probe(backend, self.session))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"解析服务健康检查出错: {str(e)}", exc_info=True)
+
+
+def configured_backends():
+    return settings.LAYOUT_PARSING_BACKENDS or [{'url': settings.LAYOUT_PARSING_API_URL}]
+
+
+def build_pool():
+    backends = [Backend(**entry) for entry in configured_backends()]
+    return BackendPool(
+        backends,
+        routing=settings.LAYOUT_PARSING_ROUTING,
+        eject_failures=settings.LAYOUT_PARSING_EJECT_FAILURES,
+        eject_seconds=settings.LAYOUT_PARSING_EJECT_SECONDS,
+    )
+
+
+_pool = None
+_pool_pid = None
+_checker = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """本进程的后端池（fork 后或配置变化后重新创建），多于一个后端时启动探测线程"""
+    global _pool, _pool_pid, _checker
+    pool = _pool
+    if pool is not None and _pool_pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if _checker is not None:
+                _checker.stop()
+                _checker = None
+            pool = build_pool()
+            if len(pool.backends) > 1 and settings.LAYOUT_PARSING_HEALTH_INTERVAL > 0:
+                _checker = HealthChecker(pool, settings.LAYOUT_PARSING_HEALTH_INTERVAL)
+                _checker.start()
+            _pool, _pool_pid = pool, os.getpid()
+        return _pool
+
+
+def reset_pool():
+    """丢弃当前的池，下一次调用时按最新配置重新创建"""
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+@receiver(setting_changed)
+def _layout_parsing_setting_changed(*, setting, **kwargs):
+    if setting.startswith('LAYOUT_PARSING_'):
+        reset_pool()
+
+
+class Call:
+    """一次调用占用的后端；ok 为调用结果，None 表示没有发出请求（不计成功也不计失败）"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.ok = None
+
+
+@contextmanager
+def choose():
+    """选择一个后端，退出时报告调用结果"""
+    pool = get_pool()
+    call = Call(pool.pick())
+    try:
+        yield call
+    finally:
+        pool.release(call.backend, call.ok)
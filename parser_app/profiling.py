@@ -0,0 +1,150 @@
+# parser_app/profiling.py
+"""单个请求的性能剖析（需开启 PROFILING_ENABLED）
+
+员工用户在请求中带上 `X-Profile: 1` 请求头或 `?_profile=1` 参数时，响应会附带 Server-Timing 头：
+数据库查询次数与耗时、模板渲染耗时、解析服务调用耗时与总耗时，浏览器开发者工具的 Timing 面板可直接查看。
+取值为 `cprofile` 时还会用 cProfile 剖析该请求，结果写入 PROFILING_OUTPUT_DIR，
+文件名通过 X-Profile-File 响应头返回，可用 `python -m pstats` 或 snakeviz 查看。
+
+查询、模板与解析服务的耗时来自 metrics.RequestStats，因此本中间件必须位于 metrics_middleware 之后。
+"""
+import cProfile
+import logging
+import os
+import time
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import current_request_stats
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+
+def requested_mode(request):
+    """请求的剖析方式：None、'timing' 或 'cprofile'（只对员工用户生效）"""
+    value = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+    if not value:
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return None
+    return 'cprofile' if value.lower() == 'cprofile' else 'timing'
+
+
+class Snapshot:
+    """请求开始时的统计值，结束时相减得到本中间件内部的耗时"""
+
+    def __init__(self):
+        stats = current_request_stats()
+        self.stats = stats
+        self.queries = stats.queries if stats else 0
+        self.query_time = stats.query_time if stats else 0.0
+        self.template_time = stats.template_time if stats else 0.0
+        self.parser_calls = stats.parser_calls if stats else 0
+        self.parser_time = stats.parser_time if stats else 0.0
+        self.start = time.perf_counter()
+
+    def server_timing(self):
+        total = (time.perf_counter() - self.start) * 1000
+        entries = []
+        stats = self.stats
+        if stats is not None:
+            queries = stats.queries - self.queries
+            entries.append(f'db;dur={(stats.query_time - self.query_time) * 1000:.1f};desc="{queries} queries"')
+            entries.append(f'tpl;dur={(stats.template_time - self.template_time) * 1000:.1f};desc="templates"')
+            calls = stats.parser_calls - self.parser_calls
+            entries.append(f'parser;dur={(stats.parser_time - self.parser_time) * 1000:.1f};desc="{calls} calls"')
+        entries.append(f'total;dur={total:.1f}')
+        return ', '.join(entries)
+
+
+def profile_path(request):
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name if match else None) or 'unresolved'
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return os.path.join(settings.PROFILING_OUTPUT_DIR, f"{stamp}_{request.method}_{view.replace(':', '-')}.prof")
+
+
+def dump_profile(request, response, profiler):
+    os.makedirs(settings.PROFILING_OUTPUT_DIR, exist_ok=True)
+    path = profile_path(request)
+    profiler.dump_stats(path)
+    response['X-Profile-File'] = os.path.basename(path)
+    logger.info(f"Profile written to {path}")
+
+
+def start_profiler():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 已有其他剖析器在运行（如另一个并发请求正在剖析）
+        return None
+    return profiler
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """按需为员工用户的请求附加 Server-Timing 并保存 cProfile 结果"""
+    if not settings.PROFILING_ENABLED:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            # 事件循环线程上的 cProfile 会混入其他并发请求，异步模式只提供 Server-Timing
+            if not requested_mode(request):
+                return await get_response(request)
+            snapshot = Snapshot()
+            response = await get_response(request)
+            response['Server-Timing'] = snapshot.server_timing()
+            return response
+    else:
+        def middleware(request):
+            mode = requested_mode(request)
+            if not mode:
+                return get_response(request)
+            snapshot = Snapshot()
+            profiler = start_profiler() if mode == 'cprofile' else None
+            try:
+                response = get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            response['Server-Timing'] = snapshot.server_timing()
+            if profiler is not None:
+                dump_profile(request, response, profiler)
+            return response
+    return middleware
+
+
+def install_template_timer():
+    """统计模板渲染耗时（计入 RequestStats.template_time）
+
+    Django 没有提供模板渲染的钩子，这里包装模板后端的 Template.render；
+    只统计顶层渲染，{% include %} 的子模板计入所属模板。
+    """
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, '_timed', False):
+        return
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        stats = current_request_stats()
+        if stats is None:
+            return original_render(self, context, request)
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+    render._timed = True
+    Template.render = render
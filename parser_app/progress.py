@@ -0,0 +1,207 @@
+# parser_app/progress.py
+"""上传进度推送
+
+浏览器通过 Server-Sent Events 订阅一条记录的状态变化和逐条写入的解析结果，
+不支持SSE或连接中断时退回到长轮询。进度直接从数据库读取，因此无论解析在哪个
+worker进程中进行都能看到。
+
+SSE 与长轮询在等待期间占用处理请求的线程。ASGI 与多线程 WSGI worker（gunicorn.conf.py 默认的 gthread）
+可以承受；单线程的 sync worker 每个连接独占整个进程，几个打开的页面就会占满所有 worker，
+因此这种部署下不提供 SSE 地址，长轮询立即返回，由页面每隔 PROGRESS_SHORT_POLL_INTERVAL 秒查询一次。
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+
+from .models import ImageUpload
+from .storage import RecordMedia
+
+FINAL_STATUSES = ('completed', 'failed')
+
+
+def streaming_supported(request):
+    """当前 worker 能否长时间挂起请求：ASGI 总是可以，WSGI 由 PROGRESS_STREAMING 决定"""
+    return 'wsgi.version' not in request.META or settings.PROGRESS_STREAMING
+
+
+def follow_urls(request, record_id):
+    """订阅进度的地址；不能长时间挂起请求时没有 events_url，并给出短轮询的间隔"""
+    if streaming_supported(request):
+        return {'events_url': reverse('upload_events', args=[record_id]),
+                'progress_url': reverse('upload_progress', args=[record_id])}
+    return {'events_url': None,
+            'progress_url': reverse('upload_progress', args=[record_id]),
+            'poll_interval': settings.PROGRESS_SHORT_POLL_INTERVAL}
+
+
+def serialize_result(record, media, result):
+    """单条解析结果的摘要"""
+    return {
+        'index': result.result_index,
+        'pruned_result': str(result.pruned_result),
+        'markdown': result.markdown_text,
+        'markdown_url': media.markdown_url(result.result_index),
+        'detail_url': reverse('result_detail', args=[record.id, result.result_index]),
+    }
+
+
+def progress_snapshot(record_id, after=0):
+    """记录当前状态及索引不小于 after 的解析结果；记录不存在时返回None"""
+    record = ImageUpload.objects.filter(id=record_id).first()
+    if record is None:
+        return None
+    media = RecordMedia(record)
+    results = record.results.filter(result_index__gte=after).order_by('result_index')
+    return {
+        'id': record.id,
+        'status': record.status,
+        'status_display': record.get_status_display(),
+        'error_message': record.error_message,
+        'processing_time': record.processing_time,
+        'results': [serialize_result(record, media, result) for result in results],
+        'done': record.status in FINAL_STATUSES,
+        'record_url': reverse('record_detail', args=[record.id]),
+    }
+
+
+def sse_event(event, data, event_id=None):
+    """格式化一条SSE消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class ProgressTracker:
+    """比较相邻两次快照，生成需要推送的SSE消息"""
+
+    def __init__(self, record_id, after=0):
+        self.record_id = record_id
+        self.next_index = after
+        self.last_status = None
+        self.done = False
+
+    def poll(self):
+        snapshot = progress_snapshot(self.record_id, self.next_index)
+        if snapshot is None:
+            self.done = True
+            return [sse_event('error', {'error': '记录不存在'})]
+
+        events = []
+        if snapshot['status'] != self.last_status:
+            self.last_status = snapshot['status']
+            events.append(sse_event('status', {
+                key: snapshot[key] for key in ('status', 'status_display', 'error_message', 'processing_time')
+            }))
+        for result in snapshot['results']:
+            self.next_index = result['index'] + 1
+            # id 为已收到的结果数量，断线重连时通过 Last-Event-ID 续传
+            events.append(sse_event('result', result, event_id=self.next_index))
+        if snapshot['done']:
+            self.done = True
+            events.append(sse_event('done', {
+                'status': snapshot['status'],
+                'error_message': snapshot['error_message'],
+                'record_url': snapshot['record_url'],
+            }))
+        return events
+
+
+def resume_index(request):
+    """从 Last-Event-ID 或 ?after= 取得已收到的结果数量"""
+    value = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('after') or 0
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _stream_headers(response):
+    response['Cache-Control'] = 'no-cache'
+    # 禁止nginx缓冲，保证消息及时送达
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def iter_sse(tracker, lifetime):
+    """同步SSE消息流（WSGI）"""
+    deadline = time.monotonic() + lifetime
+    yield 'retry: 2000\n\n'
+    while True:
+        events = tracker.poll()
+        # 没有新消息时发送注释行保持连接
+        yield ''.join(events) or ': keep-alive\n\n'
+        if tracker.done or time.monotonic() >= deadline:
+            return
+        time.sleep(settings.PROGRESS_POLL_INTERVAL)
+
+
+async def aiter_sse(tracker):
+    """异步SSE消息流（ASGI），等待期间不占用线程"""
+    deadline = time.monotonic() + settings.PROGRESS_STREAM_TIMEOUT
+    yield 'retry: 2000\n\n'
+    while True:
+        events = await sync_to_async(tracker.poll)()
+        yield ''.join(events) or ': keep-alive\n\n'
+        if tracker.done or time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(settings.PROGRESS_POLL_INTERVAL)
+
+
+def sse_response(request, record_id, asynchronous=False):
+    """SSE响应"""
+    tracker = ProgressTracker(record_id, resume_index(request))
+    if asynchronous:
+        stream = aiter_sse(tracker)
+    else:
+        # sync worker 下只发送当前状态，浏览器按 retry 间隔重连
+        stream = iter_sse(tracker, settings.PROGRESS_STREAM_TIMEOUT if streaming_supported(request) else 0)
+    return _stream_headers(StreamingHttpResponse(stream, content_type='text/event-stream'))
+
+
+def _changed(snapshot, known_status):
+    return snapshot is None or snapshot['done'] or snapshot['results'] or snapshot['status'] != known_status
+
+
+def record_not_found():
+    """记录不存在（或 MEDIA_ACCESS=owner 时无权访问）"""
+    return JsonResponse({'error': '记录不存在'}, status=404)
+
+
+def _long_poll_response(snapshot):
+    if snapshot is None:
+        return record_not_found()
+    return JsonResponse(snapshot)
+
+
+def _long_poll_args(request):
+    long_poll_allowed = request.GET.get('wait') != '0' and streaming_supported(request)
+    wait = settings.PROGRESS_LONG_POLL_TIMEOUT if long_poll_allowed else 0
+    return resume_index(request), request.GET.get('status', ''), time.monotonic() + wait
+
+
+def long_poll(request, record_id):
+    """长轮询：有新状态或新结果时立即返回，否则等待到超时"""
+    after, known_status, deadline = _long_poll_args(request)
+    while True:
+        snapshot = progress_snapshot(record_id, after)
+        if _changed(snapshot, known_status) or time.monotonic() >= deadline:
+            return _long_poll_response(snapshot)
+        time.sleep(settings.PROGRESS_POLL_INTERVAL)
+
+
+async def along_poll(request, record_id):
+    """长轮询（异步）"""
+    after, known_status, deadline = _long_poll_args(request)
+    while True:
+        snapshot = await sync_to_async(progress_snapshot)(record_id, after)
+        if _changed(snapshot, known_status) or time.monotonic() >= deadline:
+            return _long_poll_response(snapshot)
+        await asyncio.sleep(settings.PROGRESS_POLL_INTERVAL)
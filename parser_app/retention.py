@@ -0,0 +1,266 @@
+# parser_app/retention.py
+"""旧记录的归档与按需还原
+
+每条记录的 Markdown 目录与输出图片在上传后很少再被访问，却一直占用 MEDIA_ROOT，
+ParseResult.raw_data（含 base64 图片的完整解析响应）也让数据库持续膨胀。
+manage.py archive_records 把超过 RETENTION_DAYS 天的已完成记录打包：
+
+    archives/<h0h1>/<h2h3>/<token>.zip
+        markdown_<record_id>_<index>/...    记录目录下除原始上传文件外的全部文件
+        <name>_<record_id>_<index>.jpg
+        results.json                        {result_index: raw_data}
+
+归档写入存储后清空 raw_data、删除已打包的文件；原始上传文件、Markdown 文本与精简结果仍留在原处，
+列表、搜索与详情页的文字内容不受影响。
+
+打开已归档记录的详情页或访问其文件时，把归档解压到 MEDIA_ROOT/REHYDRATION_CACHE_PREFIX/<token>/
+（位于 MEDIA_ROOT 之下，nginx 的 X-Accel-Redirect 照常可用）。缓存目录按最近访问时间淘汰，
+总大小不超过 REHYDRATION_CACHE_MAX_BYTES。
+"""
+import json
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics, tracing
+from .models import ImageUpload, ParseResult
+from .storage import RECORDS_PREFIX, RecordMedia
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = 'archives'
+RESULTS_MEMBER = 'results.json'
+# 缓存目录解压完成的标记，内容为目录总字节数，修改时间为最近访问时间
+CACHE_MARKER = '.rehydrated'
+# 已经压缩过的格式直接存储，不再浪费CPU
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.gz', '.pdf'}
+
+ArchiveStats = namedtuple('ArchiveStats', ['files', 'media_bytes', 'archive_bytes', 'payload_bytes'])
+
+
+def archive_name(record):
+    """记录归档在存储中的路径"""
+    directory = RecordMedia(record).directory
+    return posixpath.join(ARCHIVE_PREFIX, directory[len(RECORDS_PREFIX) + 1:] + '.zip')
+
+
+def archivable(days=None, now=None):
+    """可以归档的记录：超过保留期、已完成、尚未归档且使用分片目录布局（旧布局先运行 migrate_media）"""
+    days = settings.RETENTION_DAYS if days is None else days
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return ImageUpload.objects.filter(
+        status='completed', archived_at__isnull=True, upload_time__lt=cutoff,
+        image__startswith=RECORDS_PREFIX + '/',
+    )
+
+
+def walk(storage, path):
+    """递归列出目录下全部文件，返回相对于 path 的路径"""
+    try:
+        dirs, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    yield from files
+    for name in dirs:
+        for child in walk(storage, posixpath.join(path, name)):
+            yield posixpath.join(name, child)
+
+
+def _compress_type(name):
+    ext = posixpath.splitext(name)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _prune_empty_dirs(storage, directory):
+    """本地磁盘上删除打包后留下的空目录（对象存储没有真正的目录）"""
+    if not isinstance(storage, FileSystemStorage):
+        return
+    root = storage.path(directory)
+    for path, _, _ in os.walk(root, topdown=False):
+        if path != root:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+
+def archive_record(record, storage=None):
+    """打包一条记录的结果文件与 raw_data，返回 ArchiveStats"""
+    storage = storage or default_storage
+    media = RecordMedia(record, storage)
+    directory = media.directory
+    names = [name for name in walk(storage, directory)
+             if posixpath.join(directory, name) != record.image.name]
+    payload = {
+        str(result.result_index): result.raw_data
+        for result in record.results.all()
+        if result.raw_data is not None
+    }
+    encoded_payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    name = archive_name(record)
+    media_bytes = 0
+
+    with tracing.span('retention.archive', record_id=record.id, files=len(names)):
+        with tempfile.TemporaryFile() as tmp:
+            with zipfile.ZipFile(tmp, 'w', compresslevel=6) as archive:
+                for member in names:
+                    with storage.open(posixpath.join(directory, member), 'rb') as f:
+                        data = f.read()
+                    media_bytes += len(data)
+                    archive.writestr(member, data, compress_type=_compress_type(member))
+                archive.writestr(RESULTS_MEMBER, encoded_payload, compress_type=zipfile.ZIP_DEFLATED)
+            archive_bytes = tmp.tell()
+            tmp.seek(0)
+            storage.save(name, File(tmp, name=posixpath.basename(name)))
+
+        now = timezone.now()
+        with transaction.atomic():
+            ParseResult.objects.filter(image_id=record.id).update(raw_data=None)
+            ImageUpload.objects.filter(id=record.id).update(archived_at=now, archive_name=name, updated_at=now)
+
+        # 归档与数据库都已更新后再删除原文件，中途失败时记录仍完整可用
+        for member in names:
+            storage.delete(posixpath.join(directory, member))
+        _prune_empty_dirs(storage, directory)
+
+    record.archived_at = now
+    record.archive_name = name
+    metrics.record_archived(media_bytes, archive_bytes)
+    return ArchiveStats(len(names), media_bytes, archive_bytes, len(encoded_payload) if payload else 0)
+
+
+def load_raw_data(record, storage=None):
+    """从归档中读出各结果的 raw_data：{result_index: raw_data}"""
+    storage = storage or default_storage
+    with storage.open(record.archive_name, 'rb') as f, zipfile.ZipFile(f) as archive:
+        payload = json.loads(archive.read(RESULTS_MEMBER))
+    return {int(index): raw_data for index, raw_data in payload.items()}
+
+
+# 还原缓存
+def cache_root():
+    return os.path.join(settings.MEDIA_ROOT, settings.REHYDRATION_CACHE_PREFIX)
+
+
+def cache_storage():
+    """还原缓存所在的本地存储；文件名相对于 MEDIA_ROOT，与 X-Accel-Redirect 的映射一致"""
+    return FileSystemStorage(location=settings.MEDIA_ROOT)
+
+
+def cache_directory(record):
+    """记录在还原缓存中的目录（相对于 MEDIA_ROOT），以令牌区分，记录删除后 id 被重用也不会串"""
+    return posixpath.join(settings.REHYDRATION_CACHE_PREFIX, posixpath.basename(RecordMedia(record).directory))
+
+
+def _directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, _, filenames in os.walk(path)
+        for filename in filenames
+    )
+
+
+def rehydrate(record, storage=None):
+    """把已归档记录的文件解压到还原缓存（已在缓存中则只更新访问时间），返回缓存目录的绝对路径"""
+    path = os.path.join(settings.MEDIA_ROOT, cache_directory(record))
+    marker = os.path.join(path, CACHE_MARKER)
+    try:
+        os.utime(marker)
+        metrics.record_rehydration('hit')
+        return path
+    except FileNotFoundError:
+        pass
+
+    storage = storage or default_storage
+    root = cache_root()
+    os.makedirs(root, exist_ok=True)
+    with tracing.span('retention.rehydrate', record_id=record.id):
+        # 先解压到临时目录再改名，其他请求不会看到解压了一半的目录
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=root)
+        try:
+            with storage.open(record.archive_name, 'rb') as f, zipfile.ZipFile(f) as archive:
+                for info in archive.infolist():
+                    if info.filename != RESULTS_MEMBER:
+                        archive.extract(info, tmp)
+            with open(os.path.join(tmp, CACHE_MARKER), 'w') as f:
+                f.write(str(_directory_size(tmp)))
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # 其他进程同时解压并先完成了
+                if not os.path.exists(marker):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    metrics.record_rehydration('miss')
+    evict(keep=path)
+    return path
+
+
+def rehydrated_file(record, relative_path, storage=None):
+    """已归档记录中的文件：确保已解压后返回 (缓存存储, 文件名)，归档里没有该文件时返回 None"""
+    rehydrate(record, storage)
+    cache = cache_storage()
+    name = posixpath.join(cache_directory(record), relative_path)
+    return (cache, name) if cache.exists(name) else None
+
+
+def cached_entries():
+    """还原缓存中的目录：[(最近访问时间, 字节数, 绝对路径)]"""
+    root = cache_root()
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    entries = []
+    for name in names:
+        if name.startswith('.'):
+            continue
+        path = os.path.join(root, name)
+        marker = os.path.join(path, CACHE_MARKER)
+        try:
+            accessed = os.stat(marker).st_mtime
+            with open(marker) as f:
+                size = int(f.read() or 0)
+        except (OSError, ValueError):
+            continue
+        entries.append((accessed, size, path))
+    return entries
+
+
+def evict(keep=None, max_bytes=None):
+    """按最近访问时间淘汰缓存目录，直到总大小不超过上限；返回淘汰的目录数"""
+    max_bytes = settings.REHYDRATION_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = sorted(cached_entries())
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        evicted += 1
+    return evicted
+
+
+def delete_archive(record, storage=None):
+    """删除记录的归档与还原缓存"""
+    if not record.archive_name:
+        return
+    storage = storage or default_storage
+    if storage.exists(record.archive_name):
+        storage.delete(record.archive_name)
+    shutil.rmtree(os.path.join(settings.MEDIA_ROOT, cache_directory(record)), ignore_errors=True)
@@ -0,0 +1,109 @@
+# parser_app/scheduler.py
+"""后台解析的调度策略
+
+待处理（pending）的记录就是队列，保存在数据库中，所有 worker 进程共享。
+每当有空闲的解析名额，按以下顺序挑选下一条：
+1. 优先级：交互上传 > 管理员重新处理 > 批量；排队每满 SCHEDULER_AGING_SECONDS 提升一级，批量任务不会被饿死；
+2. 客户端公平：同一优先级内，正在处理的记录最少的客户端先得到名额，一个客户端的大批任务不会占满所有名额；
+3. 短作业优先：其余条件相同时先处理页数少、文件小的，最后按入队时间。
+选中后以带 status 条件的 UPDATE 认领（同时写入租约，见 leases.py），多个进程同时选中同一条时只有一个成功。
+"""
+from django.conf import settings
+from django.db.models import Count, F, Min
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import metrics
+from .admission import api_key
+from .leases import lease_fields
+from .models import ImageUpload
+
+CLAIM_ATTEMPTS = 5
+
+PRIORITY_LABELS = {
+    ImageUpload.PRIORITY_INTERACTIVE: 'interactive',
+    ImageUpload.PRIORITY_REPROCESS: 'reprocess',
+    ImageUpload.PRIORITY_BATCH: 'batch',
+}
+
+
+def request_priority(request):
+    """上传请求的优先级：携带已登记 API 密钥或 priority=batch（表单字段或查询参数）的为批量，其余为交互"""
+    if api_key(request) or request.POST.get('priority', request.GET.get('priority')) == 'batch':
+        return ImageUpload.PRIORITY_BATCH
+    return ImageUpload.PRIORITY_INTERACTIVE
+
+
+def effective_priority(priority, oldest, now):
+    """考虑排队时间后的优先级"""
+    promoted = int((now - oldest).total_seconds() // settings.SCHEDULER_AGING_SECONDS)
+    return max(priority - promoted, 0)
+
+
+def pick_group(groups, running, now):
+    """从按 (优先级, 客户端) 汇总的待处理记录中选出下一组
+
+    groups 中每项包含 priority、client_key、oldest、min_pages、min_size；
+    running 为各客户端正在处理的记录数。
+    """
+    return min(groups, key=lambda g: (
+        effective_priority(g['priority'], g['oldest'], now),
+        running.get(g['client_key'], 0),
+        g['min_pages'],
+        g['min_size'],
+        g['oldest'],
+    ))
+
+
+def pending_groups():
+    return list(
+        ImageUpload.objects.filter(status='pending')
+        .values('priority', 'client_key')
+        .annotate(
+            oldest=Min(Coalesce('queued_at', 'upload_time')),
+            min_pages=Min('page_count'),
+            min_size=Min('file_size'),
+            count=Count('id'),
+        )
+    )
+
+
+def running_by_client():
+    return dict(
+        ImageUpload.objects.filter(status='processing')
+        .values_list('client_key')
+        .annotate(count=Count('id'))
+    )
+
+
+def queue_depth():
+    depth = ImageUpload.objects.filter(status='pending').count()
+    metrics.PARSE_QUEUE_DEPTH.set(depth)
+    return depth
+
+
+def claim_next():
+    """挑选并认领下一条待处理记录（状态改为 processing 并记录排队时间），队列为空时返回 None"""
+    for _ in range(CLAIM_ATTEMPTS):
+        groups = pending_groups()
+        if not groups:
+            return None
+        now = timezone.now()
+        group = pick_group(groups, running_by_client(), now)
+        job = (
+            ImageUpload.objects.filter(status='pending', priority=group['priority'], client_key=group['client_key'])
+            .order_by('page_count', 'file_size', 'queued_at', 'id')
+            .values('id', 'queued_at', 'upload_time')
+            .first()
+        )
+        if job is None:
+            continue
+        wait = max((now - (job['queued_at'] or job['upload_time'])).total_seconds(), 0)
+        claimed = ImageUpload.objects.filter(id=job['id'], status='pending').update(
+            status='processing', started_at=now, queue_wait=wait, updated_at=now,
+            attempts=F('attempts') + 1, **lease_fields(now),
+        )
+        if claimed:
+            metrics.QUEUE_WAIT.labels(PRIORITY_LABELS[group['priority']]).observe(wait)
+            return ImageUpload.objects.get(id=job['id'])
+    return None
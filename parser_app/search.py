@@ -0,0 +1,93 @@
+# parser_app/search.py
+"""解析结果的搜索索引
+
+结果正文压缩存储（见 fields.py）后，数据库无法再对 markdown_text / pruned_result 做子串匹配。
+每条结果在 ResultSearchIndex 中保存一份只用于搜索的纯文本：
+- Markdown 去掉 HTML 标签、图片引用与多余空白；
+- 精简结果只取其中的文字字段（block_content、rec_texts），已在 Markdown 中出现的不再重复，坐标、置信度等不进入索引。
+历史搜索与管理后台按这张表做 icontains 匹配，详情页等读取正文的查询不会读到它。
+"""
+import ast
+import json
+import re
+
+from .models import ResultSearchIndex
+
+TAG_RE = re.compile(r'<[^>]+>')
+MARKDOWN_IMAGE_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+# 精简结果中保存文字的字段：版面区块内容与OCR识别文本
+TEXT_KEYS = {'block_content', 'rec_texts', 'text'}
+
+
+def load_structure(pruned_result):
+    if not isinstance(pruned_result, str):
+        return pruned_result
+    for loads in (json.loads, ast.literal_eval):
+        try:
+            return loads(pruned_result)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+    return pruned_result
+
+
+def _texts(value):
+    """结构中文字字段（TEXT_KEYS）的值；坐标等数字列表直接跳过"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in TEXT_KEYS:
+                if isinstance(item, str):
+                    yield item
+                elif isinstance(item, list):
+                    yield from (text for text in item if isinstance(text, str))
+            elif isinstance(item, (dict, list)):
+                yield from _texts(item)
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)):
+                yield from _texts(item)
+
+
+def normalize(text):
+    text = MARKDOWN_IMAGE_RE.sub(' ', text or '')
+    text = TAG_RE.sub(' ', text)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+
+def search_text(markdown_text, pruned_result):
+    """结果的搜索文本"""
+    markdown_text = markdown_text or ''
+    parts = [normalize(markdown_text)]
+    structure = load_structure(pruned_result)
+    # 无法解析的精简结果整体作为文字
+    for value in [structure] if isinstance(structure, str) else _texts(structure):
+        # 区块内容通常原样出现在 Markdown 里
+        if value in markdown_text:
+            continue
+        value = normalize(value)
+        if value and value not in parts[0]:
+            parts.append(value)
+    return '\n'.join(part for part in parts if part)
+
+
+def index_entry(result):
+    return ResultSearchIndex(result_id=result.pk, image_id=result.image_id,
+                             content=search_text(result.markdown_text, result.pruned_result))
+
+
+def index_new_result(result):
+    """为新建的结果写入索引（重新处理时旧结果连同索引已被删除）"""
+    index_entry(result).save(force_insert=True)
+
+
+def rebuild(results):
+    """批量重建索引；results 为 ParseResult 的可迭代对象，返回写入的条数"""
+    entries = [index_entry(result) for result in results]
+    ResultSearchIndex.objects.filter(result_id__in=[entry.result_id for entry in entries]).delete()
+    ResultSearchIndex.objects.bulk_create(entries)
+    return len(entries)
+
+
+def matching_image_ids(query):
+    """内容包含 query 的结果所属记录的 id（子查询）"""
+    return ResultSearchIndex.objects.filter(content__icontains=query).values('image_id')
@@ -0,0 +1,208 @@
+# parser_app/similarity.py
+"""近似重复上传的检测
+
+同一页纸的重新扫描、重新拍照字节不同，却同样要花一次完整的解析。每条上传记录保存图片的
+差值哈希（dHash，64位）：缩成 9x8 灰度图后比较相邻像素的明暗，缩放、压缩质量、轻微亮度变化
+基本不改变哈希，汉明距离小于 NEAR_DUPLICATE_MAX_DISTANCE 即视为同一页。
+
+查找使用进程内的 BK 树（按与节点哈希的汉明距离分叉，查询时由三角不等式剪枝）：
+- 首次使用时加载 SIMILARITY_INDEX_PATH 的快照（manage.py build_similarity_index 生成），
+  之后每次查询前只从数据库读取 id 大于已索引最大 id 的新记录追加进树；
+- 树只增不删，命中的记录再到数据库确认仍为已完成、未归档且有解析结果。
+
+上传时的行为由 NEAR_DUPLICATE_MODE 或请求字段 near_duplicate 决定：
+off 不检查；offer 发现近似记录时不保存文件，返回 409 与候选记录，由调用方决定是否复用；
+reuse 直接复用最接近的记录的解析结果（复制结果与媒体文件），不再调用解析服务。
+"""
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+from django.conf import settings
+from PIL import Image
+
+from .models import ImageUpload
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+HASH_MASK = (1 << 64) - 1
+MODES = ('off', 'offer', 'reuse')
+SNAPSHOT_VERSION = 1
+
+
+# 哈希
+def to_signed(value):
+    """64位无符号哈希 -> 可存入 BigIntegerField 的有符号整数"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a, b):
+    return ((a ^ b) & HASH_MASK).bit_count()
+
+
+def dhash(image):
+    """图片的差值哈希（有符号64位整数）"""
+    # JPEG 可以直接按缩小的尺寸解码，大图不必完整解码
+    image.draft('L', (HASH_SIZE * 16, HASH_SIZE * 16))
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return to_signed(bits)
+
+
+def inspect(f):
+    """解码一次文件对象中的图片，返回 (哈希, 帧数)；无法识别时为 (None, 1)，读取后把位置复原到开头
+
+    哈希取多帧图片的第一帧，帧数作为调度时的作业大小提示。
+    """
+    try:
+        with Image.open(f) as image:
+            page_count = max(getattr(image, 'n_frames', 1), 1)
+            return dhash(image), page_count
+    except Exception:
+        return None, 1
+    finally:
+        f.seek(0)
+
+
+def file_hash(f):
+    """文件对象中图片的哈希（多帧图片取第一帧），无法识别时返回 None；读取后把位置复原到开头"""
+    return inspect(f)[0]
+
+
+# BK 树
+class BKTree:
+    """按汉明距离组织的 BK 树；节点为 [哈希, [记录id...], {距离: 子节点}]"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """距离不超过 radius 的 [(距离, 记录id)]，按距离排序"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return sorted(found)
+
+
+class SimilarityIndex:
+    """进程内的哈希索引，按记录 id 增量追加"""
+
+    def __init__(self, tree=None, max_id=0):
+        self.tree = tree or BKTree()
+        self.max_id = max_id
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """追加数据库中新增的记录"""
+        with self.lock:
+            rows = (ImageUpload.objects.filter(id__gt=self.max_id, perceptual_hash__isnull=False)
+                    .order_by('id').values_list('id', 'perceptual_hash'))
+            for record_id, value in rows.iterator(chunk_size=5000):
+                self.tree.add(value, record_id)
+                self.max_id = record_id
+
+    def search(self, value, radius):
+        self.refresh()
+        return self.tree.search(value, radius)
+
+    # 快照
+    def save(self, path):
+        """原子地写入快照文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.index-', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((SNAPSHOT_VERSION, self.max_id, self.tree), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """读取快照（文件由本服务写入，只能放在服务自己可写的目录）；不存在或版本不符时返回空索引"""
+        try:
+            with open(path, 'rb') as f:
+                version, max_id, tree = pickle.load(f)
+        except FileNotFoundError:
+            return cls()
+        except Exception as e:
+            logger.warning(f"读取近似图片索引快照失败，从数据库重建: {str(e)}")
+            return cls()
+        if version != SNAPSHOT_VERSION:
+            return cls()
+        return cls(tree, max_id)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex.load(settings.SIMILARITY_INDEX_PATH)
+    return _index
+
+
+def build_index():
+    """从数据库完整重建索引"""
+    index = SimilarityIndex()
+    index.refresh()
+    return index
+
+
+# 上传时的查找
+def request_mode(request):
+    mode = request.POST.get('near_duplicate') or settings.NEAR_DUPLICATE_MODE
+    return mode if mode in MODES else 'off'
+
+
+def near_duplicates(value, radius=None, limit=5):
+    """与哈希近似、可以复用的记录 [(距离, 记录)]，最接近的在前（距离相同时较新的在前）"""
+    if value is None:
+        return []
+    radius = settings.NEAR_DUPLICATE_MAX_DISTANCE if radius is None else radius
+    distances = {}
+    for distance, record_id in get_index().search(value, radius):
+        distances.setdefault(record_id, distance)
+    if not distances:
+        return []
+    records = (ImageUpload.objects.filter(id__in=distances, status='completed', archived_at__isnull=True,
+                                          results__isnull=False).distinct())
+    return sorted(((distances[record.id], record) for record in records),
+                  key=lambda item: (item[0], -item[1].id))[:limit]
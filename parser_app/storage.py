@@ -0,0 +1,293 @@
+# parser_app/storage.py
+"""媒体文件存储
+
+所有媒体文件的路径与URL只在这里计算。每条上传记录拥有独立目录，目录按令牌的
+哈希分片，避免所有文件堆在 MEDIA_ROOT 的同一层：
+
+    records/<h0h1>/<h2h3>/<token>/
+        <token>.<ext>                       原始上传文件
+        markdown_<record_id>_<index>/doc.md Markdown文本
+        markdown_<record_id>_<index>/<img>  Markdown引用的图片
+        <name>_<record_id>_<index>.jpg      输出图片（区块检测/顺序检测预览）
+
+实际读写通过 Django 的 Storage 完成，后端由 settings.STORAGES['default'] 决定：
+- LocalMediaStorage: 本地磁盘（MEDIA_ROOT）
+- S3MediaStorage: S3兼容对象存储（需要安装 boto3，可对接 MinIO 等本地替身）
+"""
+import hashlib
+import mimetypes
+import posixpath
+import re
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+from django.utils.deconstruct import deconstructible
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+from . import metrics, tracing
+
+RECORDS_PREFIX = 'records'
+
+
+def record_directory(token):
+    """按令牌哈希分片后的记录目录"""
+    digest = hashlib.sha1(token.encode('utf-8')).hexdigest()
+    return posixpath.join(RECORDS_PREFIX, digest[:2], digest[2:4], token)
+
+
+def upload_name(original_filename, token=None):
+    """为新上传的文件生成存储路径"""
+    ext = original_filename.split('.')[-1].lower() if '.' in original_filename else 'bin'
+    token = token or uuid.uuid4().hex[:10]
+    return posixpath.join(record_directory(token), f"{token}.{ext}")
+
+
+class RecordMedia:
+    """单条上传记录的媒体文件路径、URL与读写"""
+
+    def __init__(self, record, storage=None):
+        self.record = record
+        self.storage = storage or default_storage
+
+    @property
+    def directory(self):
+        """记录目录（原始文件所在目录）"""
+        return posixpath.dirname(self.record.image.name)
+
+    def _join(self, *parts):
+        return posixpath.join(self.directory, *parts) if self.directory else posixpath.join(*parts)
+
+    # 路径
+    def markdown_dir(self, result_index):
+        return self._join(f"markdown_{self.record.id}_{result_index}")
+
+    def markdown_name(self, result_index):
+        return posixpath.join(self.markdown_dir(result_index), 'doc.md')
+
+    def markdown_image_name(self, result_index, img_path):
+        return posixpath.join(self.markdown_dir(result_index), img_path)
+
+    def output_image_name(self, img_filename):
+        return self._join(img_filename)
+
+    def resolve(self, relative_path):
+        """把URL中的相对路径还原为存储路径；路径非法或不属于该记录时返回None"""
+        parts = relative_path.split('/')
+        if '\\' in relative_path or any(part in ('', '.', '..') for part in parts):
+            return None
+        name = self._join(relative_path)
+        if self.directory.startswith(RECORDS_PREFIX + '/'):
+            return name
+
+        # 未迁移的旧记录：只允许能确定属于它的文件
+        if name == self.record.image.name:
+            return name
+        if parts[0].startswith(f"markdown_{self.record.id}_") and len(parts) > 1:
+            return name
+        if len(parts) == 1 and re.match(rf'^[\w-]+_{self.record.id}_\d+\.jpg$', relative_path):
+            return name
+        return None
+
+    # URL
+    def url(self, name):
+        """记录文件的访问URL，经 record_file 视图鉴权后下发"""
+        prefix = f"{self.directory}/" if self.directory else ''
+        relative_path = name[len(prefix):] if name.startswith(prefix) else name
+        return reverse('record_file', args=[self.record.id, relative_path])
+
+    @property
+    def image_url(self):
+        return self.url(self.record.image.name) if self.record.image else ''
+
+    def markdown_url(self, result_index):
+        return self.url(self.markdown_name(result_index))
+
+    def markdown_base_url(self, result_index):
+        """Markdown目录的URL（以 / 结尾），用于解析文档内的相对图片路径"""
+        return self.url(self.markdown_dir(result_index)) + '/'
+
+    def markdown_image_url(self, result_index, img_path):
+        return self.url(self.markdown_image_name(result_index, img_path))
+
+    def output_image_url(self, img_filename):
+        return self.url(self.output_image_name(img_filename))
+
+    # 读写
+    def read_image(self):
+        """读取原始上传文件内容"""
+        with self.storage.open(self.record.image.name, 'rb') as f:
+            return f.read()
+
+    def write(self, name, content, kind='other'):
+        """写入文件（已存在则覆盖），返回存储路径；kind 用于统计写入字节数"""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        with tracing.span('media.write', kind=kind, bytes=len(content)):
+            saved = self.storage.save(name, ContentFile(content))
+        metrics.record_media_written(kind, len(content))
+        return saved
+
+    def save_markdown(self, result_index, text):
+        return self.write(self.markdown_name(result_index), text, kind='markdown')
+
+    def save_markdown_image(self, result_index, img_path, data):
+        return self.write(self.markdown_image_name(result_index, img_path), data, kind='markdown_image')
+
+    def save_output_image(self, img_filename, data):
+        return self.write(self.output_image_name(img_filename), data, kind='output_image')
+
+    def delete_all(self, results=None):
+        """删除记录的全部媒体文件"""
+        if self.directory.startswith(RECORDS_PREFIX + '/'):
+            delete_tree(self.storage, self.directory)
+            return
+
+        # 未迁移的旧记录没有独立目录，只删除能确定属于它的文件
+        if self.record.image and self.storage.exists(self.record.image.name):
+            self.storage.delete(self.record.image.name)
+        for result in results if results is not None else self.record.results.all():
+            delete_tree(self.storage, self.markdown_dir(result.result_index))
+            for img_filename in result.output_image_paths:
+                name = self.output_image_name(img_filename)
+                if self.storage.exists(name):
+                    self.storage.delete(name)
+
+
+def delete_tree(storage, path):
+    """递归删除存储中的目录"""
+    try:
+        dirs, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in files:
+        storage.delete(posixpath.join(path, name))
+    for name in dirs:
+        delete_tree(storage, posixpath.join(path, name))
+    # 对象存储没有真正的目录，本地磁盘需要删除空目录本身
+    if isinstance(storage, FileSystemStorage):
+        storage.delete(path)
+
+
+@deconstructible(path='parser_app.storage.LocalMediaStorage')
+class LocalMediaStorage(FileSystemStorage):
+    """本地磁盘存储，同名文件直接覆盖"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+
+@deconstructible(path='parser_app.storage.S3MediaStorage')
+class S3MediaStorage(Storage):
+    """S3兼容对象存储
+
+    endpoint_url 指向 MinIO 等本地服务即可在开发环境中替代真实S3。
+    """
+
+    def __init__(self, bucket_name=None, endpoint_url=None, access_key=None, secret_key=None,
+                 region_name=None, location='', custom_domain=None, querystring_auth=False,
+                 querystring_expire=3600):
+        if not bucket_name:
+            raise ImproperlyConfigured('S3MediaStorage 需要配置 bucket_name')
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region_name = region_name
+        self.location = location.strip('/')
+        self.custom_domain = custom_domain
+        self.querystring_auth = querystring_auth
+        self.querystring_expire = querystring_expire
+
+    @cached_property
+    def client(self):
+        try:
+            import boto3
+        except ImportError:
+            raise ImproperlyConfigured('使用S3存储需要安装 boto3')
+        return boto3.client(
+            's3',
+            endpoint_url=self.endpoint_url,
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+            region_name=self.region_name,
+        )
+
+    def _key(self, name):
+        name = name.replace('\\', '/').lstrip('/')
+        return posixpath.join(self.location, name) if self.location else name
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=self._key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError('S3MediaStorage 只支持读取模式打开文件')
+        obj = self.client.get_object(Bucket=self.bucket_name, Key=self._key(name))
+        return ContentFile(obj['Body'].read(), name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(
+            content, self.bucket_name, self._key(name),
+            ExtraArgs={'ContentType': content_type},
+        )
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        """路径由 RecordMedia 统一生成，同名直接覆盖"""
+        return name.replace('\\', '/')
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self._key(name))
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip('/')
+        prefix = f"{prefix}/" if prefix else ''
+        dirs, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            for item in page.get('CommonPrefixes', []):
+                dirs.append(item['Prefix'][len(prefix):].rstrip('/'))
+            for item in page.get('Contents', []):
+                files.append(item['Key'][len(prefix):])
+        return dirs, files
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['LastModified']
+
+    def url(self, name):
+        key = self._key(name)
+        if self.custom_domain:
+            return f"{self.custom_domain.rstrip('/')}/{key}"
+        if self.querystring_auth:
+            return self.client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket_name, 'Key': key},
+                ExpiresIn=self.querystring_expire,
+            )
+        endpoint = (self.endpoint_url or f"https://s3.{self.region_name or 'us-east-1'}.amazonaws.com").rstrip('/')
+        return f"{endpoint}/{self.bucket_name}/{key}"
@@ -1,7 +1,7 @@
 # parser_app/templatetags/custom_filters.py
 from django import template
 import os
-from django.conf import settings
+from django.core.files.storage import default_storage
 
 register = template.Library()
 
@@ -13,8 +13,7 @@ def addstring(value, arg):
 @register.filter
 def file_exists(filepath):
     """检查文件是否存在"""
-    full_path = os.path.join(settings.MEDIA_ROOT, filepath)
-    return os.path.exists(full_path)
+    return default_storage.exists(filepath)
 
 @register.filter
 def get_item(dictionary, key):
@@ -1,3 +1,1637 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+from io import StringIO
+import time
+import unittest
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from DjangoPaddleOCR.database import parse_database_url
+
+from . import fields, leases, parser_client, retention, search, similarity
+from . import metrics as app_metrics
+from .admission import ParserBusy, TokenBucket, parser_slot
+from .scheduler import claim_next, pick_group
+from .benchmarks import DEFAULT_THRESHOLD, FIXTURES, STAGES, find_regressions, load_baseline, run_benchmarks
+from .models import ImageUpload, ParseResult
+from .storage import RecordMedia, upload_name
+
+
+class IngestionBenchmarkTests(TestCase):
+    """上传解析流程的分阶段基准测试"""
+
+    def setUp(self):
+        # spool 阶段经过 StreamingUploadHandler，暂存文件写在 MEDIA_ROOT 下
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_all_stages_run(self):
+        results = run_benchmarks(['small'], repeat=1)
+        self.assertEqual(set(results['small']), set(STAGES))
+        self.assertEqual([name for _, _, files in os.walk(self.media_root.name) for name in files], [])
+
+    def test_baseline_covers_every_stage(self):
+        baseline = load_baseline()
+        for fixture in FIXTURES:
+            self.assertEqual(set(baseline.get(fixture, {})), set(STAGES), fixture)
+
+    def test_find_regressions(self):
+        baseline = {'small': {'spool': 0.010, 'serialize': 0.010}}
+        results = {'small': {'spool': 0.012, 'serialize': 0.020, 'json_decode': 1.0}}
+        self.assertEqual(find_regressions(results, baseline, 0.3), [('small', 'serialize', 0.020, 0.010)])
+
+    @unittest.skipUnless(os.environ.get('RUN_BENCHMARKS') == '1', '设置 RUN_BENCHMARKS=1 运行耗时比较')
+    def test_no_stage_regressed(self):
+        threshold = float(os.environ.get('BENCHMARK_THRESHOLD', DEFAULT_THRESHOLD))
+        regressions = find_regressions(run_benchmarks(), load_baseline(), threshold)
+        self.assertEqual(regressions, [])
+
+
+class QueryBudgetTests(TestCase):
+    """各页面的查询数上限，且不随记录数增长"""
+
+    BUDGETS = {
+        'conversion_history': 3,
+        'record_detail': 3,
+        'result_detail': 2,
+        'export_records': 1,
+        'statistics_data': 3,
+        'admin_imageupload_changelist': 7,
+        'admin_parseresult_changelist': 7,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def seed(self, count):
+        """生成 count 条分布在最近两个月、状态各异、每条1~3个结果的记录"""
+        statuses = ['completed', 'completed', 'completed', 'failed', 'pending', 'processing']
+        now = timezone.now()
+        records = ImageUpload.objects.bulk_create([
+            ImageUpload(
+                image=upload_name(f"seed{i}.png"),
+                original_filename=f"seed{i}.png",
+                file_size=(i * 37 % 12) * 1024 * 1024 + 512,
+                status=statuses[i % len(statuses)],
+                processing_time=1.5,
+            )
+            for i in range(count)
+        ])
+        results = []
+        for i, record in enumerate(records):
+            ImageUpload.objects.filter(pk=record.pk).update(upload_time=now - timedelta(days=i % 60, hours=i % 24))
+            for index in range(i % 3 + 1):
+                results.append(ParseResult(
+                    image=record,
+                    result_index=index,
+                    pruned_result=str({'parsing_res_list': [{'block_label': 'text', 'block_content': f"内容{i}"}]}),
+                    markdown_text=f"# 记录{i}\n\n内容{i}",
+                    raw_data={'markdown': {'text': f"内容{i}"}},
+                    markdown_image_paths=[f"imgs/img_{index}.jpg"],
+                    output_image_paths=[f"layout_det_res_{record.pk}_{index}.jpg", f"layout_order_res_{record.pk}_{index}.jpg"],
+                ))
+        ParseResult.objects.bulk_create(results)
+        return records
+
+    def requests(self, record):
+        return {
+            'conversion_history': reverse('conversion_history') + '?search=内容',
+            'record_detail': reverse('record_detail', args=[record.id]),
+            'result_detail': reverse('result_detail', args=[record.id, 0]),
+            'export_records': reverse('export_records'),
+            'statistics_data': reverse('statistics_data') + '?days=60',
+            'admin_imageupload_changelist': reverse('admin:parser_app_imageupload_changelist'),
+            'admin_parseresult_changelist': reverse('admin:parser_app_parseresult_changelist'),
+        }
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def measure(self, record):
+        return {name: self.count_queries(url) for name, url in self.requests(record).items()}
+
+    def test_query_counts_within_budget_and_independent_of_rows(self):
+        self.client.force_login(self.admin)
+        small = self.measure(self.seed(5)[0])
+        large = self.measure(self.seed(60)[0])
+        for name, budget in self.BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertLessEqual(large[name], budget)
+                self.assertEqual(small[name], large[name])
+
+
+class ProfilingTests(TestCase):
+    """按需剖析只对员工用户生效"""
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        overrides = override_settings(PROFILING_ENABLED=True, PROFILING_OUTPUT_DIR=self.output_dir.name,
+                                      RATELIMIT_ENABLED=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.user = User.objects.create_user('user')
+
+    def test_server_timing_only_for_staff(self):
+        self.client.force_login(self.user)
+        self.assertNotIn('Server-Timing', self.client.get(reverse('index'), HTTP_X_PROFILE='1'))
+
+        self.client.force_login(self.staff)
+        self.assertNotIn('Server-Timing', self.client.get(reverse('index')))
+        response = self.client.get(reverse('conversion_history') + '?_profile=1')
+        entries = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(entries, ['db', 'tpl', 'parser', 'total'])
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.output_dir.name), [])
+
+    def test_cprofile_dump_only_for_staff(self):
+        import pstats
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index') + '?_profile=cprofile')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.output_dir.name), [])
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('index'), HTTP_X_PROFILE='cprofile')
+        self.assertIn('Server-Timing', response)
+        self.assertEqual(os.listdir(self.output_dir.name), [response['X-Profile-File']])
+        self.assertTrue(response['X-Profile-File'].endswith('_GET_index.prof'))
+        stats = pstats.Stats(os.path.join(self.output_dir.name, response['X-Profile-File']))
+        self.assertGreater(stats.total_calls, 0)
+
+    def test_disabled_by_default(self):
+        from django.test import Client
+
+        with self.settings(PROFILING_ENABLED=False):
+            # 中间件在加载时检查开关，换一个新的 Client 重新加载
+            client = Client()
+            client.force_login(self.staff)
+            response = client.get(reverse('index'), HTTP_X_PROFILE='cprofile')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(os.listdir(self.output_dir.name), [])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        overrides = override_settings(RATELIMIT_ENABLED=False, METRICS_AUTH_TOKEN='')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def samples(self, metric):
+        from prometheus_client.parser import text_string_to_metric_families
+
+        for family in text_string_to_metric_families(app_metrics.collect().decode()):
+            if family.name == metric:
+                return family.samples
+        return []
+
+    def test_auth_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        with self.settings(METRICS_AUTH_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='s3cret').status_code, 403)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_requests_total', response.content)
+
+    def test_labels_do_not_depend_on_url(self):
+        # 路径中的 id、不存在的地址与查询参数都不会产生新的标签值
+        for n in range(5):
+            self.client.get(reverse('record_detail', args=[1000 + n]))
+            self.client.get(f'/no-such-page-{n}/')
+            self.client.get(reverse('conversion_history') + f'?page={n}')
+        views = {sample.labels['view'] for sample in self.samples('http_requests')}
+        self.assertIn('record_detail', views)
+        self.assertIn('conversion_history', views)
+        self.assertIn('unresolved', views)
+        for view in views:
+            self.assertRegex(view, r'^[a-z_0-9:]+$')
+        for sample in self.samples('http_requests'):
+            self.assertRegex(sample.labels['status'], r'^[1-5]\d\d$')
+            self.assertIn(sample.labels['method'], ('GET', 'POST', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'))
+        latency_views = {sample.labels['view'] for sample in self.samples('http_request_duration_seconds')}
+        self.assertLessEqual(latency_views, views)
+
+
+class TracingTests(TestCase):
+    def setUp(self):
+        self.trace_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.trace_dir.cleanup)
+        self.path = os.path.join(self.trace_dir.name, 'traces.jsonl')
+        overrides = override_settings(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=1.0, TRACING_EXPORT_PATH=self.path,
+                                      RATELIMIT_ENABLED=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_spans_nest_and_round_trip(self):
+        from . import tracing
+
+        with tracing.root_span('upload_image', path='/upload/') as root:
+            with tracing.span('save', bytes=3):
+                with tracing.span('media.write', kind='upload') as inner:
+                    headers = tracing.traceparent_headers()
+            with tracing.span('parse'):
+                tracing.set_attributes(record_id=7)
+        self.assertEqual(headers, {'traceparent': f"00-{root.trace_id}-{inner.span_id}-01"})
+
+        [trace] = tracing.read_traces(self.path)
+        self.assertEqual((trace['trace_id'], trace['name'], trace['status']), (root.trace_id, 'upload_image', 'ok'))
+        self.assertEqual(trace['attributes'], {'path': '/upload/'})
+        spans = {span['name']: span for span in trace['spans']}
+        self.assertEqual(set(spans), {'upload_image', 'save', 'media.write', 'parse'})
+        self.assertIsNone(spans['upload_image']['parent_id'])
+        self.assertEqual(spans['save']['parent_id'], root.span_id)
+        self.assertEqual(spans['media.write']['parent_id'], spans['save']['span_id'])
+        self.assertEqual(spans['parse']['parent_id'], root.span_id)
+        self.assertEqual(spans['parse']['attributes'], {'record_id': 7})
+        self.assertLessEqual(spans['media.write']['duration'], spans['save']['duration'])
+        self.assertLessEqual(spans['save']['duration'], trace['duration'])
+
+    def test_errors_and_continued_traces(self):
+        from . import tracing
+
+        with self.assertRaises(ValueError):
+            with tracing.root_span('background_parse') as root:
+                context = tracing.trace_context()
+                with tracing.span('call_parser'):
+                    raise ValueError('boom')
+        # 后台任务沿用请求的 trace_id，作为单独的一行导出
+        with tracing.root_span('background_parse', trace_context=context) as continued:
+            pass
+        first, second = tracing.read_traces(self.path)
+        self.assertEqual(first['status'], 'error')
+        failed = next(span for span in first['spans'] if span['name'] == 'call_parser')
+        self.assertEqual((failed['status'], failed['attributes']['error']), ('error', 'ValueError: boom'))
+        self.assertEqual(second['trace_id'], root.trace_id)
+        self.assertEqual(second['spans'][0]['parent_id'], root.span_id)
+        self.assertEqual(continued.parent_id, root.span_id)
+
+        # 没有进行中的链路、未被采样或关闭时不记录
+        with tracing.span('orphan') as orphan:
+            self.assertIsNone(orphan)
+        with self.settings(TRACING_SAMPLE_RATE=0.0):
+            with tracing.root_span('sampled_out') as skipped:
+                self.assertIsNone(skipped)
+        with self.settings(TRACING_ENABLED=False):
+            with tracing.root_span('disabled', trace_context=context) as skipped:
+                self.assertIsNone(skipped)
+        self.assertEqual(len(tracing.read_traces(self.path)), 2)
+
+    def test_read_traces_tail_and_rotation(self):
+        from . import tracing
+
+        for n in range(20):
+            with tracing.root_span(f'request_{n}'):
+                pass
+        size = os.path.getsize(self.path)
+        # 只读取末尾时跳过可能不完整的第一行
+        tail = tracing.read_traces(self.path, scan_bytes=size // 2)
+        self.assertTrue(0 < len(tail) < 20)
+        self.assertEqual(tail[-1]['name'], 'request_19')
+        self.assertEqual(tracing.read_traces(os.path.join(self.trace_dir.name, 'missing.jsonl')), [])
+
+        with self.settings(TRACING_MAX_BYTES=size):
+            with tracing.root_span('after_rotation'):
+                pass
+        self.assertEqual(len(tracing.read_traces(self.path + '.1')), 20)
+        self.assertEqual([t['name'] for t in tracing.read_traces(self.path)], ['after_rotation'])
+
+    def test_view_exports_status_code(self):
+        from . import tracing
+
+        response = self.client.post(reverse('upload_image'), {})
+        [trace] = tracing.read_traces(self.path)
+        self.assertEqual(trace['name'], 'upload_image')
+        self.assertEqual(trace['attributes']['status_code'], response.status_code)
+        self.assertEqual(trace['attributes']['path'], reverse('upload_image'))
+
+
+class DatabaseUrlTests(unittest.TestCase):
+    def test_sqlite_paths(self):
+        self.assertEqual(parse_database_url('sqlite:///db.sqlite3', '/srv/app')['NAME'], '/srv/app/db.sqlite3')
+        self.assertEqual(parse_database_url('sqlite:////app/db.sqlite3', '/srv/app')['NAME'], '/app/db.sqlite3')
+        config = parse_database_url('sqlite:////app/db.sqlite3', '/srv/app', busy_timeout=5)
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('PRAGMA journal_mode=WAL', config['OPTIONS']['init_command'])
+        self.assertIn('PRAGMA busy_timeout=5000', config['OPTIONS']['init_command'])
+
+    def test_postgres(self):
+        config = parse_database_url('postgres://ocr:p%40ss@db:5433/ocr?sslmode=require', '/srv/app', conn_max_age=120)
+        self.assertEqual(
+            (config['ENGINE'], config['NAME'], config['USER'], config['PASSWORD'], config['HOST'], config['PORT']),
+            ('django.db.backends.postgresql', 'ocr', 'ocr', 'p@ss', 'db', '5433'),
+        )
+        self.assertEqual(config['OPTIONS'], {'sslmode': 'require'})
+        self.assertEqual(config['CONN_MAX_AGE'], 120)
+
+        pooled = parse_database_url('postgresql://ocr@db/ocr', '/srv/app', pool=True)
+        self.assertTrue(pooled['OPTIONS']['pool'])
+        self.assertEqual(pooled['CONN_MAX_AGE'], 0)
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            parse_database_url('mysql://db/ocr', '/srv/app')
+
+    def test_requires_django_5_1(self):
+        from unittest import mock
+
+        from django.core.exceptions import ImproperlyConfigured
+
+        with mock.patch('django.VERSION', (4, 2, 0, 'final', 0)):
+            with self.assertRaises(ImproperlyConfigured):
+                parse_database_url('sqlite:///db.sqlite3', '/srv/app')
+            with self.assertRaises(ImproperlyConfigured):
+                parse_database_url('postgresql://ocr@db/ocr', '/srv/app', pool=True)
+            self.assertEqual(parse_database_url('postgresql://ocr@db/ocr', '/srv/app')['CONN_MAX_AGE'], 60)
+
+
+# 模拟一个 gunicorn worker：按上传流程的顺序写库（创建记录 -> 标记处理中 -> 写结果并完成），期间穿插列表查询
+SQLITE_WRITER = textwrap.dedent("""
+    import sys, time
+    import django
+    django.setup()
+    from django.db import connection, transaction
+    from parser_app.models import ImageUpload, ParseResult
+
+    worker, uploads, start_at = int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        assert cursor.fetchone()[0] == 'wal'
+    time.sleep(max(start_at - time.time(), 0))
+    for i in range(uploads):
+        record = ImageUpload.objects.create(
+            image=f"uploads/w{worker}_{i}.png", original_filename=f"w{worker}_{i}.png", file_size=1024)
+        ImageUpload.objects.filter(pk=record.pk).update(status='processing')
+        with transaction.atomic():
+            record = ImageUpload.objects.get(pk=record.pk)
+            for index in range(3):
+                ParseResult.objects.create(
+                    image=record, result_index=index, markdown_text='x' * 2000, raw_data={'worker': worker})
+            record.status = 'completed'
+            record.save(update_fields=['status'])
+        list(ImageUpload.objects.order_by('-upload_time')[:20])
+""")
+
+
+class SQLiteConcurrencyTests(unittest.TestCase):
+    """多个进程同时写同一个 SQLite 文件，不应出现 database is locked"""
+
+    WORKERS = 4
+    UPLOADS = 40
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='DjangoPaddleOCR.settings',
+            DATABASE_URL=f"sqlite:///{os.path.join(self.tmp.name, 'db.sqlite3')}",
+        )
+        subprocess.run(
+            [sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'],
+            cwd=settings.BASE_DIR, env=self.env, check=True, capture_output=True)
+
+    def test_concurrent_writers(self):
+        start_at = str(time.time() + 2)
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-c', SQLITE_WRITER, str(n), str(self.UPLOADS), start_at],
+                cwd=settings.BASE_DIR, env=self.env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            for n in range(self.WORKERS)
+        ]
+        for worker in workers:
+            _, stderr = worker.communicate(timeout=120)
+            self.assertEqual(worker.returncode, 0, stderr[-2000:])
+
+        counts = subprocess.run(
+            [sys.executable, '-c', 'import django; django.setup(); from parser_app.models import ImageUpload, ParseResult; '
+             'print(ImageUpload.objects.filter(status="completed").count(), ParseResult.objects.count())'],
+            cwd=settings.BASE_DIR, env=self.env, check=True, capture_output=True, text=True).stdout.split()
+        uploads = self.WORKERS * self.UPLOADS
+        self.assertEqual(counts, [str(uploads), str(uploads * 3)])
+
+
+@override_settings(
+    RATELIMIT_CACHE='default',
+    RATELIMIT_RULES={'upload_image': {'rate': '6/m', 'burst': 2}},
+    RATELIMIT_API_KEYS=['batch-client'],
+)
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.slot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.slot_dir.cleanup)
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def upload(self, **extra):
+        return self.client.post(reverse('upload_image'), {}, **extra)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket('6/m', burst=2)
+        self.assertEqual(bucket.take(cache, 'k', now=100), 0)
+        self.assertEqual(bucket.take(cache, 'k', now=100), 0)
+        self.assertAlmostEqual(bucket.take(cache, 'k', now=100), 10)
+        self.assertEqual(bucket.take(cache, 'k', now=110), 0)
+
+    def test_rate_limited_per_client(self):
+        for _ in range(2):
+            self.assertEqual(self.upload().status_code, 400)
+        response = self.upload()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        self.assertEqual(response.json()['reason'], 'rate_limited')
+
+        # 其他IP与登记的 API 密钥各自计数，未登记的密钥仍按IP计数
+        self.assertEqual(self.upload(REMOTE_ADDR='10.0.0.2').status_code, 400)
+        self.assertEqual(self.upload(HTTP_X_API_KEY='batch-client').status_code, 400)
+        self.assertEqual(self.upload(HTTP_X_API_KEY='made-up').status_code, 429)
+
+    def test_routes_without_rule_are_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get(reverse('index')).status_code, 200)
+
+    def test_parser_slots(self):
+        with self.settings(PARSER_MAX_IN_FLIGHT=2, PARSER_SLOT_DIR=self.slot_dir.name):
+            with parser_slot(), parser_slot():
+                with self.assertRaises(ParserBusy):
+                    with parser_slot():
+                        pass
+            with parser_slot():
+                pass
+
+    def test_upload_rejected_when_parser_busy(self):
+        image = SimpleUploadedFile('page.png', b'\x89PNG\r\n\x1a\n', content_type='image/png')
+        with self.settings(PARSER_MAX_IN_FLIGHT=1, PARSER_SLOT_DIR=self.slot_dir.name):
+            with parser_slot():
+                response = self.client.post(reverse('upload_image'), {'image': image})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(response.json()['reason'], 'parser_busy')
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_loadtest_reports_rate_limiting(self):
+        import json
+
+        import requests
+        from parser_app.management.commands.loadtest import RATE_LIMITED, failure
+
+        def response(status, body=b''):
+            r = requests.Response()
+            r.status_code, r._content = status, body
+            return r
+
+        limited = self.upload(REMOTE_ADDR='10.0.0.3')
+        while limited.status_code != 429:
+            limited = self.upload(REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(failure(response(429, limited.content)), RATE_LIMITED)
+        self.assertEqual(failure(response(429, json.dumps({'reason': 'parser_busy'}).encode())), 'HTTP 429 parser_busy')
+        self.assertEqual(failure(response(429, b'<html>')), 'HTTP 429')
+        self.assertEqual(failure(response(502)), 'HTTP 502')
+
+    def test_loadtest_follows_progress_like_the_page(self):
+        import json
+        from unittest import mock
+
+        import requests
+        from parser_app.management.commands.loadtest import LoadTest
+
+        def response(status, body=None, **headers):
+            r = requests.Response()
+            r.status_code, r._content = status, json.dumps(body or {}).encode()
+            r.headers.update(headers)
+            return r
+
+        class Session:
+            def __init__(self, responses):
+                self.responses, self.calls = list(responses), []
+
+            def get(self, url, params, timeout):
+                self.calls.append(dict(params))
+                return self.responses.pop(0)
+
+        test = LoadTest('http://testserver', b'', 'a.jpg', 'image/jpeg', mode='stream', timeout=30)
+        # 长轮询：每次带上已知状态，状态未变时由服务端等待
+        session = Session([
+            response(200, {'status': 'processing', 'results': []}),
+            response(429, {'reason': 'rate_limited'}, **{'Retry-After': '3'}),
+            response(200, {'status': 'processing', 'results': [{}, {}]}),
+            response(200, {'status': 'completed', 'results': [{}]}),
+        ])
+        with mock.patch('parser_app.management.commands.loadtest.time.sleep') as sleep:
+            self.assertEqual(test.wait_for_completion(session, {'progress_url': '/upload/1/progress/'}), 'ok')
+        self.assertEqual(session.calls, [
+            {'after': 0, 'status': ''},
+            {'after': 0, 'status': 'processing'},
+            {'after': 0, 'status': 'processing'},
+            {'after': 2, 'status': 'processing'},
+        ])
+        sleep.assert_called_once_with(3.0)
+        self.assertEqual(test.throttled_polls, 1)
+
+        # 服务端不支持长轮询时按 poll_interval 短轮询
+        session = Session([response(200, {'status': 'pending', 'results': []}),
+                           response(200, {'status': 'failed', 'results': []})])
+        with mock.patch('parser_app.management.commands.loadtest.time.sleep') as sleep:
+            result = test.wait_for_completion(session, {'progress_url': '/upload/1/progress/', 'poll_interval': 2})
+        self.assertEqual(result, 'failed')
+        self.assertEqual([call['wait'] for call in session.calls], [0, 0])
+        sleep.assert_called_once_with(2)
+
+
+@override_settings(SCHEDULER_AGING_SECONDS=120, RATELIMIT_API_KEYS=['batch-client'], RATELIMIT_ENABLED=False)
+class SchedulerTests(TestCase):
+    def group(self, priority, client, waited=0, pages=1, size=1024):
+        return {'priority': priority, 'client_key': client, 'oldest': self.now - timedelta(seconds=waited),
+                'min_pages': pages, 'min_size': size}
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_priority_classes_with_aging(self):
+        interactive = self.group(ImageUpload.PRIORITY_INTERACTIVE, 'ip:a')
+        batch = self.group(ImageUpload.PRIORITY_BATCH, 'ip:b', waited=100)
+        reprocess = self.group(ImageUpload.PRIORITY_REPROCESS, 'ip:c', waited=10)
+        self.assertIs(pick_group([batch, reprocess, interactive], {}, self.now), interactive)
+        self.assertIs(pick_group([batch, reprocess], {}, self.now), reprocess)
+        # 排队超过两个老化周期的批量任务与交互任务同级
+        old_batch = self.group(ImageUpload.PRIORITY_BATCH, 'ip:b', waited=300)
+        self.assertIs(pick_group([old_batch, interactive], {}, self.now), old_batch)
+
+    def test_fair_share_then_shortest_job(self):
+        busy = self.group(ImageUpload.PRIORITY_BATCH, 'key:bulk', waited=50, pages=1)
+        idle = self.group(ImageUpload.PRIORITY_BATCH, 'ip:b', waited=10, pages=20)
+        self.assertIs(pick_group([busy, idle], {'key:bulk': 3}, self.now), idle)
+        small = self.group(ImageUpload.PRIORITY_BATCH, 'ip:c', waited=5, pages=1)
+        self.assertIs(pick_group([idle, small], {}, self.now), small)
+
+    def queue(self, client, count, priority=ImageUpload.PRIORITY_BATCH, page_count=1):
+        return [ImageUpload.objects.create(
+            image=upload_name('p.png'), original_filename='p.png', file_size=1024, status='pending',
+            priority=priority, client_key=client, page_count=page_count,
+            queued_at=self.now - timedelta(seconds=30),
+        ) for _ in range(count)]
+
+    def test_claim_next(self):
+        bulk = self.queue('key:bulk', 20, page_count=5)
+        small = self.queue('key:bulk', 1, page_count=1)[0]
+        interactive = self.queue('ip:a', 1, priority=ImageUpload.PRIORITY_INTERACTIVE)[0]
+
+        first = claim_next()
+        self.assertEqual(first.id, interactive.id)
+        self.assertEqual(first.status, 'processing')
+        self.assertGreaterEqual(first.queue_wait, 30)
+        self.assertIsNotNone(first.started_at)
+
+        # 同一客户端内短作业优先
+        self.assertEqual(claim_next().id, small.id)
+        # 其他客户端的批量任务不必等 bulk 的20条全部完成
+        other = self.queue('ip:b', 1)[0]
+        self.assertEqual(claim_next().id, other.id)
+        self.assertIn(claim_next().id, {r.id for r in bulk})
+
+    def test_stream_upload_is_queued(self):
+        image = SimpleUploadedFile('page.png', b'\x89PNG\r\n\x1a\n', content_type='image/png')
+        response = self.client.post(reverse('upload_image'), {'image': image, 'mode': 'stream'},
+                                    HTTP_X_API_KEY='batch-client')
+        self.assertEqual(response.status_code, 202)
+        record = ImageUpload.objects.get(id=response.json()['id'])
+        self.assertEqual((record.status, record.priority), ('pending', ImageUpload.PRIORITY_BATCH))
+        self.assertIsNotNone(record.queued_at)
+        self.assertTrue(record.client_key.startswith('key:'))
+
+    def test_progress_urls_depend_on_worker_type(self):
+        image = SimpleUploadedFile('page.png', b'\x89PNG\r\n\x1a\n', content_type='image/png')
+        # 单线程的 sync worker：不提供 SSE，长轮询立即返回
+        with self.settings(PROGRESS_STREAMING=False):
+            job = self.client.post(reverse('upload_image'), {'image': image, 'mode': 'stream'}).json()
+            self.assertIsNone(job['events_url'])
+            self.assertEqual(job['poll_interval'], settings.PROGRESS_SHORT_POLL_INTERVAL)
+            start = time.monotonic()
+            progress = self.client.get(job['progress_url'], {'status': 'pending'}).json()
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(progress['status'], 'pending')
+
+        image.seek(0)
+        threaded = self.client.post(reverse('upload_image'), {'image': image, 'mode': 'stream'}).json()
+        self.assertEqual(threaded['events_url'], reverse('upload_events', args=[threaded['id']]))
+        self.assertNotIn('poll_interval', threaded)
+
+
+@override_settings(PARSE_LEASE_SECONDS=60, PARSE_MAX_ATTEMPTS=3)
+class LeaseTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def record(self, status='processing', attempts=1, expires_in=-1, owner='other-host:1'):
+        return ImageUpload.objects.create(
+            image=upload_name('p.png'), original_filename='p.png', file_size=1024, status=status,
+            attempts=attempts, lease_owner=owner, heartbeat_at=self.now - timedelta(seconds=90),
+            lease_expires_at=self.now + timedelta(seconds=expires_in),
+        )
+
+    def test_claim_takes_lease(self):
+        queued = self.record(status='pending', attempts=1, owner='')
+        claimed = claim_next()
+        self.assertEqual(claimed.id, queued.id)
+        self.assertEqual(claimed.attempts, 2)
+        self.assertEqual(claimed.lease_owner, leases.owner())
+        self.assertGreater(claimed.lease_expires_at, self.now)
+
+    def test_reap_requeues_or_fails(self):
+        stuck = self.record()
+        exhausted = self.record(attempts=3)
+        alive = self.record(expires_in=30)
+        self.assertEqual(leases.reap(), (1, 1))
+
+        stuck.refresh_from_db()
+        self.assertEqual((stuck.status, stuck.lease_owner, stuck.attempts), ('pending', '', 1))
+        self.assertIsNotNone(stuck.queued_at)
+        exhausted.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.error_message), ('failed', leases.LEASE_EXPIRED_MESSAGE))
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, 'processing')
+
+    def test_renew_only_own_leases(self):
+        mine = self.record(owner=leases.owner())
+        theirs = self.record()
+        self.assertEqual(leases.renew([mine.id, theirs.id]), 1)
+        mine.refresh_from_db()
+        self.assertGreater(mine.lease_expires_at, self.now)
+
+    def test_release_clears_lease(self):
+        record = self.record(status='completed', owner=leases.owner(), expires_in=30)
+        with leases.hold(record.id):
+            pass
+        record.refresh_from_db()
+        self.assertEqual((record.lease_owner, record.lease_expires_at), ('', None))
+
+    def test_reap_leases_command_dry_run(self):
+        stuck = self.record()
+        out = StringIO()
+        call_command('reap_leases', '--dry-run', stdout=out)
+        self.assertIn('放回队列', out.getvalue())
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'processing')
+
+    def test_admin_queue_view(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        stuck = self.record()
+        self.record(status='failed', attempts=3, owner='')
+        url = reverse('admin:parser_app_imageupload_queue')
+        response = self.client.get(url)
+        self.assertContains(response, '1 条租约已过期')
+        self.assertContains(response, '重试过的记录')
+
+        self.assertEqual(self.client.post(url).status_code, 302)
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'pending')
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name, MEDIA_ACCEL_REDIRECT_PREFIX='',
+                                      MEDIA_ACCESS='public', RETENTION_DAYS=30)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def archived_record(self, days_old=60):
+        record = ImageUpload.objects.create(
+            image=SimpleUploadedFile('doc.png', b'original', content_type='image/png'),
+            original_filename='doc.png', file_size=8, status='completed',
+        )
+        ImageUpload.objects.filter(id=record.id).update(upload_time=timezone.now() - timedelta(days=days_old))
+        media = RecordMedia(record)
+        media.save_markdown(0, '# 标题\n\n正文' * 50)
+        media.save_markdown_image(0, 'imgs/a.jpg', b'jpeg-bytes')
+        media.save_output_image(f'layout_det_res_{record.id}_0.jpg', b'det-bytes')
+        ParseResult.objects.create(
+            image=record, result_index=0, pruned_result='{}', markdown_text='# 标题',
+            raw_data={'markdown': {'text': '# 标题'}}, markdown_image_paths=['imgs/a.jpg'],
+            output_image_paths=[f'layout_det_res_{record.id}_0.jpg'],
+        )
+        return record
+
+    def test_archive_and_rehydrate_on_view(self):
+        record = self.archived_record()
+        fresh = self.archived_record(days_old=1)
+        out = StringIO()
+        call_command('archive_records', stdout=out)
+        self.assertIn('归档 1 条记录', out.getvalue())
+
+        record.refresh_from_db()
+        self.assertIsNotNone(record.archived_at)
+        self.assertIsNone(record.results.get().raw_data)
+        media = RecordMedia(record)
+        self.assertTrue(default_storage.exists(record.archive_name))
+        self.assertTrue(default_storage.exists(record.image.name))
+        self.assertFalse(default_storage.exists(media.markdown_name(0)))
+        self.assertEqual(retention.load_raw_data(record), {0: {'markdown': {'text': '# 标题'}}})
+        fresh.refresh_from_db()
+        self.assertIsNone(fresh.archived_at)
+
+        self.assertEqual(self.client.get(reverse('record_detail', args=[record.id])).status_code, 200)
+        self.assertTrue(os.path.isdir(os.path.join(self.media_root.name, retention.cache_directory(record))))
+        response = self.client.get(media.markdown_image_url(0, 'imgs/a.jpg'))
+        self.assertEqual(b''.join(response.streaming_content), b'jpeg-bytes')
+        response = self.client.get(media.image_url)
+        self.assertEqual(b''.join(response.streaming_content), b'original')
+        self.assertEqual(self.client.get(media.url(media._join('missing.jpg'))).status_code, 404)
+
+        self.client.post(reverse('delete_record', args=[record.id]))
+        self.assertFalse(default_storage.exists(record.archive_name))
+
+    def test_dry_run_changes_nothing(self):
+        record = self.archived_record()
+        out = StringIO()
+        call_command('archive_records', '--dry-run', stdout=out)
+        self.assertIn('将归档 1 条记录', out.getvalue())
+        record.refresh_from_db()
+        self.assertIsNone(record.archived_at)
+        self.assertTrue(default_storage.exists(RecordMedia(record).markdown_name(0)))
+
+    def test_cache_evicts_least_recently_used(self):
+        first, second = self.archived_record(), self.archived_record()
+        for record in (first, second):
+            retention.archive_record(record)
+        first_path = retention.rehydrate(first)
+        os.utime(os.path.join(first_path, retention.CACHE_MARKER), (0, 0))
+        second_path = retention.rehydrate(second)
+        size = sum(size for _, size, _ in retention.cached_entries())
+        self.assertEqual(retention.evict(max_bytes=size - 1), 1)
+        self.assertFalse(os.path.exists(first_path))
+        self.assertTrue(os.path.exists(second_path))
+
+
+class StorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def write(self, relative_path, data=b'data'):
+        path = os.path.join(self.media_root.name, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_record_directories_are_sharded(self):
+        import hashlib
+
+        digest = hashlib.sha1(b'abc123').hexdigest()
+        self.assertEqual(upload_name('Scan.PNG', token='abc123'), f"records/{digest[:2]}/{digest[2:4]}/abc123/abc123.png")
+        self.assertTrue(upload_name('README', token='abc123').endswith('/abc123/abc123.bin'))
+        self.assertNotEqual(os.path.dirname(upload_name('a.png')), os.path.dirname(upload_name('a.png')))
+
+        record = ImageUpload.objects.create(image=upload_name('a.png', token='abc123'), original_filename='a.png',
+                                            file_size=1)
+        media = RecordMedia(record)
+        directory = f"records/{digest[:2]}/{digest[2:4]}/abc123"
+        self.assertEqual(media.directory, directory)
+        self.assertEqual(media.markdown_name(0), f"{directory}/markdown_{record.id}_0/doc.md")
+        self.assertEqual(media.output_image_name('det.jpg'), f"{directory}/det.jpg")
+        self.assertEqual(media.markdown_image_url(0, 'imgs/a.jpg'),
+                         reverse('record_file', args=[record.id, f"markdown_{record.id}_0/imgs/a.jpg"]))
+
+    def test_resolve_rejects_paths_outside_the_record(self):
+        record = ImageUpload.objects.create(image=upload_name('a.png', token='abc123'), original_filename='a.png',
+                                            file_size=1)
+        media = RecordMedia(record)
+        self.assertEqual(media.resolve('abc123.png'), f"{media.directory}/abc123.png")
+        for path in ('..', '../other/x.png', 'imgs/../../x.png', './x.png', '/etc/passwd', 'a//b', 'a\\..\\b', ''):
+            self.assertIsNone(media.resolve(path), path)
+
+        # 未迁移的旧记录只允许能确定属于它的文件
+        legacy = ImageUpload.objects.create(image='old.png', original_filename='old.png', file_size=1)
+        media = RecordMedia(legacy)
+        self.assertEqual(media.resolve('old.png'), 'old.png')
+        self.assertEqual(media.resolve(f"markdown_{legacy.id}_0/doc.md"), f"markdown_{legacy.id}_0/doc.md")
+        self.assertEqual(media.resolve(f"layout_det_res_{legacy.id}_0.jpg"), f"layout_det_res_{legacy.id}_0.jpg")
+        self.assertIsNone(media.resolve('db.sqlite3'))
+        self.assertIsNone(media.resolve(f"markdown_{record.id}_0/doc.md"))
+
+    def test_migrate_media_moves_legacy_layouts(self):
+        # Windows 上的预期布局：<doc_dir>/<doc_dir>，结果文件在 <doc_dir>/ 下
+        nested = ImageUpload.objects.create(image='aaa111.png/aaa111.png', original_filename='scan.png', file_size=4)
+        self.write('aaa111.png/aaa111.png', b'img1')
+        self.write(f'aaa111.png/markdown_{nested.id}_0/doc.md', b'# one')
+        self.write(f'aaa111.png/markdown_{nested.id}_0/imgs/a.jpg', b'jpg1')
+        self.write(f'aaa111.png/layout_det_res_{nested.id}_0.jpg', b'det1')
+        ParseResult.objects.create(image=nested, result_index=0, markdown_image_paths=['imgs/a.jpg'],
+                                   output_image_paths=[f'layout_det_res_{nested.id}_0.jpg'])
+        # Linux 上名字里的反斜杠被去掉、结果文件平铺在 MEDIA_ROOT 下
+        flat = ImageUpload.objects.create(image='bbb222.jpgbbb222.jpg', original_filename='photo.jpg', file_size=4)
+        self.write('bbb222.jpgbbb222.jpg', b'img2')
+        self.write(f'markdown_{flat.id}_0/doc.md', b'# two')
+        ParseResult.objects.create(image=flat, result_index=0)
+        missing = ImageUpload.objects.create(image='ccc333.png', original_filename='gone.png', file_size=4)
+
+        out, err = StringIO(), StringIO()
+        call_command('migrate_media', stdout=out, stderr=err)
+        self.assertIn('成功 2 条, 找不到文件 1 条', out.getvalue())
+        self.assertIn(f"记录 {missing.id}", err.getvalue())
+
+        nested.refresh_from_db()
+        flat.refresh_from_db()
+        self.assertEqual(nested.image.name, upload_name('scan.png', token='aaa111'))
+        self.assertEqual(flat.image.name, upload_name('photo.jpg', token='bbb222'))
+        media = RecordMedia(nested)
+        self.assertEqual(media.read_image(), b'img1')
+        for name, data in ((media.markdown_name(0), b'# one'), (media.markdown_image_name(0, 'imgs/a.jpg'), b'jpg1'),
+                           (media.output_image_name(f'layout_det_res_{nested.id}_0.jpg'), b'det1')):
+            with default_storage.open(name, 'rb') as f:
+                self.assertEqual(f.read(), data)
+        with default_storage.open(RecordMedia(flat).markdown_name(0), 'rb') as f:
+            self.assertEqual(f.read(), b'# two')
+        # 旧文件已删除，只剩分片目录
+        self.assertEqual(sorted(os.listdir(self.media_root.name)), ['records'])
+        missing.refresh_from_db()
+        self.assertEqual(missing.image.name, 'ccc333.png')
+
+    def test_s3_storage(self):
+        try:
+            import boto3
+            from moto import mock_aws
+        except ImportError:
+            self.skipTest('需要安装 boto3 与 moto')
+        from .storage import S3MediaStorage, delete_tree
+
+        with mock_aws():
+            boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='media')
+            storage = S3MediaStorage(bucket_name='media', region_name='us-east-1', access_key='test',
+                                     secret_key='test', location='ocr')
+            record = ImageUpload.objects.create(image=upload_name('a.png', token='abc123'), original_filename='a.png',
+                                                file_size=1)
+            media = RecordMedia(record, storage)
+            media.write(record.image.name, b'original', kind='upload')
+            media.save_markdown(0, '# 标题')
+            media.save_markdown_image(0, 'imgs/a.jpg', b'jpg')
+
+            key = f"ocr/{record.image.name}"
+            head = storage.client.head_object(Bucket='media', Key=key)
+            self.assertEqual(head['ContentType'], 'image/png')
+            self.assertTrue(storage.exists(record.image.name))
+            self.assertFalse(storage.exists('records/nope.png'))
+            self.assertEqual(storage.size(record.image.name), 8)
+            self.assertEqual(media.read_image(), b'original')
+            self.assertEqual(storage.listdir(media.directory),
+                             ([f"markdown_{record.id}_0"], ['abc123.png']))
+            with self.assertRaises(ValueError):
+                storage.open(record.image.name, 'wb')
+            with self.assertRaises(FileNotFoundError):
+                storage.size('records/nope.png')
+
+            self.assertEqual(storage.url(record.image.name), f"https://s3.us-east-1.amazonaws.com/media/{key}")
+            storage.custom_domain = 'https://cdn.example.com/'
+            self.assertEqual(storage.url(record.image.name), f"https://cdn.example.com/{key}")
+            storage.custom_domain, storage.querystring_auth = None, True
+            self.assertIn('Signature', storage.url(record.image.name))
+
+            delete_tree(storage, media.directory)
+            self.assertEqual(storage.client.list_objects_v2(Bucket='media').get('KeyCount'), 0)
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name, MEDIA_ACCEL_REDIRECT_PREFIX='',
+                                      MEDIA_ACCESS='owner', RATELIMIT_ENABLED=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.record = ImageUpload.objects.create(
+            image=SimpleUploadedFile('doc.png', b'0123456789', content_type='image/png'),
+            original_filename='doc.png', file_size=10, status='completed', client_key='ip:10.0.0.1',
+        )
+        self.url = RecordMedia(self.record).image_url
+
+    def get(self, url=None, **extra):
+        extra.setdefault('REMOTE_ADDR', '10.0.0.1')
+        return self.client.get(url or self.url, **extra)
+
+    def test_parse_range(self):
+        from .media_serving import parse_range
+
+        self.assertEqual(parse_range('bytes=0-3', 10), (0, 3))
+        self.assertEqual(parse_range('bytes=4-', 10), (4, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=2-100', 10), (2, 9))
+        self.assertIs(parse_range('bytes=10-', 10), False)
+        self.assertIs(parse_range('bytes=5-2', 10), False)
+        self.assertIs(parse_range('bytes=-0', 10), False)
+        self.assertIsNone(parse_range('bytes=-', 10))
+        self.assertIsNone(parse_range('bytes=0-1,4-5', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+
+    def test_owner_access(self):
+        from .media_serving import signed_record_url
+
+        self.assertEqual(b''.join(self.get().streaming_content), b'0123456789')
+        # 其他客户端（即使已登录）不能访问，管理员与带签名的链接可以
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.2').status_code, 403)
+        self.client.force_login(User.objects.create_user('reader'))
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.2').status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.2').status_code, 200)
+        self.client.logout()
+
+        signed = signed_record_url(self.record, self.url)
+        self.assertEqual(self.get(signed, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        other = ImageUpload.objects.create(image='records/00/00/other/x.png', original_filename='x.png', file_size=1)
+        self.assertEqual(self.get(signed_record_url(other, self.url), REMOTE_ADDR='10.0.0.2').status_code, 403)
+        self.assertEqual(self.get(self.url + '?sig=forged', REMOTE_ADDR='10.0.0.2').status_code, 403)
+        with self.settings(MEDIA_LINK_MAX_AGE=0):
+            time.sleep(1)
+            self.assertEqual(self.get(signed, REMOTE_ADDR='10.0.0.2').status_code, 403)
+        with self.settings(MEDIA_ACCESS='public'):
+            self.assertEqual(self.get(REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_owner_pages(self):
+        result = ParseResult.objects.create(image=self.record, result_index=0, markdown_text='# 机密合同')
+        search.index_new_result(result)
+        pages = [
+            reverse('record_detail', args=[self.record.id]),
+            reverse('result_detail', args=[self.record.id, 0]),
+            reverse('upload_progress', args=[self.record.id]) + '?wait=0',
+            reverse('upload_events', args=[self.record.id]),
+        ]
+        history = reverse('conversion_history')
+        for url in pages:
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url).status_code, 200)
+                self.assertEqual(self.get(url, REMOTE_ADDR='10.0.0.2').status_code, 404)
+        # 条件请求同样不能确认记录存在
+        self.assertEqual(self.get(pages[0], REMOTE_ADDR='10.0.0.2', HTTP_IF_NONE_MATCH='*').status_code, 404)
+        self.assertContains(self.get(history, data={'search': '机密'}), 'doc.png')
+        self.assertNotContains(self.get(history, data={'search': '机密'}, REMOTE_ADDR='10.0.0.2'), 'doc.png')
+        self.assertNotContains(self.get(reverse('export_records'), REMOTE_ADDR='10.0.0.2'), 'doc.png')
+        response = self.client.post(reverse('delete_record', args=[self.record.id]), REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(ImageUpload.objects.filter(id=self.record.id).exists())
+        with self.settings(MEDIA_ACCESS='public'):
+            self.assertEqual(self.get(pages[0], REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_range_request(self):
+        response = self.get(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.get(HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1,4-5').status_code, 200)
+
+    def test_accel_redirect(self):
+        with self.settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/'):
+            response = self.get(self.url + '?download')
+            denied = self.get(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.record.image.name)
+        self.assertNotIn('Content-Type', response)
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=UTF-8''" +
+                         os.path.basename(self.record.image.name))
+        self.assertEqual(denied.status_code, 403)
+        self.assertNotIn('X-Accel-Redirect', denied)
+
+
+class CompressedTextTests(TestCase):
+    def test_round_trip_and_storage_format(self):
+        markdown = '# 标题\n\n' + '版面解析 layout parsing ' * 200
+        record = ImageUpload.objects.create(image=upload_name('c.png'), original_filename='c.png', file_size=1)
+        result = ParseResult.objects.create(image=record, result_index=0, markdown_text=markdown,
+                                            pruned_result={'parsing_res_list': []})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT markdown_text FROM parser_app_parseresult WHERE id = %s', [result.id])
+            stored = bytes(cursor.fetchone()[0])
+        self.assertTrue(stored.startswith(fields.MAGIC + bytes((fields.VERSION, fields.CODEC_ZLIB))))
+        self.assertLess(len(stored), len(markdown.encode('utf-8')) / 4)
+
+        result.refresh_from_db()
+        self.assertEqual(result.markdown_text, markdown)
+        self.assertEqual(result.pruned_result, "{'parsing_res_list': []}")
+        self.assertEqual(ParseResult.objects.values_list('markdown_text', flat=True).get(), markdown)
+
+    def test_reads_short_and_legacy_values(self):
+        self.assertEqual(fields.decompress_text(fields.compress_text('短文本')), '短文本')
+        self.assertEqual(fields.decompress_text('旧的文本'.encode('utf-8')), '旧的文本')
+        self.assertEqual(fields.decompress_text(memoryview(fields.compress_text('x' * 500))), 'x' * 500)
+
+    def test_search_uses_index(self):
+        record = ImageUpload.objects.create(image=upload_name('invoice.png'), original_filename='invoice.png',
+                                            file_size=1, status='completed')
+        result = ParseResult.objects.create(
+            image=record, result_index=0,
+            markdown_text='# 发票\n\n<table><tr><td>金额合计</td></tr></table>',
+            pruned_result={'parsing_res_list': [{'block_content': '购买方名称', 'block_bbox': [1, 2, 3, 4]}]},
+        )
+        search.index_new_result(result)
+        content = result.search_index.content
+        self.assertIn('金额合计', content)
+        self.assertIn('购买方名称', content)
+        self.assertNotIn('<td>', content)
+
+        for query, found in (('金额合计', True), ('购买方', True), ('block_bbox', False)):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('conversion_history'), {'search': query})
+                self.assertEqual('invoice.png' in response.content.decode(), found)
+
+
+def page_image(seed, size=(600, 800), fmt='PNG', quality=90):
+    """带几块明暗区域的"页面"图片"""
+    import io
+    import random
+
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    image = Image.new('L', (600, 800), 255)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rnd.randrange(0, 500), rnd.randrange(0, 700)
+        draw.rectangle([x, y, x + rnd.randrange(40, 200), y + rnd.randrange(20, 120)], fill=rnd.randrange(0, 200))
+    image = image.resize(size)
+    buf = io.BytesIO()
+    image.convert('RGB').save(buf, fmt, **({'quality': quality} if fmt == 'JPEG' else {}))
+    return buf.getvalue()
+
+
+class NearDuplicateTests(TestCase):
+    def setUp(self):
+        similarity._index = None
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name, NEAR_DUPLICATE_MODE='off',
+                                      NEAR_DUPLICATE_MAX_DISTANCE=6, RATELIMIT_ENABLED=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_hash_tolerates_rescans(self):
+        original = similarity.file_hash(SimpleUploadedFile('a.png', page_image(1)))
+        rescan = similarity.file_hash(SimpleUploadedFile('b.jpg', page_image(1, (450, 600), 'JPEG', 60)))
+        other = similarity.file_hash(SimpleUploadedFile('c.png', page_image(2)))
+        self.assertLessEqual(similarity.hamming(original, rescan), 6)
+        self.assertGreater(similarity.hamming(original, other), 6)
+        self.assertIsNone(similarity.file_hash(SimpleUploadedFile('d.png', b'not an image')))
+
+    def test_bk_tree_matches_brute_force(self):
+        import random
+        rnd = random.Random(7)
+        values = [similarity.to_signed(rnd.getrandbits(64)) for _ in range(500)]
+        values += [value ^ (1 << rnd.randrange(64)) for value in values[:100]]
+        tree = similarity.BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+        for query in values[:50]:
+            expected = sorted((similarity.hamming(query, v), i) for i, v in enumerate(values)
+                              if similarity.hamming(query, v) <= 8)
+            self.assertEqual(tree.search(query, 8), expected)
+
+    def test_snapshot_round_trip_and_incremental_refresh(self):
+        first = ImageUpload.objects.create(image=upload_name('a.png'), original_filename='a.png', file_size=1,
+                                           perceptual_hash=123)
+        index = similarity.build_index()
+        path = os.path.join(self.media_root.name, 'similarity', 'index.pickle')
+        index.save(path)
+        second = ImageUpload.objects.create(image=upload_name('b.png'), original_filename='b.png', file_size=1,
+                                            perceptual_hash=123 ^ 1)
+        loaded = similarity.SimilarityIndex.load(path)
+        self.assertEqual(loaded.max_id, first.id)
+        self.assertEqual(loaded.search(123, 1), [(0, first.id), (1, second.id)])
+
+    def source_record(self):
+        record = ImageUpload.objects.create(
+            image=SimpleUploadedFile('page.png', page_image(1), content_type='image/png'),
+            original_filename='page.png', file_size=1, status='completed',
+        )
+        record.perceptual_hash = similarity.file_hash(record.image.file)
+        record.save()
+        media = RecordMedia(record)
+        media.save_markdown(0, '# 第一页')
+        media.save_markdown_image(0, 'imgs/a.jpg', b'img')
+        media.save_output_image(f'layout_det_res_{record.id}_0.jpg', b'det')
+        ParseResult.objects.create(image=record, result_index=0, markdown_text='# 第一页', pruned_result='{}',
+                                   markdown_image_paths=['imgs/a.jpg'],
+                                   output_image_paths=[f'layout_det_res_{record.id}_0.jpg'])
+        return record
+
+    def upload(self, near_duplicate, **extra):
+        rescan = SimpleUploadedFile('rescan.jpg', page_image(1, (450, 600), 'JPEG', 60), content_type='image/jpeg')
+        return self.client.post(reverse('upload_image'), {'image': rescan, 'near_duplicate': near_duplicate, **extra})
+
+    def test_offer_returns_candidates_without_saving(self):
+        source = self.source_record()
+        response = self.upload('offer')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['near_duplicates'][0]['id'], source.id)
+        self.assertEqual(ImageUpload.objects.count(), 1)
+
+    def test_reuse_copies_results(self):
+        source = self.source_record()
+        response = self.upload('reuse', mode='stream')
+        self.assertEqual(response.json()['reused_from'], source.id)
+
+        record = ImageUpload.objects.get(id=response.json()['id'])
+        self.assertEqual((record.status, record.reused_from_id), ('completed', source.id))
+        self.assertIsNotNone(record.perceptual_hash)
+        result = record.results.get()
+        self.assertEqual(result.markdown_text, '# 第一页')
+        self.assertEqual(result.output_image_paths, [f'layout_det_res_{record.id}_0.jpg'])
+        media = RecordMedia(record)
+        self.assertTrue(default_storage.exists(media.output_image_name(f'layout_det_res_{record.id}_0.jpg')))
+        self.assertTrue(default_storage.exists(media.markdown_image_name(0, 'imgs/a.jpg')))
+        self.assertTrue(search.matching_image_ids('第一页').filter(image_id=record.id).exists())
+
+
+class ApiV1Tests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name, RATELIMIT_ENABLED=False,
+                                      PARSER_MAX_IN_FLIGHT=0, API_RESULTS_PAGE_SIZE=10)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def parse(self, query='', pages=3, **kwargs):
+        import json
+        from unittest import mock
+
+        from .mock_parser import MockParserConfig, make_response
+        from .parser_client import ParserResponse
+
+        config = MockParserConfig(pages=pages, images_per_page=1, image_size=16, seed=0)
+        content = json.dumps(make_response(config)).encode('utf-8')
+        with mock.patch('parser_app.parser_client.post', return_value=ParserResponse(200, content, 0.1)) as post:
+            response = self.client.post(reverse('api_v1_parse') + query, **kwargs)
+        return response, post
+
+    def body(self, response):
+        import json
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_owner_only_access(self):
+        with self.settings(MEDIA_ACCESS='owner'):
+            response, _ = self.parse('?filename=scan.png', data=page_image(1), content_type='image/png')
+            data = self.body(response)
+            job_url = reverse('api_v1_job', args=[data['job']['id']])
+            self.assertEqual(self.client.get(job_url).status_code, 200)
+            self.assertEqual(self.client.get(job_url, REMOTE_ADDR='10.0.0.9').status_code, 403)
+            # 返回的文件地址带签名，换了IP也能下载
+            url = data['results'][0]['images']['markdown_url']
+            self.assertIn('?sig=', url)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.9').status_code, 200)
+            self.assertEqual(self.client.get(url.split('?')[0], REMOTE_ADDR='10.0.0.9').status_code, 403)
+            self.assertGreater(self.client.get(reverse('api_v1_blocks')).json()['total'], 0)
+            self.assertEqual(self.client.get(reverse('api_v1_blocks'), REMOTE_ADDR='10.0.0.9').json()['total'], 0)
+
+    def test_sync_raw_upload_with_pagination(self):
+        response, post = self.parse('?filename=scan.png&page_size=2', data=page_image(1), content_type='image/png')
+        self.assertEqual(response.status_code, 200)
+        post.assert_called_once()
+        data = self.body(response)
+        self.assertEqual((data['job']['status'], data['job']['filename'], data['job']['result_count']),
+                         ('completed', 'scan.png', 3))
+        self.assertEqual([result['index'] for result in data['results']], [0, 1])
+        self.assertEqual(set(data['results'][0]), {'index', 'markdown', 'pruned_result', 'images'})
+        self.assertIsInstance(data['results'][0]['pruned_result'], dict)
+        self.assertTrue(data['results'][0]['images']['markdown_url'].startswith('http://testserver/files/'))
+
+        second = self.body(self.client.get(data['next']))
+        self.assertEqual([result['index'] for result in second['results']], [2])
+        self.assertIsNone(second['next'])
+
+        record = ImageUpload.objects.get(id=data['job']['id'])
+        selected = self.body(self.client.get(reverse('api_v1_job_results', args=[record.id]) + '?fields=raw'))
+        self.assertEqual(set(selected['results'][0]), {'index', 'raw'})
+        self.assertIn('markdown', selected['results'][0]['raw'])
+
+    def test_async_multipart_upload_is_queued(self):
+        image = SimpleUploadedFile('page.png', page_image(1), content_type='image/png')
+        response, post = self.parse('?mode=async', data={'image': image})
+        self.assertEqual(response.status_code, 202)
+        post.assert_not_called()
+        job = response.json()
+        self.assertEqual(job['status'], 'pending')
+        self.assertIn('progress', job['urls'])
+
+        self.assertEqual(self.client.get(job['urls']['job']).json()['status'], 'pending')
+        self.assertEqual(self.client.get(job['urls']['results']).status_code, 409)
+
+    def test_rejects_invalid_requests(self):
+        response, post = self.parse(data=b'plain text', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+        response, post = self.parse('?fields=markdown,base64', data=page_image(1), content_type='image/png')
+        self.assertEqual(response.status_code, 400)
+        post.assert_not_called()
+        self.assertEqual(ImageUpload.objects.count(), 0)
+        self.assertEqual(self.client.get(reverse('api_v1_job', args=[999])).status_code, 404)
+
+    def test_layout_blocks_are_indexed_and_queryable(self):
+        response, _ = self.parse('?fields=blocks', pages=2, data=page_image(1), content_type='image/png')
+        data = self.body(response)
+        record = ImageUpload.objects.get(id=data['job']['id'])
+        first = data['results'][0]['blocks']
+        self.assertEqual([block['position'] for block in first], list(range(len(first))))
+        self.assertIn('table', {block['label'] for block in first})
+        self.assertEqual(len(first[0]['bbox']), 4)
+
+        pages = self.client.get(reverse('api_v1_blocks') + '?label=table&group=page').json()
+        self.assertEqual([(item['job'], item['page']) for item in pages['items']], [(record.id, 0), (record.id, 1)])
+        history = self.client.get(reverse('conversion_history') + '?block=table')
+        self.assertEqual([r.id for r in history.context['records']], [record.id])
+        self.assertEqual(len(self.client.get(reverse('conversion_history') + '?block=seal').context['records']), 0)
+
+        count = record.layout_blocks.count()
+        record.layout_blocks.all().delete()
+        call_command('backfill_layout_blocks', '--missing', stdout=StringIO())
+        self.assertEqual(record.layout_blocks.count(), count)
+
+    def test_parser_fetches_file_by_signed_url(self):
+        import json
+        from unittest import mock
+
+        with self.settings(LAYOUT_PARSING_FILE_MODE='url', LAYOUT_PARSING_FILE_BASE_URL='http://parser-side'):
+            response, post = self.parse('?filename=scan.png', data=page_image(1), content_type='image/png')
+        self.assertEqual(response.status_code, 200)
+        url = json.loads(post.call_args.args[0])['file']
+        self.assertTrue(url.startswith('http://parser-side/files/parser/'))
+        path = url[len('http://parser-side'):]
+        fetched = self.client.get(path)
+        self.assertEqual(fetched.status_code, 200)
+        self.assertEqual(b''.join(fetched.streaming_content), page_image(1))
+
+        self.assertEqual(self.client.get(path.replace('/files/parser/', '/files/parser/x')).status_code, 403)
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 3600):
+            self.assertEqual(self.client.get(path).status_code, 403)
+
+
+class LayoutExtractionTests(unittest.TestCase):
+    def test_extracts_parsing_results_and_falls_back_to_boxes(self):
+        from . import layout
+
+        blocks = layout.extract(str({'parsing_res_list': [
+            {'block_label': 'table', 'block_bbox': [1, 2, 3, 4], 'block_content': '<table/>', 'block_order': 2},
+            {'block_label': 'seal', 'block_bbox': [[5, 1], [9, 1], [9, 7], [5, 7]], 'block_order': None},
+        ]}))
+        self.assertEqual(blocks, [
+            {'label': 'table', 'order': 2, 'bbox': [1.0, 2.0, 3.0, 4.0], 'text': '<table/>'},
+            {'label': 'seal', 'order': None, 'bbox': [5.0, 1.0, 9.0, 7.0], 'text': ''},
+        ])
+        boxes = layout.extract({'layout_det_res': {'boxes': [{'label': 'text', 'coordinate': [0, 0, 10, 10]}]}})
+        self.assertEqual(boxes, [{'label': 'text', 'order': None, 'bbox': [0.0, 0.0, 10.0, 10.0], 'text': ''}])
+        self.assertEqual(layout.extract('not a structure'), [])
+
+
+class SyntheticDataTests(TestCase):
+    def test_generates_indexed_records_and_deletes_them(self):
+        from .models import LayoutBlock, ResultSearchIndex
+
+        real = ImageUpload.objects.create(image=upload_name('real.png'), original_filename='real.png', file_size=1)
+        call_command('generate_synthetic_data', records=50, batch_size=20, days=30, seed=1, stdout=StringIO())
+        synthetic = ImageUpload.objects.filter(user_agent='synthetic-data')
+        self.assertEqual(synthetic.count(), 50)
+        self.assertEqual(set(synthetic.values_list('status', flat=True)), {'completed', 'failed'})
+        # 上传时间保留生成的值，而不是写入时刻
+        self.assertLess(synthetic.earliest('upload_time').upload_time, timezone.now() - timedelta(days=1))
+
+        results = ParseResult.objects.filter(image__in=synthetic)
+        self.assertEqual(results.count(), sum(synthetic.filter(status='completed').values_list('page_count', flat=True)))
+        self.assertEqual(ResultSearchIndex.objects.count(), results.count())
+        self.assertTrue(LayoutBlock.objects.exists())
+        result = results.first()
+        self.assertTrue(search.matching_image_ids(result.markdown_text[-20:].strip()).filter(image_id=result.image_id).exists())
+
+        call_command('generate_synthetic_data', delete=True, stdout=StringIO())
+        self.assertEqual(list(ImageUpload.objects.values_list('id', flat=True)), [real.id])
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        self.upload_dir = os.path.join(self.media_root.name, 'sessions')
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name, RATELIMIT_ENABLED=False,
+                                      CHUNKED_UPLOAD_DIR=self.upload_dir, CHUNKED_UPLOAD_CHUNK_SIZE=4096,
+                                      CHUNKED_UPLOAD_MAX_SIZE=1024 * 1024)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.data = page_image(3, (300, 400), 'BMP')
+
+    def create(self, **params):
+        import hashlib
+        params = {'filename': 'scan.bmp', 'size': len(self.data),
+                  'sha256': hashlib.sha256(self.data).hexdigest(), **params}
+        response = self.client.post(reverse('api_v1_uploads'), params, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put(self, session, offset, data):
+        return self.client.put(session['urls']['upload'], data, content_type='application/octet-stream',
+                               headers={'Upload-Offset': str(offset)})
+
+    def upload_all(self, session, start=0):
+        for offset in range(start, len(self.data), 4096):
+            self.assertEqual(self.put(session, offset, self.data[offset:offset + 4096]).status_code, 200)
+
+    def test_resume_after_restart_and_complete(self):
+        import hashlib
+
+        from . import uploads
+
+        session = self.create()
+        self.assertEqual(session['content_type'], 'image/bmp')
+        self.put(session, 0, self.data[:4096])
+        conflict = self.put(session, 0, self.data[:4096])
+        self.assertEqual((conflict.status_code, conflict.json()['offset']), (409, 4096))
+
+        # 换了 worker：哈希状态不在本进程，且上一块只写了一半
+        uploads._hashers.clear()
+        with open(os.path.join(self.upload_dir, session['id'].replace('-', '') + '.part'), 'ab') as f:
+            f.write(b'partial chunk')
+        self.assertEqual(self.client.get(session['urls']['upload'])['Upload-Offset'], '4096')
+        self.upload_all(session, start=4096)
+
+        response = self.client.post(session['urls']['complete'] + '?mode=async')
+        self.assertEqual(response.status_code, 202)
+        record = ImageUpload.objects.get(id=response.json()['id'])
+        self.assertEqual((record.status, record.original_filename, record.file_size), ('pending', 'scan.bmp', len(self.data)))
+        self.assertEqual(record.sha256, hashlib.sha256(self.data).hexdigest())
+        with default_storage.open(record.image.name, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+        # 重试完成请求不会重复创建记录
+        self.assertEqual(self.client.post(session['urls']['complete']).json()['id'], record.id)
+        self.assertEqual(ImageUpload.objects.count(), 1)
+
+    def test_checksum_mismatch_and_expiry(self):
+        from . import uploads
+        from .models import UploadSession
+
+        session = self.create(sha256='0' * 64)
+        self.upload_all(session)
+        self.assertEqual(self.client.post(session['urls']['complete'] + '?mode=async').status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(ImageUpload.objects.count(), 0)
+
+        self.create()
+        self.assertEqual(self.put(self.create(), 0, b'x' * 5000).status_code, 413)
+        self.assertEqual(uploads.expire_sessions(timezone.now() + timedelta(days=2)), 2)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_sessions_belong_to_their_client(self):
+        with self.settings(MEDIA_ACCESS='owner'):
+            session = self.create()
+            other = {'REMOTE_ADDR': '10.0.0.2'}
+            self.assertEqual(self.client.get(session['urls']['upload'], **other).status_code, 404)
+            response = self.client.put(session['urls']['upload'], self.data[:4096], **other,
+                                       content_type='application/octet-stream', headers={'Upload-Offset': '0'})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(self.client.post(session['urls']['complete'], **other).status_code, 404)
+            self.assertEqual(self.client.delete(session['urls']['upload'], **other).status_code, 404)
+            self.upload_all(session)
+            self.assertEqual(self.client.get(session['urls']['upload']).json()['offset'], len(self.data))
+
+    def test_large_inline_completion_is_queued(self):
+        from unittest import mock
+
+        session = self.create()
+        self.upload_all(session)
+        with mock.patch('parser_app.api.MAX_UPLOAD_SIZE', len(self.data) - 1):
+            response = self.client.post(session['urls']['complete'] + '?mode=sync')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ImageUpload.objects.get(id=response.json()['id']).status, 'pending')
+
+    def test_session_lock_without_fcntl(self):
+        from unittest import mock
+
+        from . import uploads
+        from .models import UploadSession
+
+        session = UploadSession.objects.get(id=self.create()['id'])
+        for lock in (uploads.fcntl, None):
+            with self.subTest(fcntl=lock), mock.patch.object(uploads, 'fcntl', lock):
+                with uploads.locked_part(session):
+                    with self.assertRaises(uploads.SessionBusy):
+                        with uploads.locked_part(UploadSession.objects.get(id=session.id)):
+                            pass
+                # 释放后可以再次写入
+                with uploads.locked_part(session):
+                    pass
+
+
+class StreamingUploadHandlerTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media_root.name, RATELIMIT_ENABLED=False,
+                                      PARSER_MAX_IN_FLIGHT=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def stored_files(self):
+        return [name for _, _, files in os.walk(self.media_root.name) for name in files]
+
+    def record_directories(self):
+        return [root for root, _, _ in os.walk(os.path.join(self.media_root.name, 'records'))]
+
+    def test_sniff(self):
+        from .upload_handlers import sniff
+
+        self.assertEqual(sniff(page_image(1)), 'image/png')
+        self.assertEqual(sniff(page_image(1, fmt='JPEG')), 'image/jpeg')
+        self.assertEqual(sniff(page_image(1, (30, 40), 'BMP')), 'image/bmp')
+        self.assertIsNone(sniff(b'%PDF-1.7'))
+
+    def test_mislabelled_upload_is_rejected_and_removed(self):
+        fake = SimpleUploadedFile('page.png', b'<html>not an image</html>', content_type='image/png')
+        response = self.client.post(reverse('upload_image'), {'image': fake, 'mode': 'stream'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+        # 暂存在 MEDIA_ROOT 的暂存目录中，被拒绝时不会留下空的分片目录
+        self.assertEqual(self.record_directories(), [])
+
+    def test_upload_is_hashed_and_moved_into_place(self):
+        import hashlib
+
+        data = page_image(1, fmt='JPEG')
+        # 声明的类型与文件名都不可信，以文件头为准
+        image = SimpleUploadedFile('page.png', data, content_type='application/octet-stream')
+        response = self.client.post(reverse('api_v1_parse') + '?mode=async', {'image': image})
+        self.assertEqual(response.status_code, 202)
+        record = ImageUpload.objects.get(id=response.json()['id'])
+        self.assertEqual(record.sha256, hashlib.sha256(data).hexdigest())
+        with default_storage.open(record.image.name, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(self.stored_files(), [os.path.basename(record.image.name)])
+
+        response = self.client.post(reverse('api_v1_parse') + '?mode=async&filename=raw.jpg', data=data,
+                                    content_type='image/jpeg')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ImageUpload.objects.get(id=response.json()['id']).sha256, record.sha256)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_hash_and_page_count_computed_while_receiving(self):
+        from unittest import mock
+
+        from .upload_handlers import StreamedUpload
+
+        data = page_image(1, fmt='GIF')
+        upload = StreamedUpload('scan.gif')
+        upload.write(data)
+        uploaded_file = upload.finish()
+        self.addCleanup(uploaded_file.close)
+        self.assertEqual(uploaded_file.content_type, 'image/gif')
+        self.assertEqual(uploaded_file.page_count, 1)
+        self.assertEqual(uploaded_file.perceptual_hash, similarity.file_hash(SimpleUploadedFile('a.gif', data)))
+
+        # 只在接收完成时解码一次，近似检测与保存直接使用结果
+        with mock.patch('parser_app.similarity.inspect', wraps=similarity.inspect) as inspect:
+            response = self.client.post(reverse('upload_image'),
+                                        {'image': SimpleUploadedFile('scan.gif', data), 'mode': 'stream'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(inspect.call_count, 1)
+        record = ImageUpload.objects.get()
+        self.assertEqual(record.perceptual_hash, uploaded_file.perceptual_hash)
+
+    def test_only_upload_views_stream(self):
+        from django.core.files.uploadedfile import InMemoryUploadedFile
+        from django.test import RequestFactory
+
+        request = RequestFactory().post('/admin/', {'image': SimpleUploadedFile('a.png', page_image(1))})
+        self.assertIsInstance(request.FILES['image'], InMemoryUploadedFile)
+        self.assertEqual(self.record_directories(), [])
+
+
+class ParserPoolTests(TestCase):
+    def backends(self, *weights):
+        from .parser_pool import Backend
+        return [Backend(f'http://parser-{n}/layout-parsing', weight=weight) for n, weight in enumerate(weights)]
+
+    def picked(self, pool, count=4):
+        names = set()
+        for _ in range(count):
+            backend = pool.pick()
+            pool.release(backend, None)
+            names.add(backend.name)
+        return names
+
+    def test_routing(self):
+        from .parser_pool import BackendPool
+
+        pool = BackendPool(self.backends(3, 1), routing='weighted')
+        picks = [pool.pick().name for _ in range(8)]
+        self.assertEqual((picks.count('parser-0'), picks.count('parser-1')), (6, 2))
+
+        pool = BackendPool(self.backends(1, 1, 2))
+        busy = [pool.pick() for _ in range(4)]
+        self.assertEqual(sorted(backend.outstanding for backend in pool.backends), [1, 1, 2])
+        for backend in busy:
+            pool.release(backend, True)
+        # 进行中请求数/权重最小的后端优先
+        pool.backends[0].outstanding = 5
+        self.assertNotEqual(pool.pick().name, 'parser-0')
+
+    def test_ejection_and_readmission(self):
+        from .parser_pool import BackendPool
+
+        pool = BackendPool(self.backends(1, 1), eject_failures=2, eject_seconds=60)
+        bad, good = pool.backends
+        for _ in range(2):
+            bad.outstanding += 1
+            pool.release(bad, False)
+        self.assertEqual(self.picked(pool), {'parser-1'})
+        self.assertIn('parser_backend_ejections_total{backend="parser-0",reason="failures"}',
+                      app_metrics.collect().decode())
+
+        # 健康检查成功不提前结束被动摘除，窗口到期后才恢复
+        pool.mark_probe(bad, True)
+        self.assertEqual(self.picked(pool), {'parser-1'})
+        bad.ejected_until = 0.0
+        self.assertEqual(self.picked(pool), {'parser-0', 'parser-1'})
+        # 探测失败的后端在下一次探测成功前不接收请求
+        pool.mark_probe(bad, False)
+        bad.ejected_until = 0.0
+        self.assertEqual(self.picked(pool), {'parser-1'})
+        pool.mark_probe(bad, True)
+        self.assertEqual(self.picked(pool), {'parser-0', 'parser-1'})
+        # 全部被摘除时退回使用全部后端
+        pool.mark_probe(bad, False)
+        pool.mark_probe(good, False)
+        self.assertEqual(self.picked(pool), {'parser-0', 'parser-1'})
+
+    def test_calls_are_routed_away_from_failing_backend(self):
+        import json
+
+        from .mock_parser import MockParserConfig, MockParserServer
+        from .parser_pool import HealthChecker, get_pool
+
+        server = MockParserServer(('127.0.0.1', 0), MockParserConfig(latency=0, pages=1))
+        server.start_in_thread()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        backends = [{'url': server.url, 'name': 'up'}, {'url': 'http://127.0.0.1:9/layout-parsing', 'name': 'down'}]
+        body = json.dumps({'file': 'eA==', 'fileType': 1}).encode('ascii')
+        with self.settings(LAYOUT_PARSING_BACKENDS=backends, LAYOUT_PARSING_HEALTH_INTERVAL=0,
+                           LAYOUT_PARSING_EJECT_FAILURES=1):
+            outcomes = []
+            for _ in range(4):
+                try:
+                    outcomes.append(parser_client.post(body).status_code)
+                except parser_client.ParserRequestError:
+                    outcomes.append('error')
+            self.assertEqual(outcomes.count('error'), 1)
+            self.assertEqual(outcomes.count(200), 3)
+            self.assertEqual([b['available'] for b in get_pool().status()], [True, False])
+
+            pool = get_pool()
+            HealthChecker(pool, 0).check_all()
+            self.assertEqual([b['available'] for b in pool.status()], [True, False])
+            self.assertIs(get_pool(), pool)
+        # 配置变化后重新创建
+        self.assertIsNot(get_pool(), pool)
+        text = app_metrics.collect().decode()
+        self.assertIn('parser_backend_request_duration_seconds_count{backend="up",outcome="200"}', text)
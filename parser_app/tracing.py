@@ -0,0 +1,251 @@
+# parser_app/tracing.py
+"""上传流程的链路追踪
+
+用嵌套的 span 记录一次上传各步骤的耗时（接收、保存、编码、调用解析服务、解码、
+逐个写图片、写数据库、渲染）。当前 span 放在 ContextVar 中，sync_to_async 会复制上下文，
+异步视图在线程里执行的步骤同样挂在发起它的 span 下。
+
+- 本地根 span（请求视图、后台任务）结束时，把它和所有子 span 作为一行 JSON 追加到 TRACING_EXPORT_PATH；
+- 后台解析沿用上传请求的 trace_id，与请求分成两行导出，按 trace_id 关联；
+- 日志记录通过 TraceIdFilter 带上 trace_id，调用解析服务时附带 W3C traceparent 请求头；
+- 管理后台的"最慢链路"页面读取导出文件（见 admin.py）。
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, trace, parent=None, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else trace.parent_span_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+        self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class Trace:
+    """一个本地根 span 及其全部子 span"""
+
+    def __init__(self, trace_id=None, parent_span_id=None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.parent_span_id = parent_span_id
+        self.spans = []
+
+
+def enabled():
+    return settings.TRACING_ENABLED
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_attributes(**attributes):
+    """给当前 span 添加属性"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span else ''
+
+
+@contextmanager
+def span(name, **attributes):
+    """子 span；当前没有进行中的链路时不做任何记录"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace, parent, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.status = 'error'
+        child.set(error=f"{type(e).__name__}: {e}"[:200])
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+@contextmanager
+def root_span(name, trace_context=None, **attributes):
+    """本地根 span，结束时导出整条链路；trace_context 为 (trace_id, parent_span_id) 时延续已有链路"""
+    if not enabled() or (trace_context is None and random.random() >= settings.TRACING_SAMPLE_RATE):
+        yield None
+        return
+    trace_id, parent_span_id = trace_context or (None, None)
+    trace = Trace(trace_id, parent_span_id)
+    root = Span(name, trace, attributes=attributes)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.status = 'error'
+        root.set(error=f"{type(e).__name__}: {e}"[:200])
+        raise
+    finally:
+        _current_span.reset(token)
+        root.end()
+        export(root)
+
+
+def traced_view(name):
+    """把视图包在本地根 span 中（同步与异步视图均可）"""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                with root_span(name, method=request.method, path=request.path) as root:
+                    response = await view(request, *args, **kwargs)
+                    if root is not None:
+                        root.set(status_code=response.status_code)
+                    return response
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                with root_span(name, method=request.method, path=request.path) as root:
+                    response = view(request, *args, **kwargs)
+                    if root is not None:
+                        root.set(status_code=response.status_code)
+                    return response
+        return wrapper
+    return decorator
+
+
+def trace_context():
+    """当前链路的 (trace_id, span_id)，用于把链路延续到后台任务"""
+    current = _current_span.get()
+    if current is None:
+        return None
+    return current.trace_id, current.span_id
+
+
+def traceparent_headers():
+    """W3C Trace Context 请求头"""
+    current = _current_span.get()
+    if current is None:
+        return {}
+    return {'traceparent': f"00-{current.trace_id}-{current.span_id}-01"}
+
+
+# 导出
+def export(root):
+    record = {
+        'trace_id': root.trace_id,
+        'name': root.name,
+        'start': root.start,
+        'duration': root.duration,
+        'status': root.status,
+        'attributes': root.attributes,
+        'spans': [s.to_dict() for s in sorted(root.trace.spans, key=lambda s: s.start)],
+    }
+    line = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+    path = settings.TRACING_EXPORT_PATH
+    try:
+        with _export_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            _rotate_if_needed(path)
+            # O_APPEND 单次写入，多个 worker 进程同时导出时行不会交错
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+    except OSError as e:
+        logger.warning(f"导出链路失败: {e}")
+
+
+def _rotate_if_needed(path):
+    try:
+        if os.path.getsize(path) < settings.TRACING_MAX_BYTES:
+            return
+    except OSError:
+        return
+    os.replace(path, path + '.1')
+
+
+def read_traces(path=None, scan_bytes=None):
+    """读取导出文件末尾的链路（最新的在后）"""
+    path = path or settings.TRACING_EXPORT_PATH
+    scan_bytes = scan_bytes or settings.TRACING_ADMIN_SCAN_BYTES
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(size - scan_bytes, 0))
+            data = f.read()
+    except OSError:
+        return []
+    lines = data.split(b'\n')
+    if size > scan_bytes:
+        lines = lines[1:]  # 第一行可能不完整
+    traces = []
+    for line in lines:
+        if line.strip():
+            try:
+                traces.append(json.loads(line))
+            except ValueError:
+                continue
+    return traces
+
+
+def slowest_traces(limit=50, name=None):
+    traces = read_traces()
+    if name:
+        traces = [t for t in traces if t['name'] == name]
+    return sorted(traces, key=lambda t: t['duration'] or 0, reverse=True)[:limit]
+
+
+class TraceIdFilter(logging.Filter):
+    """给日志记录加上 trace_id 字段"""
+
+    def filter(self, record):
+        record.trace_id = current_trace_id() or '-'
+        return True
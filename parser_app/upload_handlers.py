@@ -0,0 +1,160 @@
+# parser_app/upload_handlers.py
+"""边接收边落盘的上传处理
+
+Django 默认把不超过 FILE_UPLOAD_MAX_MEMORY_SIZE 的上传整个放在内存里，保存时再复制到存储。
+上传视图用 streaming_uploads 装饰后，StreamingUploadHandler 把每块数据直接写到磁盘，
+同时计算 SHA-256 并从文件头的魔数识别真实的图片类型；接收完成时趁文件还在页缓存中解码一次，
+得到感知哈希与帧数，之后的近似检测与调度不再重新打开文件：
+- 本地存储：写到 MEDIA_ROOT 下的暂存目录（与最终文件在同一文件系统），保存时只是改名，数据只写一次；
+  被拒绝的上传只删除暂存文件，不会在记录目录下留下空目录；
+- 其他存储（S3 等）：写到本地临时文件，保存时上传。
+内联（base64）方式调用解析服务时仍要读取一次已保存的文件来组装请求体，url 方式（见 media_serving.py）不需要。
+uploaded_file.content_type 是识别出的类型（无法识别时为 application/octet-stream），客户端声明的类型只保留在
+declared_content_type 中，文件类型检查不再相信客户端。/api/v1/parse/ 的原始请求体也经过同样的处理。
+其他视图（如管理后台）仍使用 Django 默认的上传处理。
+"""
+import hashlib
+import os
+import tempfile
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from . import similarity
+from .storage import upload_name
+
+UNKNOWN_CONTENT_TYPE = 'application/octet-stream'
+# 本地存储时上传先写到 MEDIA_ROOT 下的这个目录，保存时改名到记录目录
+STAGING_DIR = '.incoming'
+SNIFF_BYTES = 16
+MAGIC_TYPES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+
+def sniff(head):
+    """按文件头识别图片类型，无法识别时返回 None"""
+    for magic, content_type in MAGIC_TYPES:
+        if head.startswith(magic):
+            return content_type
+    return None
+
+
+class StreamedFile(UploadedFile):
+    """已写入磁盘的上传；storage_name 为预先生成的存储路径，本地存储保存时直接移动临时文件
+
+    perceptual_hash 与 page_count 在接收完成时算好（无法识别的图片为 None 与 1）。
+    """
+
+    def __init__(self, upload):
+        super().__init__(upload.file, name=upload.filename,
+                         content_type=sniff(upload.head) or UNKNOWN_CONTENT_TYPE, size=upload.size)
+        self.declared_content_type = upload.declared_content_type
+        self.sha256 = upload.hasher.hexdigest()
+        self.storage_name = upload.storage_name
+        self.path = upload.path
+        self.perceptual_hash, self.page_count = similarity.inspect(upload.file)
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        # 没有被保存（被拒绝或出错）的上传在请求结束时删除；已保存的文件已经被移走
+        try:
+            return self.file.close()
+        finally:
+            discard_temporary(self.path)
+
+
+def discard_temporary(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class StreamedUpload:
+    """一次上传的接收过程：写入、计算哈希、保存文件头用于识别类型"""
+
+    def __init__(self, filename, declared_content_type=''):
+        self.filename = filename
+        self.declared_content_type = declared_content_type
+        self.storage_name = upload_name(filename)
+        self.hasher = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+        if isinstance(default_storage, FileSystemStorage):
+            directory = default_storage.path(STAGING_DIR)
+            os.makedirs(directory, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(prefix='upload-', dir=directory)
+        else:
+            fd, self.path = tempfile.mkstemp(prefix='upload-', dir=settings.FILE_UPLOAD_TEMP_DIR)
+        self.file = os.fdopen(fd, 'w+b')
+
+    def write(self, data):
+        if len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+        self.file.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+    def finish(self):
+        self.file.flush()
+        self.file.seek(0)
+        return StreamedFile(self)
+
+    def abort(self):
+        self.file.close()
+        discard_temporary(self.path)
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """multipart 上传的文件字段直接写入 StreamedUpload"""
+
+    upload = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.upload = StreamedUpload(self.file_name, self.content_type or '')
+
+    def receive_data_chunk(self, raw_data, start):
+        self.upload.write(raw_data)
+
+    def file_complete(self, file_size):
+        upload, self.upload = self.upload, None
+        return upload.finish()
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            self.upload.abort()
+            self.upload = None
+
+
+def streaming_uploads(view):
+    """视图的 multipart 上传改用 StreamingUploadHandler
+
+    上传处理器必须在读取 request.POST 之前替换，而 CsrfViewMiddleware 在视图之前就会读取它，
+    所以外层标记为 csrf_exempt、替换处理器后再做 CSRF 检查（视图本身已豁免的除外）。
+    """
+    protected = view if getattr(view, 'csrf_exempt', False) else csrf_protect(view)
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request.upload_handlers = [StreamingUploadHandler(request)]
+            return await protected(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            request.upload_handlers = [StreamingUploadHandler(request)]
+            return protected(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
@@ -0,0 +1,279 @@
+# parser_app/uploads.py
+"""可续传的分块上传
+
+大文件一次 POST 失败就要从头再来。分块上传分三步（接口见 api.py）：
+1. 创建会话：声明文件名、类型、大小（可附带 SHA-256），得到会话 id；
+2. 逐块 PUT：请求头 Upload-Offset 为这一块的起始位置，必须等于服务端已确认的字节数，
+   请求体直接追加写入 CHUNKED_UPLOAD_DIR 下的 <会话id>.part，不经过内存或 Django 的上传处理；
+   中断后 GET 会话取得 offset，从该处继续；
+3. 完成：核对大小与校验和后，把文件交给与普通上传相同的流程保存、解析。
+
+数据库中的 offset 是唯一可信的进度：写入数据并 fsync 后才更新 offset，每次写入前先把文件截断到 offset，
+worker 中途被杀、客户端断开留下的半块数据会被丢弃。同一会话同时只允许一个请求写入
+（文件锁；没有 fcntl 的 Windows 开发环境退化为进程内的锁，只在单进程下成立）。
+SHA-256 随写入增量计算；哈希状态只在写入它的进程中，下一块落到别的 worker 或重启后，从磁盘重新计算已写入的部分。
+CHUNKED_UPLOAD_DIR 必须是所有 worker 共享的目录；过期的会话由 manage.py expire_upload_sessions 清理。
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
+
+from . import similarity
+from .models import UploadSession
+from .upload_handlers import SNIFF_BYTES, UNKNOWN_CONTENT_TYPE, sniff
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：退化为进程内的锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+HASH_READ_SIZE = 1024 * 1024
+MAX_HASHERS = 256
+
+
+class UploadError(Exception):
+    """分块上传请求无效"""
+    status = 400
+
+
+class SessionBusy(UploadError):
+    status = 409
+
+    def __init__(self):
+        super().__init__('该上传会话正在被另一个请求写入')
+
+
+class SessionClosed(UploadError):
+    status = 409
+
+    def __init__(self):
+        super().__init__('上传会话已完成')
+
+
+class OffsetMismatch(UploadError):
+    status = 409
+
+    def __init__(self, offset):
+        super().__init__(f'Upload-Offset 与已上传的字节数 {offset} 不一致')
+        self.offset = offset
+
+
+class ChunkTooLarge(UploadError):
+    status = 413
+
+
+class ChecksumMismatch(UploadError):
+    def __init__(self, digest):
+        super().__init__(f'SHA-256 校验失败，服务端计算结果为 {digest}')
+        self.digest = digest
+
+
+class AssembledFile(UploadedFile):
+    """拼好的文件；提供 temporary_file_path，本地存储保存时直接移动而不是复制
+
+    与 upload_handlers.StreamedFile 一样，content_type 按文件头识别，sha256 为写入时计算的哈希，
+    感知哈希与帧数在拼好时解码一次得到。
+    """
+
+    def __init__(self, path, session):
+        f = open(path, 'rb')
+        content_type = sniff(f.read(SNIFF_BYTES)) or UNKNOWN_CONTENT_TYPE
+        f.seek(0)
+        super().__init__(f, name=session.filename, content_type=content_type, size=session.size)
+        self.declared_content_type = session.content_type
+        self.sha256 = session.sha256
+        self.path = path
+        self.perceptual_hash, self.page_count = similarity.inspect(f)
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def part_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{session.id.hex}.part")
+
+
+def expiry():
+    return timezone.now() + timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRE_HOURS)
+
+
+def create_session(filename, content_type, size, checksum='', client_key=''):
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    session = UploadSession.objects.create(
+        filename=filename, content_type=content_type, size=size, checksum=checksum.lower(),
+        client_key=client_key, expires_at=expiry(),
+    )
+    open(part_path(session), 'wb').close()
+    return session
+
+
+# 增量哈希
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def _take_hasher(session, f):
+    """已写入部分的 SHA-256 状态：本进程写到当前 offset 的直接延续，否则从磁盘重新计算"""
+    with _hashers_lock:
+        entry = _hashers.pop(session.id, None)
+    if entry is not None and entry[0] == session.offset:
+        return entry[1]
+    hasher = hashlib.sha256()
+    f.seek(0)
+    remaining = session.offset
+    while remaining:
+        data = f.read(min(HASH_READ_SIZE, remaining))
+        if not data:
+            break
+        hasher.update(data)
+        remaining -= len(data)
+    return hasher
+
+
+def _keep_hasher(session_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[session_id] = (offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+# 没有 fcntl 时正在写入的会话
+_writing = set()
+_writing_lock = threading.Lock()
+
+
+@contextmanager
+def _exclusive(session, f):
+    """会话的写锁，已被其他请求持有时抛出 SessionBusy"""
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SessionBusy()
+        # 文件关闭时释放
+        yield
+        return
+    with _writing_lock:
+        if session.id in _writing:
+            raise SessionBusy()
+        _writing.add(session.id)
+    try:
+        yield
+    finally:
+        with _writing_lock:
+            _writing.discard(session.id)
+
+
+@contextmanager
+def locked_part(session):
+    """独占打开未完成的文件，持有期间重新读取会话状态"""
+    try:
+        f = open(part_path(session), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('上传会话的文件已不存在，请重新创建会话')
+    try:
+        with _exclusive(session, f):
+            session.refresh_from_db(fields=['offset', 'status'])
+            if session.status != 'open':
+                raise SessionClosed()
+            yield f
+    finally:
+        f.close()
+
+
+def append_chunk(session, offset, stream, length):
+    """把请求体（length 字节）写到 offset 处，返回新的 offset"""
+    if length > settings.CHUNKED_UPLOAD_CHUNK_SIZE:
+        raise ChunkTooLarge(f'每块不能超过 {settings.CHUNKED_UPLOAD_CHUNK_SIZE} 字节')
+    with locked_part(session) as f:
+        if offset != session.offset:
+            raise OffsetMismatch(session.offset)
+        if offset + length > session.size:
+            raise ChunkTooLarge(f'超出声明的文件大小 {session.size} 字节')
+        hasher = _take_hasher(session, f)
+        # 丢弃中断的请求写了一半的数据
+        f.truncate(offset)
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            f.write(data)
+            hasher.update(data)
+            remaining -= len(data)
+        f.flush()
+        os.fsync(f.fileno())
+        # 客户端提前断开时只确认实际收到的部分
+        new_offset = offset + length - remaining
+        UploadSession.objects.filter(id=session.id, offset=offset).update(
+            offset=new_offset, updated_at=timezone.now(), expires_at=expiry())
+        session.offset = new_offset
+        _keep_hasher(session.id, new_offset, hasher)
+        return new_offset
+
+
+def claim_file(session):
+    """核对大小与校验和并把会话标记为完成，返回拼好的文件；失败时由调用方 reopen"""
+    with locked_part(session) as f:
+        if session.offset != session.size:
+            raise OffsetMismatch(session.offset)
+        digest = _take_hasher(session, f).hexdigest()
+        if session.checksum and digest != session.checksum:
+            # 数据已损坏，只能重新上传
+            discard(session)
+            raise ChecksumMismatch(digest)
+        if not UploadSession.objects.filter(id=session.id, status='open').update(status='completed', sha256=digest):
+            raise SessionClosed()
+    session.status, session.sha256 = 'completed', digest
+    return AssembledFile(part_path(session), session)
+
+
+def reopen(session):
+    """交给解析流程前失败（如解析名额已满），会话恢复为可再次完成"""
+    UploadSession.objects.filter(id=session.id).update(status='open', expires_at=expiry())
+    session.status = 'open'
+
+
+def finish(session, record):
+    """文件已保存到媒体存储：关联记录并删除临时文件（本地存储已直接移走）"""
+    UploadSession.objects.filter(id=session.id).update(record=record, expires_at=expiry())
+    session.record = record
+    _remove_part(session)
+
+
+def _remove_part(session):
+    try:
+        os.unlink(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def discard(session):
+    _remove_part(session)
+    with _hashers_lock:
+        _hashers.pop(session.id, None)
+    UploadSession.objects.filter(id=session.id).delete()
+
+
+def expire_sessions(now=None):
+    """删除过期的会话与临时文件，返回删除的会话数"""
+    expired = UploadSession.objects.filter(expires_at__lt=now or timezone.now())
+    count = 0
+    for session in expired.iterator():
+        discard(session)
+        count += 1
+    if count:
+        logger.info(f"清理过期的分块上传会话 {count} 个")
+    return count
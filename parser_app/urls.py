@@ -1,10 +1,29 @@
 # parser_app/urls.py
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views, async_views
+
+# 以ASGI运行时可切换到异步版本的上传与解析接口
+if settings.ASYNC_INGESTION:
+    upload_view, api_parse_view = async_views.upload_image_async, async_views.api_parse_async
+    events_view, progress_view = async_views.upload_events_async, async_views.upload_progress_async
+else:
+    upload_view, api_parse_view = views.upload_image, views.api_parse
+    events_view, progress_view = views.upload_events, views.upload_progress
 
 urlpatterns = [
     path('', views.index, name='index'),
-    path('upload/', views.upload_image, name='upload_image'),
+    path('upload/', upload_view, name='upload_image'),
+    path('upload/<int:record_id>/events/', events_view, name='upload_events'),
+    path('upload/<int:record_id>/progress/', progress_view, name='upload_progress'),
+    path('api/parse/', api_parse_view, name='api_parse'),
+    path('api/v1/parse/', api.parse, name='api_v1_parse'),
+    path('api/v1/jobs/<int:job_id>/', api.job, name='api_v1_job'),
+    path('api/v1/jobs/<int:job_id>/results/', api.job_results, name='api_v1_job_results'),
+    path('api/v1/blocks/', api.blocks, name='api_v1_blocks'),
+    path('api/v1/uploads/', api.create_upload, name='api_v1_uploads'),
+    path('api/v1/uploads/<uuid:session_id>/', api.upload, name='api_v1_upload'),
+    path('api/v1/uploads/<uuid:session_id>/complete/', api.complete_upload, name='api_v1_upload_complete'),
     path('history/', views.conversion_history, name='conversion_history'),
     path('history/<int:record_id>/', views.record_detail, name='record_detail'),
     path('history/<int:record_id>/delete/', views.delete_record, name='delete_record'),
@@ -12,4 +31,7 @@ urlpatterns = [
     path('history/export/', views.export_records, name='export_records'),
     path('history/statistics/', views.statistics_data, name='statistics_data'),
     path('result/<int:image_id>/<int:result_index>/', views.result_detail, name='result_detail'),
+    path('files/<int:record_id>/<path:path>', views.record_file, name='record_file'),
+    path('files/parser/<str:token>/<str:filename>', views.parser_file, name='parser_file'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
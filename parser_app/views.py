@@ -1,25 +1,39 @@
-from django.conf import settings
-from django.core.files.storage import FileSystemStorage
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, Http404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
 from django.utils import timezone
 from django.views.decorators.http import require_POST
-from .models import ImageUpload, ParseResult
-import base64
-import requests
-import os
+from prometheus_client import CONTENT_TYPE_LATEST
+from .models import ImageUpload, LayoutBlock, ParseResult
+from .storage import RecordMedia
+from .media_serving import (
+    can_access_record, can_access_record_id, media_file_response, owner_client_key, parser_file_record_id,
+)
+from .ingest import (
+    validate_upload, check_near_duplicate, create_image_record, parse_record, render_upload_result,
+    fail_processing, UploadFailed,
+)
+from . import layout, leases, metrics as app_metrics, parser_client, retention, search
+from .admission import ParserBusy, parser_slot
+from .tracing import traced_view
+from .upload_handlers import streaming_uploads
+from .background import start_upload
+from .progress import sse_response, long_poll, record_not_found
+from .page_cache import (
+    record_stamp, record_version, page_cache_key, render_cached,
+    record_detail_condition, result_detail_condition,
+)
+import hmac
 import json
+import posixpath
 from datetime import datetime, timedelta
 import logging
-import time
-import uuid
 
 logger = logging.getLogger(__name__)
 
-API_URL = "http://60590ca1.r20.cpolar.top/layout-parsing"
-
 def conversion_history(request):
     """转换记录页面"""
     # 获取查询参数
@@ -27,21 +41,29 @@ def conversion_history(request):
     status_filter = request.GET.get('status', '')
     date_from = request.GET.get('date_from', '')
     date_to = request.GET.get('date_to', '')
+    block_filter = request.GET.get('block', '')
 
-    # 获取所有记录
-    records = ImageUpload.objects.all().order_by('-upload_time')
+    # MEDIA_ACCESS=owner 时只列出自己上传的记录（搜索与统计同样限定）
+    visible = visible_records(request)
 
-    # 应用过滤器
+    # 获取所有记录（结果数量用聚合一次查出，避免每行一次 COUNT）
+    records = visible.annotate(results_count=Count('results')).order_by('-upload_time')
+
+    # 应用过滤器（结果内容用子查询匹配，不与上面的聚合共用JOIN，也不需要 distinct）
     if search_query:
+        # 结果正文压缩存储，按内容搜索使用单独的搜索索引
         records = records.filter(
             Q(original_filename__icontains=search_query) |
-            Q(results__pruned_result__icontains=search_query) |
-            Q(results__markdown_text__icontains=search_query)
-        ).distinct()
+            Q(id__in=search.matching_image_ids(search_query))
+        )
 
     if status_filter:
         records = records.filter(status=status_filter)
 
+    # 含有某类版面区块（如表格）的记录，查询区块表的索引
+    if block_filter:
+        records = records.filter(id__in=layout.image_ids_with(block_filter))
+
     if date_from:
         try:
             date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
@@ -67,98 +89,100 @@ def conversion_history(request):
     except EmptyPage:
         records_page = paginator.page(paginator.num_pages)
 
-    # 统计信息
-    total_count = ImageUpload.objects.count()
-    completed_count = ImageUpload.objects.filter(status='completed').count()
-    failed_count = ImageUpload.objects.filter(status='failed').count()
-    pending_count = ImageUpload.objects.filter(status='pending').count()
-
-    # 今日统计
+    # 统计信息（含今日统计，一次聚合查询）
     today = timezone.now().date()
-    today_records = ImageUpload.objects.filter(upload_time__date=today)
-    today_count = today_records.count()
-    today_completed = today_records.filter(status='completed').count()
+    today_filter = Q(upload_time__date=today)
+    counts = visible.aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='completed')),
+        failed=Count('id', filter=Q(status='failed')),
+        pending=Count('id', filter=Q(status='pending')),
+        today=Count('id', filter=today_filter),
+        today_completed=Count('id', filter=today_filter & Q(status='completed')),
+    )
 
     context = {
         'records': records_page,
-        'total_count': total_count,
-        'completed_count': completed_count,
-        'failed_count': failed_count,
-        'pending_count': pending_count,
-        'today_count': today_count,
-        'today_completed': today_completed,
+        'total_count': counts['total'],
+        'completed_count': counts['completed'],
+        'failed_count': counts['failed'],
+        'pending_count': counts['pending'],
+        'today_count': counts['today'],
+        'today_completed': counts['today_completed'],
         'search_query': search_query,
         'status_filter': status_filter,
         'date_from': date_from,
         'date_to': date_to,
         'status_choices': ImageUpload.STATUS_CHOICES,
+        'block_filter': block_filter,
+        'block_choices': LayoutBlock.LABEL_CHOICES,
     }
 
     return render(request, 'conversion_history.html', context)
 
 
+def visible_records(request):
+    """当前请求可以看到的记录（MEDIA_ACCESS=owner 时限定为自己上传的）"""
+    records = ImageUpload.objects.all()
+    owner = owner_client_key(request)
+    if owner is not None:
+        records = records.filter(client_key=owner)
+    return records
+
+
+@record_detail_condition
 def record_detail(request, record_id):
     """转换记录详情"""
-    record = get_object_or_404(ImageUpload, id=record_id)
-    results = record.results.all()
-
-    # 为每个结果准备图片URL信息
-    for result in results:
-        # Markdown图片信息
-        result.markdown_images_info = []
-        for img_path in result.markdown_image_paths:
-            relative_path = f"markdown_{record.id}_{result.result_index}/{img_path}"
-            result.markdown_images_info.append({
-                'path': img_path,
-                'filename': os.path.basename(img_path) if img_path else 'unknown',
-                'url': f"{settings.MEDIA_URL}{record.image.name.split('/')[-1]}/{relative_path}",
-                'full_path': os.path.join(settings.MEDIA_ROOT, relative_path)
-            })
+    updated_at = record_stamp(request, record_id)
+    if updated_at is None:
+        raise Http404('记录不存在')
 
-        # 输出图片信息
-        result.output_images_info = []
-        for img_path in result.output_image_paths:
-            result.output_images_info.append({
-                'path': img_path,
-                'filename': os.path.basename(img_path) if img_path else 'unknown',
-                'url': f"{settings.MEDIA_URL}{record.image.name.split('/')[-1]}/{img_path}",
-                'full_path': os.path.join(settings.MEDIA_ROOT, img_path)
-            })
+    def build_context():
+        record = get_object_or_404(ImageUpload, id=record_id)
+        results = list(record.results.all())
+        media = RecordMedia(record)
+        if record.archived_at:
+            # 已归档的记录先解压到还原缓存，页面上的图片请求直接命中
+            prepare_archived(record)
+
+        # 为每个结果准备图片URL信息
+        for result in results:
+            result.markdown_url = media.markdown_url(result.result_index)
+            result.markdown_base_url = media.markdown_base_url(result.result_index)
+            result.markdown_images_info = result.get_markdown_images_info()
+            result.output_images_info = result.get_output_images_info()
+
+        return {
+            'record': record,
+            'results': results,
+            # 与 record.results.first 相同（按 -created_at 排序的第一条），不再单独查询
+            'first_result': results[0] if results else None,
+            'image_url': media.image_url,
+        }
 
-    context = {
-        'record': record,
-        'results': results,
-        'doc_dir': record.image.name.split('/')[-1],
-        'MEDIA_URL': f"{settings.MEDIA_URL}"
-    }
+    cache_key = page_cache_key('record_detail', record_version(record_id, updated_at))
+    return render_cached(request, cache_key, 'record_detail.html', build_context)
 
-    return render(request, 'record_detail.html', context)
+
+def prepare_archived(record):
+    """解压已归档记录；失败时页面照常显示，图片请求再重试"""
+    try:
+        retention.rehydrate(record)
+    except Exception as e:
+        logger.error(f"还原归档记录 {record.id} 失败: {str(e)}", exc_info=True)
 
 
 def delete_record(request, record_id):
     """删除转换记录"""
     if request.method == 'POST':
         record = get_object_or_404(ImageUpload, id=record_id)
+        if not can_access_record(request, record):
+            raise Http404('记录不存在')
 
         try:
             # 删除相关文件
-            if record.image:
-                if os.path.exists(record.image.path):
-                    os.remove(record.image.path)
-
-            # 删除解析结果相关的文件
-            for result in record.results.all():
-                # 删除markdown目录
-                md_dir = os.path.join(settings.MEDIA_ROOT, f"markdown_{record.id}_{result.result_index}")
-                if os.path.exists(md_dir):
-                    import shutil
-                    shutil.rmtree(md_dir)
-
-                # 删除输出图片
-                for img_name in ['output1', 'output2', 'output3']:  # 根据实际情况调整
-                    img_path = os.path.join(settings.MEDIA_ROOT, f"{img_name}_{record.id}_{result.result_index}.jpg")
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
+            RecordMedia(record).delete_all()
+            retention.delete_archive(record)
 
             # 删除数据库记录
             record.delete()
@@ -184,11 +208,11 @@ def bulk_delete_records(request):
 
             for record_id in record_ids:
                 try:
-                    record = ImageUpload.objects.get(id=record_id)
+                    record = visible_records(request).get(id=record_id)
 
                     # 删除文件
-                    if record.image and os.path.exists(record.image.path):
-                        os.remove(record.image.path)
+                    RecordMedia(record).delete_all()
+                    retention.delete_archive(record)
 
                     record.delete()
                     deleted_count += 1
@@ -212,10 +236,10 @@ def export_records(request):
     """导出记录"""
     record_ids = request.GET.get('ids', '').split(',')
 
+    records = visible_records(request)
     if record_ids and record_ids[0]:
-        records = ImageUpload.objects.filter(id__in=record_ids)
-    else:
-        records = ImageUpload.objects.all()
+        records = records.filter(id__in=record_ids)
+    records = records.annotate(results_count=Count('results'))
 
     # 创建CSV数据
     import csv
@@ -238,7 +262,7 @@ def export_records(request):
             record.upload_time.strftime('%Y-%m-%d %H:%M:%S'),
             record.get_status_display(),
             f"{record.processing_time or 0:.2f}秒",
-            record.results.count()
+            record.results_count
         ])
 
     # 创建HTTP响应
@@ -257,23 +281,37 @@ def statistics_data(request):
     end_date = timezone.now().date()
     start_date = end_date - timedelta(days=days)
 
-    # 每日统计
+    # 每日统计（按日期分组一次查出，没有记录的日期补0）
+    per_day = {
+        row['date']: row
+        for row in ImageUpload.objects.filter(
+            upload_time__date__gte=start_date,
+            upload_time__date__lt=start_date + timedelta(days=days),
+        ).annotate(date=TruncDate('upload_time')).values('date').annotate(
+            total=Count('id'),
+            completed=Count('id', filter=Q(status='completed')),
+            failed=Count('id', filter=Q(status='failed')),
+        )
+    }
     daily_stats = []
     for i in range(days):
         date = start_date + timedelta(days=i)
-        day_records = ImageUpload.objects.filter(upload_time__date=date)
+        row = per_day.get(date, {})
 
         daily_stats.append({
             'date': date.strftime('%Y-%m-%d'),
-            'total': day_records.count(),
-            'completed': day_records.filter(status='completed').count(),
-            'failed': day_records.filter(status='failed').count(),
+            'total': row.get('total', 0),
+            'completed': row.get('completed', 0),
+            'failed': row.get('failed', 0),
         })
 
     # 状态分布
+    status_counts = dict(
+        ImageUpload.objects.order_by().values_list('status').annotate(count=Count('id'))
+    )
     status_distribution = []
     for status_code, status_name in ImageUpload.STATUS_CHOICES:
-        count = ImageUpload.objects.filter(status=status_code).count()
+        count = status_counts.get(status_code, 0)
         if count > 0:
             status_distribution.append({
                 'name': status_name,
@@ -289,16 +327,19 @@ def statistics_data(request):
         ('>10MB', 10 * 1024 * 1024, None)
     ]
 
-    size_distribution = []
+    size_filters = {}
     for name, min_size, max_size in size_ranges:
         if max_size:
-            count = ImageUpload.objects.filter(file_size__gte=min_size, file_size__lt=max_size).count()
+            size_filters[name] = Count('id', filter=Q(file_size__gte=min_size, file_size__lt=max_size))
         else:
-            count = ImageUpload.objects.filter(file_size__gte=min_size).count()
+            size_filters[name] = Count('id', filter=Q(file_size__gte=min_size))
+    size_counts = ImageUpload.objects.aggregate(**size_filters)
 
+    size_distribution = []
+    for name, _, _ in size_ranges:
         size_distribution.append({
             'name': name,
-            'value': count
+            'value': size_counts[name]
         })
 
     return JsonResponse({
@@ -311,231 +352,64 @@ def index(request):
     return render(request, 'index.html')
 
 
+@streaming_uploads
 @require_POST
+@traced_view('upload_image')
 def upload_image(request):
     """处理图片上传和解析"""
     try:
-        # 检查是否有文件上传
-        if 'image' not in request.FILES:
-            logger.error("No file in request.FILES")
-            return JsonResponse({'error': '没有上传文件'}, status=400)
-
-        uploaded_file = request.FILES['image']
-        logger.info(f"Received file: {uploaded_file.name}, size: {uploaded_file.size}")
-
-        # 验证文件类型
-        allowed_types = ['image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/bmp']
-        if uploaded_file.content_type not in allowed_types:
-            logger.error(f"Invalid file type: {uploaded_file.content_type}")
-            return JsonResponse({'error': '不支持的文件类型，请上传图片文件'}, status=400)
-
-        # 验证文件大小（10MB）
-        max_size = 10 * 1024 * 1024  # 10MB
-        if uploaded_file.size > max_size:
-            logger.error(f"File too large: {uploaded_file.size} bytes")
-            return JsonResponse({'error': '文件大小不能超过10MB'}, status=400)
-
-        # 保存文件
-        fs = FileSystemStorage()
-
-        # 生成唯一文件名
-        ext = uploaded_file.name.split('.')[-1]
-        filename = f"{uuid.uuid4().hex[:10]}.{ext}"
-
-        # 保存文件并获取保存后的路径
-        saved_filename = fs.save(f"{filename}\\{filename}", uploaded_file)
-        file_path = os.path.join(f"{settings.MEDIA_ROOT}", saved_filename)
-
-        # 获取客户端信息
-        ip_address = request.META.get('REMOTE_ADDR', '')
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-
-        # 创建ImageUpload记录
-        image_record = ImageUpload.objects.create(
-            image=saved_filename,
-            original_filename=uploaded_file.name,
-            file_size=uploaded_file.size,  # 确保提供file_size
-            status='processing',
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
+        uploaded_file, error_response = validate_upload(request)
+        if error_response:
+            return error_response
 
-        try:
-            # 读取并编码图片
-            with open(file_path, "rb") as file:
-                image_bytes = file.read()
-                image_data = base64.b64encode(image_bytes).decode("ascii")
-
-            logger.info(f"Image encoded, size: {len(image_data)} characters")
-
-            # 准备API请求数据
-            payload = {
-                "file": image_data,
-                "fileType": 1,
-            }
-
-            # 调用API，增加超时时间
-            logger.info(f"Calling API: {API_URL}")
-            start_time = time.time()
-
-            try:
-                response = requests.post(
-                    API_URL,
-                    json=payload,
-                    timeout=120,  # 120秒超时
-                    headers={
-                        'Content-Type': 'application/json',
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                    }
-                )
-
-                elapsed_time = time.time() - start_time
-                logger.info(f"API response received in {elapsed_time:.2f}s, status: {response.status_code}")
-
-                # 更新处理时间
-                image_record.processing_time = elapsed_time
-
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"API returned result with keys: {list(result.keys())}")
-
-                    if "result" in result:
-                        results_data = result["result"]
-
-                        save_results = []
-
-                        # 处理每个解析结果
-                        layout_results = results_data.get("layoutParsingResults", [])
-                        for i, res in enumerate(layout_results):
-                            markdown_image_paths=[]
-                            images_data = res.get("markdown", {}).get("images", {})
-
-                            # 保存markdown和图片
-                            md_dir = os.path.join(f"{settings.MEDIA_ROOT}\\{filename}", f"markdown_{image_record.id}_{i}")
-                            os.makedirs(md_dir, exist_ok=True)
-
-                            # 保存markdown文本
-                            md_path = os.path.join(md_dir, "doc.md")
-                            with open(md_path, "w", encoding="utf-8") as f:
-                                f.write(res.get("markdown", {}).get("text", ""))
-
-                                # 保存Markdown图片并记录路径
-                                for img_path, img_data in images_data.items():
-                                    try:
-                                        img_full_path = os.path.join(md_dir, img_path)
-                                        os.makedirs(os.path.dirname(img_full_path), exist_ok=True)
-
-                                        # 保存图片文件
-                                        with open(img_full_path, "wb") as f:
-                                            f.write(base64.b64decode(img_data))
-
-                                        # 记录相对路径（相对于markdown目录）
-                                        markdown_image_paths.append(img_path)
-
-                                    except Exception as e:
-                                        logger.error(f"保存Markdown图片失败: {str(e)}")
-                                        continue
-
-                                # 收集输出图片路径
-                                output_image_paths = []
-                                output_images_data = res.get("outputImages", {})
-
-                                for img_name, img_data in output_images_data.items():
-                                    try:
-                                        # 生成输出图片文件名
-                                        img_filename = f"{img_name}_{image_record.id}_{i}.jpg"
-                                        output_path = os.path.join(f"{settings.MEDIA_ROOT}\\{filename}", img_filename)
-
-                                        # 保存输出图片
-                                        with open(output_path, "wb") as f:
-                                            f.write(base64.b64decode(img_data))
-
-                                        # 记录文件名
-                                        output_image_paths.append(img_filename)
-
-                                    except Exception as e:
-                                        logger.error(f"保存输出图片失败: {str(e)}")
-                                        continue
-
-                            save_results.append({
-                                'index': i,
-                                'pruned_result': res.get("prunedResult", ""),
-                                'markdown': res.get("markdown", {}).get("text", ""),
-                                'markdown_dir': f"markdown_{image_record.id}_{i}",
-                                'image_id': image_record.id
-                            })
-
-                            parse_result = ParseResult.objects.create(
-                                image=image_record,
-                                result_index=i,
-                                pruned_result=res.get("prunedResult", ""),
-                                markdown_text=res.get("markdown", {}).get("text", ""),
-                                raw_data=res,
-                                markdown_image_paths=markdown_image_paths,
-                                output_image_paths=output_image_paths
-                            )
-
-                        # 更新状态为完成
-                        image_record.status = 'completed'
-                        image_record.save()
-
-                        # 返回结果页面
-                        context = {
-                            'original_image': saved_filename,
-                            'results': save_results,
-                            'image_id': image_record.id,
-                            'filename': uploaded_file.name,
-                            'MEDIA_URL': settings.MEDIA_URL
-                        }
-                        return render(request, 'result.html', context)
-                    else:
-                        error_msg = f"API返回格式错误: {result}"
-                        logger.error(error_msg)
-                        image_record.status = 'failed'
-                        image_record.error_message = error_msg[:500]
-                        image_record.save()
-                        return JsonResponse({'error': 'API返回数据格式不正确'}, status=500)
-                else:
-                    error_msg = f"API请求失败: {response.status_code}"
-                    logger.error(error_msg)
-                    image_record.status = 'failed'
-                    image_record.error_message = error_msg[:500]
-                    image_record.save()
-                    return JsonResponse({
-                        'error': f'API请求失败 (状态码: {response.status_code})',
-                        'details': response.text[:200] if response.text else ''
-                    }, status=500)
-
-            except requests.exceptions.Timeout:
-                error_msg = 'API请求超时，请稍后重试'
-                logger.error(error_msg)
-                image_record.status = 'failed'
-                image_record.error_message = error_msg
-                image_record.save()
-                return JsonResponse({'error': error_msg}, status=504)
-            except requests.exceptions.RequestException as e:
-                error_msg = f'网络请求错误: {str(e)}'
-                logger.error(error_msg)
-                image_record.status = 'failed'
-                image_record.error_message = error_msg[:500]
-                image_record.save()
-                return JsonResponse({'error': error_msg}, status=500)
+        # 按 near_duplicate 模式提示或复用近似图片的已有结果
+        response, perceptual_hash = check_near_duplicate(request, uploaded_file)
+        if response is not None:
+            return response
 
-        except Exception as e:
-            error_msg = f'处理错误: {str(e)}'
-            logger.error(f"Error processing file: {error_msg}", exc_info=True)
-            image_record.status = 'failed'
-            image_record.error_message = error_msg[:500]
-            image_record.save()
-            return JsonResponse({'error': error_msg}, status=500)
+        # 增量模式：立即返回，解析在后台进行，进度通过 upload_events / upload_progress 获取
+        if request.POST.get('mode') == 'stream':
+            return start_upload(request, uploaded_file, perceptual_hash)
+
+        # 解析名额已满时直接返回429，不保存文件
+        try:
+            with parser_slot():
+                # 保存文件并创建ImageUpload记录
+                image_record = create_image_record(request, uploaded_file, perceptual_hash=perceptual_hash)
+
+                with leases.hold(image_record.id):
+                    try:
+                        save_results = parse_record(image_record)
+                    except UploadFailed as e:
+                        return e.response()
+                    except Exception as e:
+                        return fail_processing(image_record, e)
+        except ParserBusy as e:
+            return e.response()
+
+        return render_upload_result(request, image_record, save_results)
 
     except Exception as e:
         logger.error(f"Unexpected error in upload_image: {str(e)}", exc_info=True)
         return JsonResponse({'error': f'服务器内部错误: {str(e)}'}, status=500)
 
 
+def upload_events(request, record_id):
+    """上传进度（Server-Sent Events）"""
+    if not can_access_record_id(request, record_id):
+        return record_not_found()
+    return sse_response(request, record_id)
+
+
+def upload_progress(request, record_id):
+    """上传进度（长轮询，SSE不可用时使用）"""
+    if not can_access_record_id(request, record_id):
+        return record_not_found()
+    return long_poll(request, record_id)
+
+
 def api_parse(request):
-    """API接口（用于AJAX调用）"""
+    """API接口（用于AJAX调用）；旧接口，不保存上传与结果，新客户端使用 /api/v1/（见 api.py）"""
     if request.method == 'POST':
         # 这里可以处理JSON格式的请求
         data = json.loads(request.body)
@@ -544,36 +418,94 @@ def api_parse(request):
         if not image_data:
             return JsonResponse({'error': '没有图片数据'}, status=400)
 
-        payload = {
+        body = json.dumps({
             "file": image_data,
             "fileType": 1,
-        }
+        }).encode('ascii')
 
         try:
-            response = requests.post(API_URL, json=payload, timeout=30)
-            return JsonResponse(response.json())
+            with parser_slot():
+                response = parser_client.post(body, timeout=30)
+            return JsonResponse(json.loads(response.content))
+        except ParserBusy as e:
+            return e.response()
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': '只支持POST请求'}, status=400)
 
 
+def record_file(request, record_id, path):
+    """记录的媒体文件（鉴权后交给nginx发送，开发环境直接返回）"""
+    record = get_object_or_404(ImageUpload, id=record_id)
+    if not can_access_record(request, record):
+        return JsonResponse({'error': '无权访问该文件'}, status=403)
+
+    media = RecordMedia(record)
+    name = media.resolve(path)
+    if name is None:
+        raise Http404('文件不存在')
+    storage = media.storage
+    if record.archived_at and name != record.image.name:
+        # 已归档记录的结果文件从还原缓存下发
+        found = retention.rehydrated_file(record, path)
+        if found is None:
+            raise Http404('文件不存在')
+        storage, name = found
+    elif not storage.exists(name):
+        raise Http404('文件不存在')
+
+    as_attachment = 'download' in request.GET
+    return media_file_response(request, storage, name, posixpath.basename(name), as_attachment)
+
+
+def parser_file(request, token, filename):
+    """解析服务通过签名地址下载记录的原始图片（LAYOUT_PARSING_FILE_MODE=url）"""
+    record_id = parser_file_record_id(token)
+    if record_id is None:
+        return JsonResponse({'error': '链接无效或已过期'}, status=403)
+    record = get_object_or_404(ImageUpload, id=record_id)
+    storage, name = RecordMedia(record).storage, record.image.name
+    if posixpath.basename(name) != filename or not storage.exists(name):
+        raise Http404('文件不存在')
+    return media_file_response(request, storage, name, filename)
+
+
+@result_detail_condition
 def result_detail(request, image_id, result_index):
     """查看详细结果"""
-    try:
-        parse_result = ParseResult.objects.get(
+    updated_at = record_stamp(request, image_id)
+    if updated_at is None:
+        return JsonResponse({'error': '结果不存在'}, status=404)
+
+    cache_key = page_cache_key('result_detail', record_version(image_id, updated_at), result_index)
+
+    def build_context():
+        parse_result = ParseResult.objects.select_related('image').get(
             image_id=image_id,
             result_index=result_index
         )
-
-        context = {
+        media = RecordMedia(parse_result.image)
+        if parse_result.image.archived_at:
+            prepare_archived(parse_result.image)
+        output_images = parse_result.output_image_paths
+        return {
             'result': parse_result,
-            'original_image': parse_result.image.image.url if parse_result.image.image else '',
-            'doc_dir': parse_result.image.image.url.split('/')[-1],
-            'MEDIA_URL': f"{settings.MEDIA_URL}",
-            'det_img': parse_result.output_image_paths[0] if parse_result.output_image_paths[0] else '',
-            'order_img': parse_result.output_image_paths[1] if parse_result.output_image_paths[1] else '',
+            'original_image': media.image_url,
+            'markdown_base_url': media.markdown_base_url(result_index),
+            'det_img_url': media.output_image_url(output_images[0]) if len(output_images) > 0 else '',
+            'order_img_url': media.output_image_url(output_images[1]) if len(output_images) > 1 else '',
         }
-        return render(request, 'detail.html', context)
+
+    try:
+        return render_cached(request, cache_key, 'detail.html', build_context)
     except ParseResult.DoesNotExist:
-        return JsonResponse({'error': '结果不存在'}, status=404)
\ No newline at end of file
+        return JsonResponse({'error': '结果不存在'}, status=404)
+
+
+def metrics(request):
+    """Prometheus 指标（汇总所有 worker 进程）；设置了 METRICS_AUTH_TOKEN 时需要 Bearer 令牌"""
+    token = settings.METRICS_AUTH_TOKEN
+    if token and not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f"Bearer {token}"):
+        return HttpResponseForbidden()
+    return HttpResponse(app_metrics.collect(), content_type=CONTENT_TYPE_LATEST)